@@ -1,8 +1,10 @@
 # ----------------------------------------------------------------------------------------------
 
+import asyncio
 import json
 import random
 from spade.agent import Agent
+from misc.transport import LocalTransportMixin
 
 from order import DeliveryOrder
 from drone.parameters import DroneParameters
@@ -10,7 +12,11 @@ from misc.log import Logger
 from drone.behaviours import *
 from drone.utils import *
 from flask_socketio import SocketIO
-from misc.distance import haversine_distance, next_position
+from misc.clock import WallClock
+from drone.flight import FlightLeg
+from drone.planner import plain_orders, plan_orders, plan_warehouse, run_planner
+from warehouse.utils import InventoryDigest
+from misc.multiplex import HostAgent
 
 # ----------------------------------------------------------------------------------------------
 
@@ -25,7 +31,7 @@ INTERVAL_BETWEEN_TICKS = 0.030
 
 # ----------------------------------------------------------------------------------------------
 
-class DroneAgent(Agent):
+class DroneAgent(LocalTransportMixin, Agent):
     """
     DroneAgent class.
     Defines the drone agent that will be used in the simulation.
@@ -34,7 +40,9 @@ class DroneAgent(Agent):
         Agent (Agent): The base class for all agents in the system.
     """
     def __init__(self, drone_id, jid, password, initialPos, capacity, autonomy,
-                 velocity, warehouse_positions, socketio : SocketIO) -> None:
+                 velocity, warehouse_positions, socketio : SocketIO, clock = None,
+                 targeting : str = TARGET_ALL, nearest_warehouses : int = NEAREST_WAREHOUSES, fleet = None,
+                 log_file : str | None = None) -> None:
         super().__init__(jid, password)
         self.total_orders : list[DeliveryOrder] = [] 
         self.next_orders : list[DeliveryOrder] = []
@@ -47,6 +55,12 @@ class DroneAgent(Agent):
         self.max_deliverable_order : DeliveryOrder = None
 
         self.warehouse_positions : dict = warehouse_positions    
+        self.targeting : str = targeting # which warehouses are asked for orders, see `target_warehouses`
+        self.nearest_warehouses : int = nearest_warehouses
+        self.search_widening : int = 0 # times the search was widened since the last orders proposed
+        self.asked_warehouses : list[str] = [] # warehouses asked in the last search
+        self.digests : dict[str, InventoryDigest] = {} # latest inventory digest pushed by each warehouse
+        self.publishers : dict[str, str] = {} # jid of each warehouse pushing digests, told when the drone finishes
         self.distance_to_next_warehouse = 0.0
         self.available_order_sets : dict = {}
         self.orders_to_be_picked : dict[str, list[DeliveryOrder]] = {}
@@ -57,16 +71,21 @@ class DroneAgent(Agent):
         }
 
         self.params = DroneParameters(drone_id, capacity, autonomy, velocity)
-        self.logger = Logger(filename = drone_id)
+        self.logger = Logger(filename = log_file or drone_id, name = drone_id)
         self.socketio = socketio
         self.orders_to_visualize : list[DeliveryOrder] = []
 
         self.need_to_stop = False
 
         self.warehouses_responses = []
+        self.__conversations : int = 0 # replies are matched to their request by the thread of the conversation
 
         self.__distance_since_last_drop : float = 0.0
-        self.tick_rate = INTERVAL_BETWEEN_TICKS
+        self.clock = clock if clock is not None else WallClock() # flights are timed with it
+        self.leg : FlightLeg | None = None # flight in progress, if any
+        self.fleet = fleet # FleetKinematics that times the flights and emits the position, if any
+        if fleet is not None:
+            fleet.add(self)
 
         # Helper
         self.died_sucessfully : bool | None = None
@@ -76,7 +95,8 @@ class DroneAgent(Agent):
         Agent's setup method. It adds the IdleBehav behaviour.
         """
         self.logger.log(f"{self.params.id} - [SETUP]")
-        self.add_behaviour(EmitPositionBehaviour(period=INTERVAL_BETWEEN_TICKS))
+        if self.fleet is None:
+            self.add_behaviour(EmitPositionBehaviour(period=INTERVAL_BETWEEN_TICKS))
         fsm = FSMBehaviour()
         fsm.add_state(name=STATE_AVAILABLE, state=AvailableBehaviour(), initial=True)
         fsm.add_state(name=STATE_SUGGEST, state=OrderSuggestionsBehaviour())
@@ -86,8 +106,10 @@ class DroneAgent(Agent):
 
         # State transitions to normal states
         fsm.add_transition(source=STATE_AVAILABLE, dest=STATE_SUGGEST)
+        fsm.add_transition(source=STATE_AVAILABLE, dest=STATE_AVAILABLE)
         fsm.add_transition(source=STATE_SUGGEST, dest=STATE_PICKUP)
         fsm.add_transition(source=STATE_SUGGEST, dest=STATE_DELIVER)
+        fsm.add_transition(source=STATE_SUGGEST, dest=STATE_AVAILABLE)
         fsm.add_transition(source=STATE_PICKUP, dest=STATE_DELIVER)
         fsm.add_transition(source=STATE_PICKUP, dest=STATE_AVAILABLE)
         fsm.add_transition(source=STATE_DELIVER, dest=STATE_AVAILABLE)
@@ -98,7 +120,9 @@ class DroneAgent(Agent):
         fsm.add_transition(source=STATE_PICKUP, dest=STATE_DEAD)
         fsm.add_transition(source=STATE_DELIVER, dest=STATE_DEAD)
 
-        self.add_behaviour(fsm)
+        # Digests are only for the DigestBehaviour, the states never see them
+        self.add_behaviour(fsm, ~DigestBehaviour.template())
+        self.add_behaviour(DigestBehaviour(), DigestBehaviour.template())
 
     def __str__(self) -> str:
         return str(self.params)
@@ -113,20 +137,28 @@ class DroneAgent(Agent):
         
     # ----------------------------------------------------------------------------------------------
 
-    def get_current_metrics(self) -> dict:
+    def get_current_metrics(self, position : dict | None = None, flown : float | None = None) -> dict:
         """
         Method to get the current metrics of the drone.
 
+        Args:
+            position (dict | None, optional): The position, if already computed. Defaults to the current position.
+            flown (float | None, optional): The distance flown in the flight in progress, if already computed.
+
         Returns:
             dict: The current metrics of the drone.
         """
+        if position is None:
+            position = self.current_position()
+        if flown is None:
+            flown = self.leg.distance_at(self.clock.now()) if self.leg is not None else 0.0
         return {
             'id': self.params.id,
-            'latitude': self.position['latitude'],
-            'longitude': self.position['longitude'],
-            'distance': self.params.metrics_total_distance,
+            'latitude': position['latitude'],
+            'longitude': position['longitude'],
+            'distance': self.params.metrics_total_distance + flown,
             'capacity': round(self.params.curr_capacity * 100.0/self.params.max_capacity,2),
-            'autonomy': round(self.params.curr_autonomy * 100.0/self.params.max_autonomy,2),
+            'autonomy': round((self.params.curr_autonomy - flown) * 100.0/self.params.max_autonomy,2),
             'orders_delivered': self.params.orders_delivered,
             'type': 'drone'
         }
@@ -138,51 +170,55 @@ class DroneAgent(Agent):
         warehouse = self.warehouse_positions[self.next_warehouse]
         self.params.refill_autonomy(warehouse)
 
-    def update_position(self, target_latitude : float, target_longitude : float) -> None:
+    def current_position(self) -> dict:
+        """
+        Method to get the drone's position now, interpolated along the flight in progress if there is one.
+
+        Returns:
+            dict: The latitude and longitude of the drone.
+        """
+        if self.leg is None:
+            return self.position
+        return self.leg.position_at(self.clock.now())
+
+    def start_leg(self, target_latitude : float, target_longitude : float) -> FlightLeg:
         """
-        Method to update the drone's position.
-        Also updates the distance since the last drop and the autonomy.
+        Method to take off towards a target.
+        The length and arrival time of the flight are computed once, the drone has nothing to do until it ends.
 
         Args:
             target_latitude (float): The target latitude.
             target_longitude (float): The target longitude.
+
+        Returns:
+            FlightLeg: The flight, which ends at `end_time`.
         """
-        
-        self.logger.log("[TRAVELLING] - Distance to target: {} meters"\
-            .format(round(haversine_distance(
-                        self.position['latitude'], self.position['longitude'], 
-                        target_latitude, target_longitude), 2)))
-                
-        position, distance = next_position(
-            self.position['latitude'], self.position['longitude'],
-            target_latitude, target_longitude,
-            self.params.velocity * TIME_MULTIPLIER * self.tick_rate
+        self.leg = FlightLeg(
+            self.position,
+            {"latitude": target_latitude, "longitude": target_longitude},
+            self.params.velocity * TIME_MULTIPLIER,
+            self.clock.now(),
+            self.params.curr_autonomy
         )
-        
-        self.__distance_since_last_drop += distance
-        self.params.update_distance(distance)
-        
-        self.position = position
+        self.logger.log("[TRAVELLING] - Distance to target: {} meters".format(round(self.leg.length, 2)))
+        return self.leg
 
-    def arrived_at_next_order(self):
+    def end_leg(self) -> bool:
         """
-        Method to verify if the drone has arrived at the next order's destination.
-        
+        Method to land at the end of the flight in progress.
+        Updates the position, the distance since the last drop and the autonomy, once for the whole flight.
+
         Returns:
-            bool: True if the drone has arrived at the next order's destination, False otherwise.
+            bool: True if the drone reached its target, False if it ran out of battery on the way.
         """
-        return self.position["latitude"] == self.next_order.destination_position["latitude"] \
-           and self.position["longitude"] == self.next_order.destination_position["longitude"]
-           
-    def arrived_at_next_warehouse(self):
-        """
-        Method to verify if the drone has arrived at the next warehouse.
+        leg, self.leg = self.leg, None
+        distance = leg.length if leg.reachable else leg.distance_at(leg.end_time)
         
-        Returns:
-            bool: True if the drone has arrived at the next warehouse, False otherwise.
-        """
-        return self.position["latitude"] == self.warehouse_positions[self.next_warehouse]["latitude"] \
-           and self.position["longitude"] == self.warehouse_positions[self.next_warehouse]["longitude"]
+        self.__distance_since_last_drop += distance
+        self.params.update_distance(distance)
+        
+        self.position = leg.target if leg.reachable else leg.position_at(leg.end_time)
+        return leg.reachable
 
     def has_inventory(self) -> bool:
         """
@@ -227,7 +263,7 @@ class DroneAgent(Agent):
         Returns:
             tuple: The latitude and longitude of the next order.
         """
-        return self.next_order.destination_position['latitude'], self.next_order.destination_position['longitude']    
+        return self.next_order.dest_lat, self.next_order.dest_lon    
     
     # ----------------------------------------------------------------------------------------------
 
@@ -266,6 +302,53 @@ class DroneAgent(Agent):
         
         self.__distance_since_last_drop = 0.0
 
+    def deliver_next_order(self) -> None:
+        """
+        Method to deliver the next order once the drone is at its destination.
+        If it was the furthest order the autonomy allows, the drone will have to go to the closest warehouse next.
+        """
+        max_order = self.next_order is not None and self.next_order == self.max_deliverable_order
+
+        self.drop_order()    
+        if max_order:
+            self.required_warehouse = closest_warehouse(
+                self.position["latitude"],
+                self.position["longitude"],
+                self.warehouse_positions
+            )
+            
+        if len(self.warehouse_positions) == 0:
+            self.logger.log("[DELIVERING] - No warehouses left - Continuing to deliver orders...")
+
+    def prepare_deliveries(self) -> bool:
+        """
+        Method to plan the path through the orders the drone carries, once at the next warehouse.
+
+        Returns:
+            bool: True if there are orders to deliver, False otherwise.
+        """
+        if not self.next_orders:
+            return False
+        closest_order_next_warehouse = closest_order(
+            self.warehouse_positions[self.next_warehouse]["latitude"],
+            self.warehouse_positions[self.next_warehouse]["longitude"],
+            self.next_orders
+        )
+        self.next_order = closest_order_next_warehouse
+        self.next_orders = generate_path(self.next_orders, closest_order_next_warehouse)
+        self.tasks_in_range()
+        return True
+
+    def finish(self) -> None:
+        """
+        Method to log and store the final metrics of the drone.
+        """
+        self.need_to_stop = True
+        orders_id = [order.id for order in self.total_orders]
+        
+        self.logger.log(self.params.metrics(orders_id=orders_id))
+        self.params.store_results()
+
     # ----------------------------------------------------------------------------------------------
     
     def tasks_in_range(self) -> None:
@@ -280,21 +363,23 @@ class DroneAgent(Agent):
         current_position = self.position
         
         for order in self.next_orders:
-            distance_max_order += haversine_distance(
+            distance_max_order += position_distance(
                 current_position['latitude'], 
                 current_position['longitude'],
-                order.destination_position['latitude'],
-                order.destination_position['longitude']
+                order.dest_lat,
+                order.dest_lon
             )
             current_position = order.destination_position
             closest_warehouse_to_order = closest_warehouse(
-                order.destination_position['latitude'],
-                order.destination_position['longitude'],
+                order.dest_lat,
+                order.dest_lon,
                 self.warehouse_positions
             )
-            distance_order_to_warehouse = haversine_distance(
-                order.destination_position['latitude'],
-                order.destination_position['longitude'],
+            if closest_warehouse_to_order is None:
+                break
+            distance_order_to_warehouse = position_distance(
+                order.dest_lat,
+                order.dest_lon,
                 self.warehouse_positions[closest_warehouse_to_order]['latitude'],
                 self.warehouse_positions[closest_warehouse_to_order]['longitude']
             )
@@ -309,6 +394,180 @@ class DroneAgent(Agent):
     
     # ----------------------------------------------------------------------------------------------
 
+    def warehouses_to_ask(self) -> list[str]:
+        """
+        Method to get the warehouses the drone asks for orders.
+
+        Returns:
+            list[str]: The ids of the warehouses, only the required one when autonomy is running out.
+        """
+        if self.required_warehouse is None:
+            warehouses = target_warehouses(
+                self.position["latitude"],
+                self.position["longitude"],
+                self.warehouse_positions,
+                self.targeting,
+                self.nearest_warehouses,
+                self.params.curr_autonomy,
+                self.search_widening
+            )
+            for warehouse in warehouses:
+                if warehouse in self.digests and self.digests[warehouse].remaining == 0:
+                    # Same as a refusal, without asking
+                    self.logger.log(f"[DIGEST] - {warehouse} has no orders left")
+                    self.remove_warehouse(warehouse)
+            warehouses = [warehouse for warehouse in warehouses if warehouse in self.warehouse_positions]
+            # A digest may be out of date, so the warehouses are all asked rather than none
+            worth = [warehouse for warehouse in warehouses if self.worth_asking(warehouse)]
+            if worth and len(worth) < len(warehouses):
+                self.logger.log(f"[DIGEST] - Skipping {[warehouse for warehouse in warehouses if warehouse not in worth]}")
+            self.asked_warehouses = worth or warehouses
+        else:
+            self.asked_warehouses = [self.required_warehouse]
+        return self.asked_warehouses
+
+    def update_digest(self, digest : InventoryDigest) -> None:
+        """
+        Method to keep the digest a warehouse pushed, unless a newer one was already received.
+
+        Args:
+            digest (InventoryDigest): The digest.
+        """
+        known = self.digests.get(digest.warehouse)
+        if known is None or digest.version > known.version:
+            self.digests[digest.warehouse] = digest
+
+    def worth_asking(self, warehouse_id : str) -> bool:
+        """
+        Method to check, from its last digest, whether a warehouse may have orders for the drone.
+        Warehouses that pushed no digest are always worth asking.
+
+        Args:
+            warehouse_id (str): The id of the warehouse.
+
+        Returns:
+            bool: False if every order is reserved, too heavy for the free capacity, or out of reach of a full battery.
+        """
+        digest = self.digests.get(warehouse_id)
+        if digest is None:
+            return True
+        position = self.warehouse_positions[warehouse_id]
+        return digest.available > 0 \
+            and digest.min_weight <= self.params.max_capacity - self.params.curr_capacity \
+            and digest.reach(position["latitude"], position["longitude"]) <= self.params.max_autonomy
+
+    def widen_search(self) -> bool:
+        """
+        Method to ask warehouses further away next time, when the ones asked proposed no orders.
+
+        Returns:
+            bool: True if some warehouses were left out of the last search, False if every one worth asking was asked.
+        """
+        if self.required_warehouse is not None or all(
+            warehouse in self.asked_warehouses or not self.worth_asking(warehouse) for warehouse in self.warehouse_positions
+        ):
+            return False
+        self.search_widening += 1
+        self.logger.log(f"[TARGETING] - No orders proposed nearby - widening the search ({self.search_widening})")
+        return True
+
+    def new_thread(self) -> str:
+        """
+        Method to start a conversation with the warehouses. Their replies carry the same thread,
+        so that late replies to an earlier conversation can be told apart.
+
+        Returns:
+            str: The thread of the conversation, unique to the drone.
+        """
+        self.__conversations += 1
+        return f"{self.params.id}-{self.__conversations}"
+
+    def handle_proposal(self, sender : str, orders : list[DeliveryOrder]) -> None:
+        """
+        Method to plan the best set of orders among the ones a warehouse proposed.
+
+        Args:
+            sender (str): The id of the warehouse.
+            orders (list[DeliveryOrder]): The orders it proposed.
+        """
+        self.__log_proposal(sender, orders)
+        indexes, planner_stats = plan_orders(plain_orders(orders), *self.__planning_args(sender))
+        self.__store_plan(sender, orders, indexes, planner_stats)
+
+    async def plan_proposals(self, proposals : dict[str, list[DeliveryOrder]]) -> None:
+        """
+        Method to plan the best set of orders among the ones of each warehouse, like `handle_proposal`,
+        on the planner of the process. The proposals are planned at the same time, and the event loop
+        keeps serving the other agents meanwhile unless the planner is inline.
+
+        Args:
+            proposals (dict[str, list[DeliveryOrder]]): The orders each warehouse proposed.
+        """
+        for sender, orders in proposals.items():
+            self.__log_proposal(sender, orders)
+        loop_stats = {sender: {} for sender in proposals}
+        plans = await asyncio.gather(*(
+            run_planner(plan_orders, plain_orders(orders), *self.__planning_args(sender), stats=loop_stats[sender])
+            for sender, orders in proposals.items()
+        ))
+        for (sender, orders), (indexes, planner_stats) in zip(proposals.items(), plans):
+            self.__store_plan(sender, orders, indexes, {**planner_stats, **loop_stats[sender]})
+
+    def __log_proposal(self, sender : str, orders : list[DeliveryOrder]) -> None:
+        self.logger.log(f"[PROPOSED] - {sender}")
+        self.logger.log(f"PROPOSED ORDERS: {orders}")
+        self.logger.log(f"CURR CAPACITY: {self.params.max_capacity - self.params.curr_capacity}")
+
+    def __planning_args(self, sender : str) -> tuple[float, float, int, float]:
+        # Plain values only, so they can be sent to a planner process
+        return (
+            self.warehouse_positions[sender]["latitude"],
+            self.warehouse_positions[sender]["longitude"],
+            self.params.max_capacity - self.params.curr_capacity,
+            self.params.max_autonomy
+        )
+
+    def __store_plan(self, sender : str, orders : list[DeliveryOrder], indexes : list[int] | None, planner_stats : dict) -> None:
+        self.available_order_sets[sender] = None if indexes is None else [orders[i] for i in indexes]
+        self.logger.log(f"[PLANNER] - {sender} - {planner_stats}")
+        if self.available_order_sets[sender]:
+            self.search_widening = 0
+
+    def handle_refusal(self, sender : str) -> None:
+        """
+        Method to forget a warehouse that has no orders left.
+
+        Args:
+            sender (str): The id of the warehouse.
+        """
+        self.logger.log(f"[REFUSED] - {sender}")
+        self.remove_warehouse(sender)
+
+    def choose_orders(self) -> tuple[None|str, list[DeliveryOrder]]:
+        """
+        Method to choose the warehouse and orders to pick up among the available order sets.
+
+        Returns:
+            tuple[None|str, list[DeliveryOrder]]: The warehouse id and the list of orders to pick up.
+        """
+        if self.required_warehouse is None:
+            return self.best_orders()
+        return self.required_warehouse, self.available_order_sets[self.required_warehouse]
+
+    async def plan_choice(self) -> tuple[None|str, list[DeliveryOrder]]:
+        """
+        Method to choose the warehouse and orders to pick up like `choose_orders`, on the planner of the process.
+
+        Returns:
+            tuple[None|str, list[DeliveryOrder]]: The warehouse id and the list of orders to pick up.
+        """
+        if self.required_warehouse is not None:
+            return self.required_warehouse, self.available_order_sets[self.required_warehouse]
+        stats = {}
+        winner = await run_planner(plan_warehouse, *self.__choice_args(), stats=stats)
+        self.logger.log(f"[PLANNER] - choice - {stats}")
+        return (winner, self.available_order_sets[winner] if winner else [])
+
     def best_orders(self) -> tuple[None|str, list[DeliveryOrder]]:
         """
         Method to select the best orders for the drone from the available warehouses.
@@ -316,57 +575,23 @@ class DroneAgent(Agent):
         Returns:
             tuple[None|str, list[DeliveryOrder]]: The warehouse id and the list of orders to pick up.
         """
-        winner : str | None = None
-        drone_utility = float('-inf')
-        
-        if self.next_orders:
-            orders = self.next_orders
-            closest = closest_order(self.position["latitude"], self.position["longitude"], orders)
-            distance_closest_order = haversine_distance(
-                self.position["latitude"], 
-                self.position["longitude"], 
-                closest.destination_position['latitude'], 
-                closest.destination_position['longitude']
-            )
-            path = generate_path(orders, closest)
-            travel_distance = distance_closest_order + calculate_travel_distance(path)
-                
-            capacity_level = calculate_capacity_level(orders, self.params.max_capacity - self.params.curr_capacity)
-            drone_utility = utility(len(orders), travel_distance, self.params.curr_autonomy, capacity_level)
-        
-        for warehouse, orders in self.available_order_sets.items():
-            if orders is None:
-                continue
-            new_orders = orders.copy()
-            if self.next_orders:
-                new_orders += self.next_orders
-            distance_warehouse = haversine_distance(
-                self.position["latitude"], 
-                self.position["longitude"], 
-                self.warehouse_positions[warehouse]['latitude'], 
-                self.warehouse_positions[warehouse]['longitude']
-            )
-            closest_to_warehouse = closest_order(
-                self.warehouse_positions[warehouse]['latitude'], 
-                self.warehouse_positions[warehouse]['longitude'], 
-                new_orders
-            )
-            distance_warehouse_to_closest_order = haversine_distance(
-                self.warehouse_positions[warehouse]['latitude'], 
-                self.warehouse_positions[warehouse]['longitude'], 
-                closest_to_warehouse.destination_position['latitude'], 
-                closest_to_warehouse.destination_position['longitude']
-            )
-            path = generate_path(new_orders, closest_to_warehouse)
-            travel_distance = distance_warehouse + distance_warehouse_to_closest_order + calculate_travel_distance(path)
-            capacity_level = calculate_capacity_level(new_orders, self.params.max_capacity - self.params.curr_capacity)
-            new_utility = utility(len(new_orders), travel_distance, self.params.max_autonomy, capacity_level)
-                
-            if new_utility >= drone_utility:
-                winner = warehouse
-                drone_utility = new_utility
-                
+        winner = plan_warehouse(*self.__choice_args())
         return (winner, self.available_order_sets[winner] if winner else [])
+
+    def __choice_args(self) -> tuple:
+        # Plain values only, so they can be sent to a planner process
+        candidates = [
+            (warehouse, self.warehouse_positions[warehouse]["latitude"], self.warehouse_positions[warehouse]["longitude"], plain_orders(orders))
+            for warehouse, orders in self.available_order_sets.items() if orders is not None
+        ]
+        return (
+            (self.position["latitude"], self.position["longitude"]),
+            plain_orders(self.next_orders),
+            candidates,
+            self.params.max_capacity - self.params.curr_capacity,
+            self.params.curr_autonomy,
+            self.params.max_autonomy
+        )
     
     def suboptimal_orders(self) -> tuple[None|str, list[DeliveryOrder]]:
         """
@@ -382,3 +607,21 @@ class DroneAgent(Agent):
         return warehouse, self.available_order_sets[warehouse]
         
 # ----------------------------------------------------------------------------------------------
+
+class FleetAgent(HostAgent):
+    """
+    Hosts many drones over a single connection, see `misc.multiplex.HostAgent`. Each drone keeps its own
+    state machine, from `AvailableBehaviour` to `DeadBehaviour`, and warehouses address it by its own jid
+    as if it connected itself.
+
+    Args:
+        id (str): The id of the fleet, also the name of its log file.
+        jid (str): The jid of the fleet, the only one that connects.
+        password (str): The password of the jid.
+        drones (list[DroneAgent]): The drones it hosts.
+    """
+    def __init__(self, id : str, jid : str, password : str, drones : list[DroneAgent]) -> None:
+        super().__init__(id, jid, password, drones)
+        self.drones : list[DroneAgent] = drones
+
+# ----------------------------------------------------------------------------------------------
@@ -1,12 +1,14 @@
 # ----------------------------------------------------------------------------------------------
 
 import asyncio
-from spade.behaviour import PeriodicBehaviour, FSMBehaviour, State
+from spade.behaviour import CyclicBehaviour, PeriodicBehaviour, FSMBehaviour, State
 from spade.message import Message
-import json
+from spade.template import Template
 
 from order import DeliveryOrder
 from drone.utils import *
+from misc.codec import METADATA_CODEC, codec_for, current_codec
+from warehouse.utils import InventoryDigest
 
 # ----------------------------------------------------------------------------------------------
 
@@ -22,6 +24,8 @@ SUGGEST_ORDER = "suggest"
 DECIDE = "decide"
 PICKUP = "pickup_orders"
 RECHARGE_DRONE = "recharge"
+DIGEST = "digest"
+UNSUBSCRIBE = "unsubscribe"
 
 METADATA_NEXT_BEHAVIOUR = "next_behaviour"
 
@@ -33,8 +37,63 @@ STATE_PICKUP = "pickup"
 STATE_DELIVER = "deliver"
 STATE_DEAD = "dead"
 
-TRIES = 3
-TIMEOUT = 5.0
+TIMEOUT = 5.0 # seconds the replies of a conversation are awaited for, all together
+TRIES = 3 # rounds in a row without any reply before the drone gives up
+
+# ----------------------------------------------------------------------------------------------
+
+async def fly(agent, latitude : float, longitude : float) -> bool:
+    '''
+    Fly the drone to a position, sleeping until the flight ends instead of stepping it tick by tick.
+    With a fleet kinematics service, the service wakes the drone up when it arrives instead.
+    
+    Args:
+        agent (DroneAgent): The drone
+        latitude (float): Target latitude
+        longitude (float): Target longitude
+        
+    Returns:
+        bool: True if the drone arrived, False if it ran out of battery on the way
+    '''
+    leg = agent.start_leg(latitude, longitude)
+    if agent.fleet is not None:
+        await agent.fleet.take_off(agent, leg)
+    else:
+        await asyncio.sleep(max(leg.end_time - agent.clock.now(), 0.0))
+    return agent.end_leg()
+
+async def gather_replies(state : State, thread : str, senders : list[str], timeout : float = TIMEOUT) -> dict[str, Message]:
+    '''
+    Receive the replies of a conversation, until every sender answered or the timeout runs out
+    
+    Messages of other threads are late replies to earlier conversations, they are dropped.
+    
+    Args:
+        state (State): The state receiving the replies
+        thread (str): The thread of the conversation
+        senders (list[str]): The ids of the agents expected to reply
+        timeout (float, optional): Seconds to wait for all the replies. Defaults to TIMEOUT.
+        
+    Returns:
+        dict[str, Message]: The replies received, by sender. Senders that missed the timeout are left out.
+    '''
+    deadline = asyncio.get_running_loop().time() + timeout
+    pending = set(senders)
+    replies : dict[str, Message] = {}
+    while pending:
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            break
+        reply = await state.receive(timeout=remaining)
+        if reply is None:
+            break
+        sender = str(reply.sender).split("@")[0]
+        if reply.thread != thread or sender not in pending:
+            state.agent.logger.log(f"[STALE] - Dropped a late reply from {sender} - {reply.metadata.get('performative')}")
+            continue
+        pending.discard(sender)
+        replies[sender] = reply
+    return replies
 
 # ----------------------------------------------------------------------------------------------
 
@@ -50,11 +109,7 @@ class FSMBehaviour(FSMBehaviour):
 
     async def on_end(self):
         self.agent.logger.log(f"FSM finished at state {self.current_state}")
-        self.agent.need_to_stop = True
-        orders_id = [order.id for order in self.agent.total_orders]
-        
-        self.agent.logger.log(self.agent.params.metrics(orders_id=orders_id))
-        self.agent.params.store_results()
+        self.agent.finish()
 
 # ----------------------------------------------------------------------------------------------
 
@@ -65,37 +120,38 @@ class AvailableBehaviour(State):
     Args:
         State (State): Base class for states
     '''
-    async def run(self):
-        self.agent.warehouses_responses = []
-        
-        warehouses = []
-        if self.agent.required_warehouse is None:
-            warehouses = self.agent.warehouse_positions.keys()
-        else:
-            warehouses = [self.agent.required_warehouse]
+    def __init__(self):
+        super().__init__()
+        self.silent_rounds : int = 0 # rounds in a row no warehouse replied to
         
+    async def run(self):
+        # Ask every warehouse at once and wait for their replies together
+        warehouses = self.agent.warehouses_to_ask()
+        thread = self.agent.new_thread()
         for warehouse in warehouses:
             message = Message()
             message.to = warehouse + "@localhost"
+            message.thread = thread
             message.body = self.agent.__repr__()
             message.set_metadata("performative", "request")
             message.set_metadata(METADATA_NEXT_BEHAVIOUR, SUGGEST_ORDER)
-            response = None
-            
-            for _ in range(TRIES):
-                await self.send(message)
-                response = await self.receive(timeout=TIMEOUT)
-                if response is not None:
-                    self.agent.warehouses_responses.append(response)
-                    break
-                else:
-                    self.agent.logger.log(f"[ERROR] - No response from warehouse {warehouse}, trying again...")
-                    
-            if response is None:
-                self.agent.logger.log(f"[ERROR] - No response from warehouse {warehouse} - {warehouse in self.agent.warehouse_positions.keys()}")
-                self.agent.died_successfully = False
-                self.set_next_state(STATE_DEAD)
+            message.set_metadata(METADATA_CODEC, current_codec().name)
+            await self.send(message)
+        
+        replies = await gather_replies(self, thread, warehouses)
+        for warehouse in warehouses:
+            if warehouse not in replies:
+                # Its reservations, if it made any, expire on their own
+                self.agent.logger.log(f"[ERROR] - No response from warehouse {warehouse} - skipped this round")
+        self.agent.warehouses_responses = [replies[warehouse] for warehouse in warehouses if warehouse in replies]
+        
+        if warehouses and not replies and not self.agent.has_inventory():
+            self.silent_rounds += 1
+            if self.silent_rounds < TRIES:
+                self.agent.logger.log("[ERROR] - No warehouse responded, trying again...")
+                self.set_next_state(STATE_AVAILABLE)
                 return
+        self.silent_rounds = 0
         self.set_next_state(STATE_SUGGEST)
 
 # ----------------------------------------------------------------------------------------------
@@ -114,20 +170,30 @@ class OrderSuggestionsBehaviour(State):
             self.agent.logger.log("[WARN] - No responses from warehouses - Delivering remaining orders...")
             self.set_next_state(STATE_DELIVER)
             return
+        if not responses and not self.agent.warehouse_positions:
+            self.agent.logger.log("[FINISH] - No warehouses left")
+            self.agent.died_successfully = True
+            self.set_next_state(STATE_DEAD)
+            return
         if not responses:
             self.agent.logger.log("[ERROR] - No responses from warehouses")
             self.agent.died_successfully = False
             self.set_next_state(STATE_DEAD)
             return
         
+        proposals = {}
         for response in responses:
             performative = response.metadata.get("performative")
             sender = str(response.sender).split("@")[0]
             if performative == "propose":
-                self._handle_proposal(response, sender)
+                proposals[sender] = self._decode_proposal(response)
             elif performative == "refuse":
                 self._handle_refusal(sender)
-        if self.agent.available_order_sets:
+        await self.agent.plan_proposals(proposals)
+        if not any(self.agent.available_order_sets.values()) and self.agent.widen_search():
+            await self._send_proposal_rejected(list(self.agent.available_order_sets.keys()))
+            self.set_next_state(STATE_AVAILABLE)
+        elif self.agent.available_order_sets:
             await self._process_available_orders()
         elif self.agent.has_inventory():
             self.agent.logger.log("[ORDER SUGGESTION] - No available orders - Delivering remaining orders...")
@@ -137,26 +203,14 @@ class OrderSuggestionsBehaviour(State):
             self.agent.died_successfully = True
             self.set_next_state(STATE_DEAD)
     
-    def _handle_proposal(self, response : Message, sender : str):
+    def _decode_proposal(self, response : Message) -> list[DeliveryOrder]:
         '''
-        Handle the proposal response from the warehouse
+        Decode the orders of the proposal response from the warehouse
         
         Args:
             response (Message): The response message from the warehouse
-            sender (str): The id of the warehouse
         '''
-        self.agent.logger.log(f"[PROPOSED] - {sender}")
-        proposed_orders = json.loads(response.body)
-        orders = [DeliveryOrder(**json.loads(order)) for order in proposed_orders]
-        self.agent.logger.log(f"PROPOSED ORDERS: {orders}")
-        self.agent.logger.log(f"CURR CAPACITY: {self.agent.params.max_capacity - self.agent.params.curr_capacity}")
-        self.agent.available_order_sets[sender] = best_available_orders(
-            orders,
-            self.agent.warehouse_positions[sender]["latitude"],
-            self.agent.warehouse_positions[sender]["longitude"],
-            self.agent.params.max_capacity - self.agent.params.curr_capacity,
-            self.agent.params.max_autonomy
-        )
+        return codec_for(response).decode_orders(response.body)
     
     def _handle_refusal(self, sender : str):
         '''
@@ -165,18 +219,13 @@ class OrderSuggestionsBehaviour(State):
         Args:
             sender (str): The id of the warehouse
         '''
-        self.agent.logger.log(f"[REFUSED] - {sender}")
-        self.agent.remove_warehouse(sender)
+        self.agent.handle_refusal(sender)
     
     async def _process_available_orders(self):
         '''
         Process the available orders and decide which orders to pick up
         '''
-        winner, orders = None, None
-        if self.agent.required_warehouse is None:
-            winner, orders = self.agent.best_orders()
-        else:
-            winner, orders = self.agent.required_warehouse, self.agent.available_order_sets[self.agent.required_warehouse]
+        winner, orders = await self.agent.plan_choice()
         
         if winner:
             await self._send_proposal_accepted(winner, orders)
@@ -200,7 +249,10 @@ class OrderSuggestionsBehaviour(State):
         message.to = winner + "@localhost"
         message.set_metadata(METADATA_NEXT_BEHAVIOUR, DECIDE)
         message.set_metadata("performative", "accept-proposal")
-        message.body = json.dumps([order.__repr__() for order in orders] if orders else [])
+        codec = current_codec()
+        message.set_metadata(METADATA_CODEC, codec.name)
+        message.body = codec.encode_ids([order.id for order in orders] if orders else [])
+        self.agent.logger.log(f"[CODEC] - {codec.name} - {len(message.body)} bytes for {len(orders) if orders else 0} orders to {winner}")
         await self.send(message)
         self.agent.logger.log(f"[DECIDED] - {winner} - {orders}")
         losers = [warehouse for warehouse in self.agent.available_order_sets.keys() if warehouse != winner]
@@ -231,17 +283,11 @@ class PickupOrdersBehaviour(State):
         State (State): Base class for states
     '''
     async def run(self):
-        while not self.agent.arrived_at_next_warehouse():
-            next_warehouse_lat, next_warehouse_lon = self.agent.get_next_warehouse_position()
-            self.agent.update_position(next_warehouse_lat, next_warehouse_lon)
-            
-            if self.agent.params.is_out_of_autonomy():
-                self.agent.logger.log("[ERROR] Drone out of battery") 
-                self.agent.died_successfully = False
-                self.set_next_state(STATE_DEAD)
-                return
-            
-            await asyncio.sleep(self.agent.tick_rate)
+        if not await fly(self.agent, *self.agent.get_next_warehouse_position()):
+            self.agent.logger.log("[ERROR] Drone out of battery") 
+            self.agent.died_successfully = False
+            self.set_next_state(STATE_DEAD)
+            return
 
         self.agent.recharge()
         if self.agent.orders_to_be_picked[self.agent.next_warehouse] is None:
@@ -252,10 +298,12 @@ class PickupOrdersBehaviour(State):
             message = Message()
             message.to = self.agent.next_warehouse + "@localhost"
             message.set_metadata(METADATA_NEXT_BEHAVIOUR, PICKUP)
-            message.body = json.dumps(orders_id)
+            message.set_metadata(METADATA_CODEC, current_codec().name)
+            message.body = current_codec().encode_ids(orders_id)
+            message.thread = self.agent.new_thread()
             await self.send(message)            
             
-            response = await self.receive(timeout=TIMEOUT)
+            response = (await gather_replies(self, message.thread, [self.agent.next_warehouse])).get(self.agent.next_warehouse)
             
             if response and response.metadata["performative"] == "confirm":
                 self.agent.logger.log("[PICKUP] - {} Orders picked up at {} - {}".format(len(orders_id), self.agent.next_warehouse, orders_id))
@@ -265,15 +313,10 @@ class PickupOrdersBehaviour(State):
                 
                 del self.agent.orders_to_be_picked[self.agent.next_warehouse]
                 
-                closest_order_next_warehouse = closest_order(
-                    self.agent.warehouse_positions[self.agent.next_warehouse]["latitude"],
-                    self.agent.warehouse_positions[self.agent.next_warehouse]["longitude"],
-                    self.agent.next_orders
-                )
-                
-                self.update_after_pickup(closest_order_next_warehouse)
+                self.agent.prepare_deliveries()
+                self.set_next_state(STATE_DELIVER)
             else:
-                self.agent.logger.log(f"[ERROR] - Orders not picked up - {response.metadata} - {orders_id}")
+                self.agent.logger.log(f"[ERROR] - Orders not picked up - {response.metadata if response else None} - {orders_id}")
                 self.agent.died_successfully = False
                 self.set_next_state(STATE_DEAD)
                 
@@ -281,27 +324,10 @@ class PickupOrdersBehaviour(State):
         '''
         Handle the case when there are no orders to pick up
         '''
-        if self.agent.next_orders:
-            closest_order_warehouse = closest_order(
-                self.agent.warehouse_positions[self.agent.next_warehouse]["latitude"],
-                self.agent.warehouse_positions[self.agent.next_warehouse]["longitude"],
-                self.agent.next_orders
-            )
-            self.update_after_pickup(closest_order_warehouse)
+        if self.agent.prepare_deliveries():
+            self.set_next_state(STATE_DELIVER)
         else:
             self.set_next_state(STATE_AVAILABLE)
-
-    def update_after_pickup(self, closest_order_next_warehouse : DeliveryOrder):
-        '''
-        Update the state after the orders have been picked up
-        
-        Args:
-            closest_order_next_warehouse (DeliveryOrder): The closest order to the next warehouse
-        '''
-        self.agent.next_order = closest_order_next_warehouse
-        self.agent.next_orders = generate_path(self.agent.next_orders, closest_order_next_warehouse)
-        self.agent.tasks_in_range()
-        self.set_next_state(STATE_DELIVER)
         
 # ----------------------------------------------------------------------------------------------
 
@@ -318,30 +344,13 @@ class DeliverOrdersBehaviour(State):
             self.set_next_state(STATE_AVAILABLE)
             return
         
-        while not self.agent.arrived_at_next_order():
-            next_order_lat, next_order_lon = self.agent.get_next_order_position()
-            self.agent.update_position(next_order_lat, next_order_lon)
-            
-            if self.agent.params.is_out_of_autonomy():
-                self.agent.logger.log("[ERROR] Drone out of battery") 
-                self.agent.died_successfully = False
-                self.set_next_state(STATE_DEAD)
-                return
-            
-            await asyncio.sleep(self.agent.tick_rate)
-            
-        max_order = self.agent.next_order is not None and self.agent.next_order == self.agent.max_deliverable_order
-
-        self.agent.drop_order()    
-        if max_order:
-            self.agent.required_warehouse = closest_warehouse(
-                self.agent.position["latitude"],
-                self.agent.position["longitude"],
-                self.agent.warehouse_positions
-            )
+        if not await fly(self.agent, *self.agent.get_next_order_position()):
+            self.agent.logger.log("[ERROR] Drone out of battery") 
+            self.agent.died_successfully = False
+            self.set_next_state(STATE_DEAD)
+            return
             
-        if len(self.agent.warehouse_positions) == 0:
-            self.agent.logger.log("[DELIVERING] - No warehouses left - Continuing to deliver orders...")
+        self.agent.deliver_next_order()
         
         # even if there are no warehouses left, the drone will be sent to the available state
         # there, it will check if there are any orders left to deliver and come back to this state
@@ -361,6 +370,13 @@ class DeadBehaviour(State):
             self.agent.logger.log("[DEAD BEHAVIOUR] - Drone successfully completed its mission.")
         else:
             self.agent.logger.log("[DEAD BEHAVIOUR] - Something went wrong.")
+        
+        # Warehouses pushing digests stop sending them
+        for warehouse_jid in self.agent.publishers.values():
+            message = Message(to=warehouse_jid)
+            message.set_metadata("performative", "inform")
+            message.set_metadata(METADATA_NEXT_BEHAVIOUR, UNSUBSCRIBE)
+            await self.send(message)
 
 # ----------------------------------------------------------------------------------------------
 
@@ -382,3 +398,23 @@ class EmitPositionBehaviour(PeriodicBehaviour):
             await self.agent.stop()
             
 # ----------------------------------------------------------------------------------------------
+
+class DigestBehaviour(CyclicBehaviour):
+    '''
+    Keep the inventory digests the warehouses push, for the drone to skip warehouses that have nothing for it
+    
+    Args:
+        CyclicBehaviour (CyclicBehaviour): Base class for cyclic behaviours
+    '''
+    async def run(self):
+        message = await self.receive(timeout=TIMEOUT)
+        if message is not None:
+            digest = InventoryDigest.decode(message.body)
+            self.agent.publishers[digest.warehouse] = str(message.sender)
+            self.agent.update_digest(digest)
+            
+    @staticmethod
+    def template() -> Template:
+        return Template(metadata={METADATA_NEXT_BEHAVIOUR: DIGEST})
+
+# ----------------------------------------------------------------------------------------------
@@ -0,0 +1,173 @@
+# ----------------------------------------------------------------------------------------------
+
+import asyncio
+import numpy as np
+
+from drone.flight import FlightLeg
+from misc.clock import WallClock
+
+# ----------------------------------------------------------------------------------------------
+
+FLEET_TICK = 0.030 # seconds between two emissions of the fleet's positions, as EmitPositionBehaviour
+INITIAL_SLOTS = 64 # drones the arrays hold before they grow
+
+# Columns of the flights array
+START_LAT, START_LON, TARGET_LAT, TARGET_LON, START_TIME, END_TIME, SPEED, LENGTH = range(8)
+COLUMNS = 8
+
+# ----------------------------------------------------------------------------------------------
+
+class FleetKinematics:
+    """
+    Tracks the flights of the whole fleet in NumPy arrays, instead of every drone timing its own
+    flight and emitting its own position.
+
+    A drone hands its `FlightLeg` over with `take_off` and waits on the future it gets back. A single
+    task then wakes up once per tick, or sooner if a flight ends before the tick, interpolates the
+    position of every drone in one vectorised step, emits them in one message and resolves the futures
+    of the drones that arrived. Only those drones are woken up, so the scheduling work per tick stays
+    the same however many drones fly.
+
+    Positions are interpolated like `FlightLeg.position_at`, from the take off to the end of the leg.
+
+    Example of usage:
+    ```py
+    fleet = FleetKinematics(socketio)
+    drones = [DroneAgent(..., fleet=fleet) for ...]
+    asyncio.create_task(fleet.run())
+    ```
+
+    Args:
+        socketio (SocketIO): Where the positions are emitted, None to emit nothing.
+        clock (optional): Clock the flights are timed with, the drones' clock. Defaults to WallClock().
+        tick (float, optional): Seconds between two emissions. Defaults to FLEET_TICK.
+
+    Attributes:
+        drones (list[DroneAgent]): The drones, the i-th drone's flight is in the i-th element of the arrays.
+        ticks (int): The number of steps run.
+        arrivals (int): The number of drones woken up at the end of a flight.
+    """
+    def __init__(self, socketio, clock = None, tick : float = FLEET_TICK) -> None:
+        self.socketio = socketio
+        self.clock = clock if clock is not None else WallClock()
+        self.tick : float = tick
+        self.drones : list = []
+        self.ticks : int = 0
+        self.arrivals : int = 0
+
+        self.__slots : dict[str, int] = {} # drone id -> row in the arrays
+        self.__futures : dict[int, asyncio.Future] = {} # row -> future of the flight in progress
+        self.__legs : np.ndarray = np.zeros((INITIAL_SLOTS, COLUMNS)) # the flight of each drone, by column
+        self.__legs[:, END_TIME] = np.inf
+        self.__flying : np.ndarray = np.zeros(INITIAL_SLOTS, dtype=bool)
+
+    # ----------------------------------------------------------------------------------------------
+
+    def add(self, drone) -> None:
+        """
+        Register a drone, before its first flight.
+        """
+        size = len(self.__flying)
+        if len(self.drones) == size:
+            legs = np.zeros((2 * size, COLUMNS))
+            legs[:, END_TIME] = np.inf
+            legs[:size] = self.__legs
+            flying = np.zeros(2 * size, dtype=bool)
+            flying[:size] = self.__flying
+            self.__legs, self.__flying = legs, flying
+        self.__slots[drone.params.id] = len(self.drones)
+        self.drones.append(drone)
+
+    def take_off(self, drone, leg : FlightLeg) -> asyncio.Future:
+        """
+        Start tracking the flight of a drone.
+
+        Args:
+            drone (DroneAgent): The drone, registered with `add`.
+            leg (FlightLeg): Its flight.
+
+        Returns:
+            asyncio.Future: Resolved once the flight ended, at `leg.end_time`.
+        """
+        i = self.__slots[drone.params.id]
+        self.__legs[i] = (
+            leg.start["latitude"], leg.start["longitude"],
+            leg.target["latitude"], leg.target["longitude"],
+            leg.start_time, leg.end_time, leg.speed, leg.length
+        )
+        self.__flying[i] = True
+        future = asyncio.get_running_loop().create_future()
+        self.__futures[i] = future
+        return future
+
+    def positions(self, now : float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Positions of every flying drone at the given time, in one vectorised step.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: The latitudes, the longitudes and the distance flown
+                since the take off, for every registered drone. Only meaningful where a drone is flying.
+        """
+        legs = self.__legs[:len(self.drones)]
+        start_times, lengths = legs[:, START_TIME], legs[:, LENGTH]
+        flown = np.minimum((np.clip(now, start_times, legs[:, END_TIME]) - start_times) * legs[:, SPEED], lengths)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fraction = np.where(lengths > 0, flown / lengths, 1.0)
+        latitudes = legs[:, START_LAT] + fraction * (legs[:, TARGET_LAT] - legs[:, START_LAT])
+        longitudes = legs[:, START_LON] + fraction * (legs[:, TARGET_LON] - legs[:, START_LON])
+        return latitudes, longitudes, flown
+
+    def step(self) -> list[int]:
+        """
+        Wake up the drones whose flight ended.
+
+        Returns:
+            list[int]: The indexes of the drones that arrived.
+        """
+        self.ticks += 1
+        count = len(self.drones)
+        arrived = np.flatnonzero(self.__flying[:count] & (self.__legs[:count, END_TIME] <= self.clock.now()))
+        for i in arrived:
+            self.__flying[i] = False
+            self.__legs[i, END_TIME] = np.inf
+            future = self.__futures.pop(i)
+            if not future.done():
+                future.set_result(True)
+        self.arrivals += len(arrived)
+        return arrived.tolist()
+
+    def emit(self) -> None:
+        """
+        Emit the metrics of every drone still running in one message, with the positions of the flying ones interpolated.
+        """
+        if self.socketio is None:
+            return
+        latitudes, longitudes, flown = self.positions(self.clock.now())
+        data = []
+        for i, drone in enumerate(self.drones):
+            if not drone.is_alive():
+                continue
+            data.extend(order.get_order_for_visualization() for order in drone.orders_to_visualize)
+            drone.orders_to_visualize = []
+            if self.__flying[i]:
+                data.append(drone.get_current_metrics({"latitude": latitudes[i], "longitude": longitudes[i]}, flown[i]))
+            else:
+                data.append(drone.get_current_metrics())
+        self.socketio.emit('update_data', data)
+
+    async def run(self) -> None:
+        """
+        Step and emit every tick, or sooner when a flight ends first, until every drone stopped.
+        """
+        while any(drone.is_alive() for drone in self.drones):
+            self.step()
+            self.emit()
+            for drone in self.drones:
+                if drone.need_to_stop and drone.is_alive():
+                    await drone.stop()
+
+            count = len(self.drones)
+            next_arrival = self.__legs[:count, END_TIME].min() if count else np.inf
+            await asyncio.sleep(max(min(self.tick, next_arrival - self.clock.now()), 0.0))
+
+# ----------------------------------------------------------------------------------------------
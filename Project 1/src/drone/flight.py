@@ -0,0 +1,66 @@
+# ----------------------------------------------------------------------------------------------
+
+from misc.distance import geo_distance
+
+# ----------------------------------------------------------------------------------------------
+
+class FlightLeg:
+    """
+    Straight flight of a drone from one position to another, computed once when the drone takes off.
+    The position at any time is interpolated instead of stepped tick by tick, and the arrival is known
+    in advance, so the drone can wait for it instead of checking every tick whether it got there.
+
+    Positions are interpolated linearly in latitude and longitude, like `misc.distance.next_position`.
+
+    Example of usage:
+    ```py
+    leg = FlightLeg(start, target, speed=20 * TIME_MULTIPLIER, start_time=clock.now(), autonomy=40_000)
+    leg.position_at(clock.now()) # where the drone is now
+    leg.end_time                 # when it lands, or runs out of battery if leg.reachable is False
+    ```
+
+    Args:
+        start (dict): The latitude and longitude the drone takes off from.
+        target (dict): The latitude and longitude it flies to.
+        speed (float): Meters covered per second of the clock the times are measured with.
+        start_time (float): The time of the take off.
+        autonomy (float): Meters the drone can still fly.
+
+    Attributes:
+        length (float): The length of the leg, in meters.
+        eta (float): The time the drone reaches the target, if its autonomy allows it.
+        reachable (bool): Whether the autonomy is enough to reach the target.
+        end_time (float): The time the leg ends: the eta, or the time the autonomy runs out.
+    """
+    __slots__ = ("start", "target", "speed", "start_time", "length", "eta", "reachable", "end_time")
+
+    def __init__(self, start : dict, target : dict, speed : float, start_time : float, autonomy : float) -> None:
+        self.start : dict = start
+        self.target : dict = target
+        self.speed : float = speed
+        self.start_time : float = start_time
+        self.length : float = geo_distance(start["latitude"], start["longitude"], target["latitude"], target["longitude"])
+        self.eta : float = start_time + self.length / speed
+        self.reachable : bool = self.length <= autonomy
+        self.end_time : float = self.eta if self.reachable else start_time + max(autonomy, 0.0) / speed
+
+    def distance_at(self, time : float) -> float:
+        """
+        Distance flown since the take off, in meters, at the given time.
+        """
+        elapsed = min(max(time, self.start_time), self.end_time) - self.start_time
+        return min(elapsed * self.speed, self.length)
+
+    def position_at(self, time : float) -> dict:
+        """
+        Position of the drone at the given time. The target itself once the drone arrived.
+        """
+        if self.length == 0.0 or (self.reachable and time >= self.eta):
+            return self.target
+        fraction = self.distance_at(time) / self.length
+        return {
+            "latitude": self.start["latitude"] + fraction * (self.target["latitude"] - self.start["latitude"]),
+            "longitude": self.start["longitude"] + fraction * (self.target["longitude"] - self.start["longitude"])
+        }
+
+# ----------------------------------------------------------------------------------------------
@@ -0,0 +1,312 @@
+# ----------------------------------------------------------------------------------------------
+
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from time import perf_counter
+
+from drone.utils import best_available_orders, closest_order, position_distance, generate_path, \
+    calculate_travel_distance, calculate_capacity_level, utility, SOLVER_TIME_BUDGET
+from misc.distance import current_projection, set_projection
+from misc.distance_matrix import shared_matrix, set_shared_matrix
+
+# ----------------------------------------------------------------------------------------------
+
+INLINE = "inline" # plan in the event loop, blocking every agent while it runs
+THREAD = "thread"
+PROCESS = "process"
+PLANNERS = (INLINE, THREAD, PROCESS)
+PLANNER_WORKERS = 4
+
+_kind = INLINE
+_executor : Executor | None = None
+_monitor : "LoopMonitor | None" = None
+
+# ----------------------------------------------------------------------------------------------
+
+class PlannedOrder:
+    """
+    The fields of an order the planning functions read, without the rest of the order table, so that
+    they can be sent to another process. Built from the plain tuples of `plain_orders`.
+    """
+    __slots__ = ("id", "dest_lat", "dest_lon", "weight")
+
+    def __init__(self, id : str, dest_lat : float, dest_lon : float, weight : int) -> None:
+        self.id : str = id
+        self.dest_lat : float = dest_lat
+        self.dest_lon : float = dest_lon
+        self.weight : int = weight
+
+def plain_orders(orders : list) -> list[tuple[str, float, float, int]]:
+    """
+    Get the id, destination and weight of each order, as plain tuples that can be pickled.
+    """
+    return [(order.id, order.dest_lat, order.dest_lon, order.weight) for order in orders]
+
+# ----------------------------------------------------------------------------------------------
+# Planning functions, run in the event loop or in the pool. Inputs and outputs are plain values.
+# ----------------------------------------------------------------------------------------------
+
+def plan_orders(orders : list[tuple], latitude : float, longitude : float, capacity : int, autonomy : float,
+                time_budget : float | None = SOLVER_TIME_BUDGET) -> tuple[list[int] | None, dict]:
+    """
+    Run `best_available_orders` on plain orders.
+
+    Returns:
+        tuple[list[int] | None, dict]: The indexes of the best set of orders, None if there is none, and the stats of the search.
+    """
+    planned = [PlannedOrder(*order) for order in orders]
+    stats = {}
+    best = best_available_orders(planned, latitude, longitude, capacity, autonomy, time_budget=time_budget, stats=stats)
+    if best is None:
+        return None, stats
+    index = {id(order): i for i, order in enumerate(planned)}
+    return [index[id(order)] for order in best], stats
+
+def plan_warehouse(position : tuple[float, float], next_orders : list[tuple], candidates : list[tuple[str, float, float, list[tuple]]],
+                   free_capacity : int, curr_autonomy : float, max_autonomy : float) -> str | None:
+    """
+    Choose the warehouse whose set of orders, on top of the orders the drone already carries, has the best utility.
+    Ties go to the later candidate.
+
+    Args:
+        position (tuple[float, float]): The latitude and longitude of the drone.
+        next_orders (list[tuple]): The plain orders the drone carries.
+        candidates (list[tuple[str, float, float, list[tuple]]]): The id, latitude, longitude and plain planned orders of each warehouse.
+        free_capacity (int): The capacity the drone has left.
+        curr_autonomy (float): The autonomy the drone has left.
+        max_autonomy (float): The autonomy of the drone once recharged at the warehouse.
+
+    Returns:
+        str | None: The id of the warehouse, None if delivering the orders carried is better.
+    """
+    latitude, longitude = position
+    carried = [PlannedOrder(*order) for order in next_orders]
+    winner : str | None = None
+    drone_utility = float('-inf')
+
+    if carried:
+        closest = closest_order(latitude, longitude, carried)
+        path = generate_path(carried, closest)
+        travel_distance = position_distance(latitude, longitude, closest.dest_lat, closest.dest_lon) + calculate_travel_distance(path)
+        drone_utility = utility(len(carried), travel_distance, curr_autonomy, calculate_capacity_level(carried, free_capacity))
+
+    for warehouse, warehouse_lat, warehouse_lon, orders in candidates:
+        new_orders = [PlannedOrder(*order) for order in orders] + carried
+        closest_to_warehouse = closest_order(warehouse_lat, warehouse_lon, new_orders)
+        path = generate_path(new_orders, closest_to_warehouse)
+        travel_distance = position_distance(latitude, longitude, warehouse_lat, warehouse_lon) \
+            + position_distance(warehouse_lat, warehouse_lon, closest_to_warehouse.dest_lat, closest_to_warehouse.dest_lon) \
+            + calculate_travel_distance(path)
+        new_utility = utility(len(new_orders), travel_distance, max_autonomy, calculate_capacity_level(new_orders, free_capacity))
+        if new_utility >= drone_utility:
+            winner = warehouse
+            drone_utility = new_utility
+
+    return winner
+
+# ----------------------------------------------------------------------------------------------
+
+def _init_worker(projection, matrix) -> None:
+    # Workers measure distances like the main process
+    set_projection(projection)
+    set_shared_matrix(matrix)
+
+def set_planner(kind : str, workers : int = PLANNER_WORKERS) -> None:
+    """
+    Choose where the drones of the process plan: in the event loop, in a thread pool or in a process pool.
+    With a process pool, the distance mode and matrix of the process are copied to the workers, so they
+    must be set before.
+
+    Args:
+        kind (str): One of PLANNERS.
+        workers (int, optional): Threads or processes of the pool. Defaults to PLANNER_WORKERS.
+    """
+    global _kind, _executor
+    if kind not in PLANNERS:
+        raise ValueError(f"Unknown planner {kind}, expected one of {PLANNERS}.")
+    shutdown_planner()
+    _kind = kind
+    if kind == THREAD:
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="planner")
+    elif kind == PROCESS:
+        _executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                        initargs=(current_projection(), shared_matrix()))
+
+def current_planner() -> str:
+    """
+    Get where the drones of the process plan.
+    """
+    return _kind
+
+def shutdown_planner() -> None:
+    """
+    Stop the pool of the planner, if any, and plan in the event loop again.
+    """
+    global _kind, _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+    _kind, _executor = INLINE, None
+
+async def run_planner(function, *args, stats : dict | None = None):
+    """
+    Run a planning function on the planner and wait for its result without blocking the event loop,
+    unless the planner is INLINE.
+
+    A pool doesn't free the event loop entirely: thread workers hold the GIL while they search, and
+    sending the inputs to process workers takes time too. So with a pool, the stall is read from the
+    `LoopMonitor` of the process (see `set_loop_monitor`), as its share of the loop's lag while the
+    function ran. Without a monitor, `blocked_ms` is left out.
+
+    Args:
+        function: One of the planning functions of this module.
+        stats (dict | None, optional): If given, `blocked_ms` is set to the milliseconds the event loop was blocked. Defaults to None.
+
+    Returns:
+        The result of the function.
+    """
+    if _executor is None:
+        started = perf_counter()
+        result = function(*args)
+        if stats is not None:
+            stats["blocked_ms"] = round((perf_counter() - started) * 1000, 3)
+        return result
+    monitor = _monitor if stats is not None else None
+    if monitor is None:
+        return await asyncio.get_running_loop().run_in_executor(_executor, function, *args)
+    started = monitor.begin_task()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, function, *args)
+    finally:
+        stats["blocked_ms"] = round(monitor.end_task(started) * 1000, 3)
+
+# ----------------------------------------------------------------------------------------------
+
+class LoopMonitor:
+    """
+    Measures how long the event loop is blocked, by sleeping for `interval` over and over and recording
+    how late it wakes up. A late wake up is time every agent of the process had to wait.
+
+    Tasks that run outside the loop, e.g. the plans of a pool, can be tracked with `begin_task` and
+    `end_task` to get their share of the lag: each moment of lag is split evenly among the tasks
+    running then, so tasks running at the same time don't count the same stall twice.
+
+    Example of usage:
+    ```py
+    monitor = LoopMonitor()
+    asyncio.create_task(monitor.run())
+    ...
+    monitor.stop()
+    print(monitor.summary())
+    ```
+
+    Args:
+        interval (float, optional): Seconds between two checks. Defaults to 0.01.
+        threshold (float, optional): Seconds late from which a wake up counts as a stall. Defaults to 0.05.
+
+    Attributes:
+        checks (int): The number of wake ups.
+        stalls (int): The number of wake ups later than the threshold.
+        max_lag (float): Seconds late of the latest wake up.
+        total_lag (float): Seconds late of all the wake ups.
+        tasks (int): The tracked tasks running.
+    """
+    def __init__(self, interval : float = 0.01, threshold : float = 0.05) -> None:
+        self.interval : float = interval
+        self.threshold : float = threshold
+        self.checks : int = 0
+        self.stalls : int = 0
+        self.max_lag : float = 0.0
+        self.total_lag : float = 0.0
+        self.tasks : int = 0
+        self.__running : bool = False
+        self.__expected : float = 0.0
+        self.__late : float = 0.0 # seconds late of the wake up under way, counted so far
+        self.__task_lag : float = 0.0 # lag each tracked task has been given since the start
+
+    async def run(self) -> None:
+        self.__running = True
+        while self.__running:
+            self.__expected = perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            if self.__running:
+                self.__record()
+
+    def stop(self) -> None:
+        # The wake up under way counts up to now
+        if self.__running:
+            self.__record()
+        self.__running = False
+
+    def begin_task(self) -> float:
+        """
+        Start tracking a task.
+
+        Returns:
+            float: The mark to give to `end_task`.
+        """
+        self.__settle()
+        self.tasks += 1
+        return self.__task_lag
+
+    def end_task(self, mark : float) -> float:
+        """
+        Stop tracking a task.
+
+        Args:
+            mark (float): What `begin_task` returned.
+
+        Returns:
+            float: The seconds of lag given to the task while it ran.
+        """
+        self.__settle()
+        self.tasks -= 1
+        return self.__task_lag - mark
+
+    def __settle(self) -> None:
+        # Count the lag of the wake up under way so far, split among the tasks running until now
+        if not self.__running:
+            return
+        now = perf_counter()
+        lag = max(now - self.__expected, 0.0)
+        self.__expected = max(self.__expected, now)
+        self.__late += lag
+        self.total_lag += lag
+        if self.tasks:
+            self.__task_lag += lag / self.tasks
+
+    def __record(self) -> None:
+        self.__settle()
+        self.checks += 1
+        self.max_lag = max(self.max_lag, self.__late)
+        if self.__late >= self.threshold:
+            self.stalls += 1
+        self.__late = 0.0
+
+    def summary(self) -> dict:
+        """
+        Get the number of stalls and the average and maximum lag, in milliseconds.
+        """
+        return {
+            "checks": self.checks,
+            "stalls": self.stalls,
+            "avg_lag_ms": round(self.total_lag * 1000 / max(self.checks, 1), 3),
+            "max_lag_ms": round(self.max_lag * 1000, 3)
+        }
+
+# ----------------------------------------------------------------------------------------------
+
+def set_loop_monitor(monitor : LoopMonitor | None) -> None:
+    """
+    Share the monitor of the event loop with the planner of the process, which reads from it how long
+    pooled plans block the loop. None stops measuring them.
+    """
+    global _monitor
+    _monitor = monitor
+
+def current_loop_monitor() -> LoopMonitor | None:
+    """
+    Get the monitor of the event loop shared with the planner, if any.
+    """
+    return _monitor
+
+# ----------------------------------------------------------------------------------------------
@@ -1,9 +1,24 @@
 # ----------------------------------------------------------------------------------------------
 
 from itertools import combinations
+from time import perf_counter
 
 from order import DeliveryOrder
-from misc.distance import haversine_distance
+import numpy as np
+
+from misc.distance import geo_distance, geo_distances
+from misc.distance_matrix import shared_matrix
+from misc.spatial_index import IndexedPositions
+
+SOLVER_TIME_BUDGET : float = 1.0 # seconds a single best_available_orders call may search for
+VECTORISE_THRESHOLD : int = 32 # from this many orders on, distances not in the matrix are computed with NumPy
+
+# Warehouses a drone asks for orders
+TARGET_ALL : str = "all" # every warehouse
+TARGET_NEAREST : str = "nearest" # the k nearest
+TARGET_REACH : str = "reach" # those within the autonomy left
+TARGETING_POLICIES : tuple[str, ...] = (TARGET_ALL, TARGET_NEAREST, TARGET_REACH)
+NEAREST_WAREHOUSES : int = 3 # k of TARGET_NEAREST
 
 # ---------------------------------------------------------------------------------------------
 
@@ -23,6 +38,93 @@ def arrived_to_target(position, target_lat : float, target_lon : float) -> bool:
 
 # ---------------------------------------------------------------------------------------------
 
+def position_distance(lat1 : float, lon1 : float, lat2 : float, lon2 : float) -> float:
+    '''
+    Distance between two positions, taken from the shared distance matrix when both are known points
+    
+    Args:
+        lat1 (float): Latitude of the first position
+        lon1 (float): Longitude of the first position
+        lat2 (float): Latitude of the second position
+        lon2 (float): Longitude of the second position
+        
+    Returns:
+        float: The distance in meters
+    '''
+    matrix = shared_matrix()
+    if matrix is None:
+        return geo_distance(lat1, lon1, lat2, lon2)
+    return matrix.distance(lat1, lon1, lat2, lon2)
+
+# ---------------------------------------------------------------------------------------------
+
+def order_distances(latitude : float, longitude : float, orders : list[DeliveryOrder]) -> list[float]:
+    '''
+    Distances from the given position to the destination of each order
+    
+    Args:
+        latitude (float): Latitude of the given position
+        longitude (float): Longitude of the given position
+        orders (list[DeliveryOrder]): List of orders
+        
+    Returns:
+        list[float]: The distance to each order, in the same order
+    '''
+    matrix = shared_matrix()
+    row = matrix.locate(latitude, longitude) if matrix is not None else None
+    if row is None and len(orders) >= VECTORISE_THRESHOLD:
+        return geo_distances(
+            latitude,
+            longitude,
+            np.fromiter((order.dest_lat for order in orders), dtype=np.float64, count=len(orders)),
+            np.fromiter((order.dest_lon for order in orders), dtype=np.float64, count=len(orders))
+        ).tolist()
+    distances = []
+    for order in orders:
+        column = matrix.index.get(order.id) if row is not None else None
+        if column is None:
+            distances.append(geo_distance(
+                latitude,
+                longitude,
+                order.dest_lat,
+                order.dest_lon
+            ))
+        else:
+            distances.append(matrix.item(row, column))
+    return distances
+
+# ---------------------------------------------------------------------------------------------
+
+def warehouse_distances(latitude : float, longitude : float, warehouse_positions : dict) -> dict[str, float]:
+    '''
+    Distances from the given position to each warehouse
+    
+    Args:
+        latitude (float): Latitude of the given position
+        longitude (float): Longitude of the given position
+        warehouse_positions (dict): Dictionary of warehouse positions
+        
+    Returns:
+        dict[str, float]: The distance to each warehouse, by warehouse id
+    '''
+    matrix = shared_matrix()
+    row = matrix.locate(latitude, longitude) if matrix is not None else None
+    distances = {}
+    for warehouse_id, position in warehouse_positions.items():
+        column = matrix.index.get(warehouse_id) if row is not None else None
+        if column is None:
+            distances[warehouse_id] = geo_distance(
+                latitude,
+                longitude,
+                position['latitude'],
+                position['longitude']
+            )
+        else:
+            distances[warehouse_id] = matrix.item(row, column)
+    return distances
+
+# ---------------------------------------------------------------------------------------------
+
 def closest_order(latitude, longitude, orders : list[DeliveryOrder]) -> DeliveryOrder:
     '''
     Find the closest order to the given position
@@ -37,13 +139,7 @@ def closest_order(latitude, longitude, orders : list[DeliveryOrder]) -> Delivery
     '''
     min_dist = float('inf')
     closest = None
-    for order in orders:
-        dist = haversine_distance(
-            latitude,
-            longitude,
-            order.destination_position['latitude'],
-            order.destination_position['longitude']
-        )
+    for order, dist in zip(orders, order_distances(latitude, longitude, orders)):
         if dist < min_dist:
             min_dist = dist
             closest = order
@@ -58,20 +154,17 @@ def closest_warehouse(latitude, longitude, warehouse_positions : dict) -> str:
     Args:
         latitude (float): Latitude of the given position
         longitude (float): Longitude of the given position
-        warehouse_positions (dict): Dictionary of warehouse positions
+        warehouse_positions (dict): Dictionary of warehouse positions, searched through its spatial index
+            when it is an IndexedPositions
         
     Returns:
         str: The id of the closest warehouse to the given position
     '''
+    if isinstance(warehouse_positions, IndexedPositions):
+        return warehouse_positions.nearest(latitude, longitude)
     min_dist = float('inf')
     closest = None
-    for warehouse_id, position in warehouse_positions.items():
-        dist = haversine_distance(
-            latitude,
-            longitude,
-            position['latitude'],
-            position['longitude']
-        )
+    for warehouse_id, dist in warehouse_distances(latitude, longitude, warehouse_positions).items():
         if dist < min_dist:
             min_dist = dist
             closest = warehouse_id
@@ -79,6 +172,48 @@ def closest_warehouse(latitude, longitude, warehouse_positions : dict) -> str:
 
 # ---------------------------------------------------------------------------------------------
 
+def target_warehouses(latitude : float, longitude : float, warehouse_positions : dict, policy : str = TARGET_ALL,
+                      k : int = NEAREST_WAREHOUSES, autonomy : float = float('inf'), widening : int = 0) -> list[str]:
+    '''
+    Choose the warehouses to ask for orders from the given position
+    
+    Each widening doubles k, or the radius, so a drone that got no orders from the warehouses around it
+    looks further away. TARGET_REACH falls back to the nearest warehouse when none is within the radius.
+    
+    Args:
+        latitude (float): Latitude of the given position
+        longitude (float): Longitude of the given position
+        warehouse_positions (dict): Dictionary of warehouse positions, searched through its spatial index
+            when it is an IndexedPositions
+        policy (str, optional): One of TARGETING_POLICIES. Defaults to TARGET_ALL.
+        k (int, optional): Number of warehouses TARGET_NEAREST asks. Defaults to NEAREST_WAREHOUSES.
+        autonomy (float, optional): Radius TARGET_REACH asks within, in meters. Defaults to no limit.
+        widening (int, optional): Number of times the search was widened. Defaults to 0.
+        
+    Returns:
+        list[str]: The ids of the warehouses, closest first unless every warehouse is asked
+    '''
+    if policy == TARGET_ALL or not warehouse_positions:
+        return list(warehouse_positions.keys())
+    if policy not in TARGETING_POLICIES:
+        raise ValueError(f"Unknown targeting policy {policy}, expected one of {TARGETING_POLICIES}.")
+    
+    scale = 2 ** widening
+    if isinstance(warehouse_positions, IndexedPositions):
+        index = warehouse_positions.index
+        if policy == TARGET_NEAREST:
+            found = index.k_nearest(latitude, longitude, k * scale)
+        else:
+            found = index.within(latitude, longitude, autonomy * scale) or index.k_nearest(latitude, longitude, 1)
+        return [warehouse_id for warehouse_id, _ in found]
+    
+    ranked = sorted(warehouse_distances(latitude, longitude, warehouse_positions).items(), key=lambda entry: entry[1])
+    if policy == TARGET_NEAREST:
+        return [warehouse_id for warehouse_id, _ in ranked[:k * scale]]
+    return [warehouse_id for warehouse_id, dist in ranked if dist <= autonomy * scale] or [ranked[0][0]]
+
+# ---------------------------------------------------------------------------------------------
+
 def generate_path(orders: list[DeliveryOrder], first_order: DeliveryOrder) -> list[DeliveryOrder]:
     '''
     Generate a path that visits all the given orders starting from the first order
@@ -93,7 +228,7 @@ def generate_path(orders: list[DeliveryOrder], first_order: DeliveryOrder) -> li
     if not orders:
         return []
     start_order = first_order
-    if start_order not in orders:
+    if start_order.id not in {order.id for order in orders}:
         return []
     path = [start_order]
     visited = {start_order.id}
@@ -101,17 +236,16 @@ def generate_path(orders: list[DeliveryOrder], first_order: DeliveryOrder) -> li
     while len(path) < len(orders):
         next_order = None
         min_distance = float('inf')
-        for order in orders:
-            if order.id not in visited:  
-                distance = haversine_distance(
-                    current_order.destination_position['latitude'], 
-                    current_order.destination_position['longitude'], 
-                    order.destination_position['latitude'], 
-                    order.destination_position['longitude']
-                )
-                if distance < min_distance:
-                    min_distance = distance
-                    next_order = order
+        remaining = [order for order in orders if order.id not in visited]
+        distances = order_distances(
+            current_order.dest_lat, 
+            current_order.dest_lon, 
+            remaining
+        )
+        for order, distance in zip(remaining, distances):
+            if distance < min_distance:
+                min_distance = distance
+                next_order = order
         if next_order:
             visited.add(next_order.id)  
             path.append(next_order)
@@ -134,16 +268,20 @@ def calculate_travel_distance(path : list[DeliveryOrder]) -> float:
     '''
     if len(path) < 2:
         return 0.0
+    matrix = shared_matrix()
     total_distance = 0.0
     for i in range(len(path) - 1):
         start = path[i]
         end = path[i + 1]
-        total_distance += haversine_distance(
-            start.destination_position['latitude'], 
-            start.destination_position['longitude'], 
-            end.destination_position['latitude'], 
-            end.destination_position['longitude']
-        )
+        if matrix is not None and start.id in matrix and end.id in matrix:
+            total_distance += matrix.between(start.id, end.id)
+        else:
+            total_distance += geo_distance(
+                start.dest_lat, 
+                start.dest_lon, 
+                end.dest_lat, 
+                end.dest_lon
+            )
     return total_distance
 
 # ---------------------------------------------------------------------------------------------
@@ -210,38 +348,177 @@ def combine_orders(orders: list[DeliveryOrder], capacity: int) -> list[list[Deli
 
 # ---------------------------------------------------------------------------------------------
 
-def best_available_orders(orders: list[DeliveryOrder], latitude: float, longitude: float, capacity: int, autonomy: float) -> list[DeliveryOrder]:
+class RouteCostTable:
+    '''
+    Travel distances of the nearest neighbour routes over the subsets of a fixed list of orders.
+    
+    Built once per decision. A route is described, as in Held-Karp, by the bitmask of the orders
+    still to visit and the stop the drone is currently at; the distance left from each such state
+    is memoised, so every subset whose route reaches a known state reuses it instead of rebuilding
+    the path with `generate_path` and `calculate_travel_distance`.
+    
+    Args:
+        orders (list[DeliveryOrder]): List of orders, bit i of a mask stands for orders[i]
+        latitude (float): Latitude of the position the routes start from
+        longitude (float): Longitude of the position the routes start from
+        
+    Attributes:
+        hits (int): Number of lookups answered by the cache.
+        misses (int): Number of states that had to be computed.
+    '''
+    def __init__(self, orders: list[DeliveryOrder], latitude: float, longitude: float) -> None:
+        self.orders : list[DeliveryOrder] = orders
+        self.start_distances : list[float] = order_distances(latitude, longitude, orders)
+        self.distances : list[list[float]] = [
+            order_distances(
+                order.dest_lat, 
+                order.dest_lon, 
+                orders
+            ) for order in orders
+        ]
+        self.hits : int = 0
+        self.misses : int = 0
+        self.__remaining_distance : dict[int, float] = {}
+        
+    @staticmethod
+    def __closest(distances : list[float], mask : int) -> int:
+        # Same tie-breaking as closest_order and generate_path: the first order in the list wins
+        closest = -1
+        min_dist = float('inf')
+        while mask:
+            lowest = mask & -mask
+            i = lowest.bit_length() - 1
+            if distances[i] < min_dist:
+                min_dist = distances[i]
+                closest = i
+            mask ^= lowest
+        return closest
+    
+    def __remaining(self, mask : int, last : int) -> float:
+        if mask == 0:
+            return 0.0
+        key = mask * len(self.orders) + last
+        distance = self.__remaining_distance.get(key)
+        if distance is not None:
+            self.hits += 1
+            return distance
+        self.misses += 1
+        
+        next_stop = self.__closest(self.distances[last], mask)
+        distance = self.distances[last][next_stop] + self.__remaining(mask & ~(1 << next_stop), next_stop)
+        self.__remaining_distance[key] = distance
+        return distance
+    
+    def travel_distance(self, mask : int) -> float:
+        '''
+        Travel distance of the nearest neighbour route through the given subset of orders
+        
+        Args:
+            mask (int): Bitmask of the orders in the subset, must not be empty
+            
+        Returns:
+            float: Distance from the starting position to the closest order plus the path through the rest
+        '''
+        first = self.__closest(self.start_distances, mask)
+        return self.start_distances[first] + self.__remaining(mask & ~(1 << first), first)
+    
+    def hit_rate(self) -> float:
+        '''
+        Fraction of the lookups answered by the cache
+        
+        Returns:
+            float: The hit rate, 0.0 if nothing was looked up yet
+        '''
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+# ---------------------------------------------------------------------------------------------
+
+def best_available_orders(orders: list[DeliveryOrder], latitude: float, longitude: float, capacity: int, autonomy: float,
+                          time_budget: float | None = SOLVER_TIME_BUDGET, stats: dict | None = None) -> list[DeliveryOrder]:
     '''
     Find the best set of orders that maximizes the utility
     
+    Branch and bound over the subsets of orders: sets that exceed the capacity are never built and
+    a branch is dropped as soon as an upper bound of its utility falls below the best utility found.
+    Ties are broken like the exhaustive enumeration of `combine_orders` (bigger sets first, then the
+    later combination), so both return the same set when the search finishes within the budget.
+    Route distances come from a `RouteCostTable` shared by every set looked at in the call.
+    
     Args:
         orders (list[DeliveryOrder]): List of orders
         latitude (float): Latitude of the drone's current position
         longitude (float): Longitude of the drone's current position
         capacity (int): Maximum capacity of the drone
         autonomy (float): Drone's autonomy
+        time_budget (float | None, optional): Seconds the search may take before returning the best set
+            found so far. None disables the limit. Defaults to SOLVER_TIME_BUDGET.
+        stats (dict | None, optional): If given, filled with the number of sets evaluated, the route
+            cache hits, misses and hit rate, and whether the time budget ran out. Defaults to None.
         
     Returns:
         list[DeliveryOrder]: The best set of orders that maximizes the utility
     '''
-    order_sets = combine_orders(orders, capacity)
+    deadline = None if time_budget is None else perf_counter() + time_budget
+    weights = [order.weight for order in orders]
+    route_table = RouteCostTable(orders, latitude, longitude)
+    start_distances = route_table.start_distances
+    
+    # remaining_weight[i] is the weight of every order from index i onwards
+    remaining_weight = [0] * (len(orders) + 1)
+    for i in range(len(orders) - 1, -1, -1):
+        remaining_weight[i] = remaining_weight[i + 1] + weights[i]
+    
+    def upper_bound(weight : int, reach : float) -> float:
+        # Any route has to cover at least the distance to its furthest order,
+        # and the capacity level can never go past the weight still available.
+        if reach > autonomy:
+            return float('-inf')
+        return min(weight / capacity, 1.0) + 1 - (reach / autonomy)
+    
     best_set = None
-    best_utility = float('-inf')
-    for order_set in order_sets:
-        closest = closest_order(latitude, longitude, order_set)
-        distance_closest_order = haversine_distance(
-            latitude, 
-            longitude, 
-            closest.destination_position['latitude'], 
-            closest.destination_position['longitude']
-        )
-        path = generate_path(order_set, closest)
-        travel_distance = distance_closest_order + calculate_travel_distance(path)
-        capacity_level = calculate_capacity_level(order_set, capacity)
-        set_utility = utility(len(order_set), travel_distance, autonomy, capacity_level)
-        if set_utility >= best_utility:
-            best_set = order_set
-            best_utility = set_utility
+    best_key = (float('-inf'),)
+    timed_out = False
+    evaluated = 0
+    chosen : list[int] = []
+    
+    def search(first : int, mask : int, weight : int, reach : float) -> None:
+        nonlocal best_set, best_key, timed_out, evaluated
+        for i in range(first, len(orders)):
+            if deadline is not None and perf_counter() > deadline:
+                timed_out = True
+                return
+            new_weight = weight + weights[i]
+            if new_weight > capacity:
+                continue
+            new_reach = max(reach, start_distances[i])
+            if upper_bound(new_weight + remaining_weight[i + 1], new_reach) < best_key[0]:
+                continue
+            
+            chosen.append(i)
+            new_mask = mask | (1 << i)
+            if upper_bound(new_weight, new_reach) >= best_key[0]:
+                evaluated += 1
+                set_utility = utility(len(chosen), route_table.travel_distance(new_mask), autonomy, min(new_weight / capacity, 1.0))
+                key = (set_utility, len(chosen), tuple(chosen))
+                if key > best_key:
+                    best_set = [orders[j] for j in chosen]
+                    best_key = key
+            search(i + 1, new_mask, new_weight, new_reach)
+            chosen.pop()
+            if timed_out:
+                return
+    
+    search(0, 0, 0, 0.0)
+    
+    if stats is not None:
+        stats.update({
+            "evaluated": evaluated,
+            "cache_hits": route_table.hits,
+            "cache_misses": route_table.misses,
+            "cache_hit_rate": round(route_table.hit_rate(), 4),
+            "timed_out": timed_out
+        })
     return best_set
 
 # ----------------------------------------------------------------------------------------------
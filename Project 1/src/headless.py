@@ -0,0 +1,372 @@
+import heapq
+from collections import Counter
+from math import inf, nextafter
+from time import perf_counter
+from typing import Callable
+
+from drone.agent import DroneAgent
+from drone.utils import TARGET_ALL, NEAREST_WAREHOUSES
+from drone.behaviours import STATE_AVAILABLE, STATE_SUGGEST, STATE_PICKUP, STATE_DELIVER, STATE_DEAD
+from misc.clock import VirtualClock
+from misc.spatial_index import IndexedPositions
+from warehouse.agent import WarehouseAgent
+from warehouse.behaviours import BATCH_WINDOW, DIGEST_PERIOD
+
+# ----------------------------------------------------------------------------------------------
+
+MESSAGE_DELAY = 0.001 # seconds a message takes to be delivered
+
+# Kinds of events
+MESSAGE = "message"
+ARRIVAL = "arrival"
+EXPIRY = "expiry"
+AUCTION = "auction"
+DIGEST = "digest"
+
+# ----------------------------------------------------------------------------------------------
+
+class HeadlessSimulation:
+    """
+    Runs a scenario without SPADE, XMPP, the web app or real time.
+
+    Drones and warehouses are the same agents as in `DeliveryLogic`, but they are never started: an
+    event queue drives them through the states of the drone FSM instead, and a virtual clock jumps
+    straight from one event to the next. The events are the delivery of a message, the arrival of a
+    drone at its target, the expiry of a warehouse's reservations, the end of a warehouse's batch window
+    and a warehouse's check for a new inventory digest.
+
+    The virtual clock counts the seconds a real-time run would take, so flights (see `drone.flight.FlightLeg`)
+    and reservation timeouts last as long as in a real-time run. Every drone stores the same metrics as in
+    a real-time run, through `DroneParameters.store_results`.
+
+    Example of usage:
+    ```py
+    summary = HeadlessSimulation(delivery_drones, warehouses).run()
+    ```
+
+    Args:
+        delivery_drones (list[dict]): The drones returned by `parse_data`.
+        warehouses (list): The warehouses and their orders returned by `parse_data`.
+        message_delay (float, optional): Seconds a message takes to be delivered. Defaults to MESSAGE_DELAY.
+        until (float | None, optional): Virtual time at which to stop even if drones are still working. Defaults to None.
+        batch_window (float, optional): Seconds warehouses collect requests for before answering them
+            together, see `warehouse.behaviours.AuctionBehaviour`. 0 answers each at once. Defaults to BATCH_WINDOW.
+        targeting (str, optional): Which warehouses the drones ask for orders, see `drone.utils.target_warehouses`. Defaults to TARGET_ALL.
+        nearest_warehouses (int, optional): Warehouses asked with the nearest targeting. Defaults to NEAREST_WAREHOUSES.
+        digest_period (float, optional): Seconds between the warehouses' checks for a new inventory digest to push
+            to the drones, see `warehouse.behaviours.PublishDigestBehaviour`. 0 pushes none. Defaults to DIGEST_PERIOD.
+
+    Attributes:
+        clock (VirtualClock): The clock of the simulation, also used by the warehouses' reservations.
+        events (Counter): The number of events processed, by kind.
+        requests (int): The number of requests for orders the drones sent.
+        digests (int): The number of inventory digests the warehouses pushed.
+    """
+    def __init__(self, delivery_drones : list[dict], warehouses : list, message_delay : float = MESSAGE_DELAY,
+                 until : float | None = None, batch_window : float = BATCH_WINDOW, targeting : str = TARGET_ALL,
+                 nearest_warehouses : int = NEAREST_WAREHOUSES, digest_period : float = DIGEST_PERIOD) -> None:
+        self.clock : VirtualClock = VirtualClock()
+        self.message_delay : float = message_delay
+        self.until : float | None = until
+        self.events : Counter = Counter()
+        self.requests : int = 0
+        self.digests : int = 0
+        self.__queue : list[tuple[float, int, str, Callable]] = [] # min-heap of (time, sequence, kind, callback)
+        self.__sequence : int = 0
+
+        self.warehouses : dict[str, WarehouseAgent] = {
+            warehouse["id"]: WarehouseAgent(
+                warehouse["id"],
+                warehouse["jid"],
+                warehouse["password"],
+                warehouse["latitude"],
+                warehouse["longitude"],
+                orders,
+                None,
+                clock=self.clock,
+                batch_window=batch_window,
+                digest_period=digest_period
+            ) for warehouse, orders in warehouses
+        }
+
+        warehouse_positions : IndexedPositions = IndexedPositions()
+        for warehouse, _ in warehouses:
+            warehouse_positions[warehouse["id"]] = {
+                "latitude": warehouse["latitude"],
+                "longitude": warehouse["longitude"],
+                "jid": warehouse["jid"]
+            }
+
+        self.delivery_drones : list[DroneAgent] = [
+            DroneAgent(
+                drone["id"],
+                drone["jid"],
+                drone["password"],
+                drone["initialPos"],
+                drone["capacity"],
+                drone["autonomy"],
+                drone["velocity"],
+                warehouse_positions.copy(),
+                None,
+                clock=self.clock,
+                targeting=targeting,
+                nearest_warehouses=nearest_warehouses
+            ) for drone in delivery_drones
+        ]
+        self.states : dict[str, str] = {}
+        self.__auctions : dict[str, list[tuple[DroneAgent, Callable]]] = {} # warehouse id -> drones waiting for its auction
+
+    # ----------------------------------------------------------------------------------------------
+
+    def run(self) -> dict:
+        """
+        Run the simulation until every drone is dead or the `until` time is reached.
+
+        Returns:
+            dict: The virtual and wall-clock durations, the events processed, the orders delivered,
+                the requests for orders sent per order delivered and the distance flown by the fleet.
+        """
+        started = perf_counter()
+        for drone in self.delivery_drones:
+            drone.logger.log(f"{drone.params.id} - [SETUP]")
+            drone.logger.log(f"FSM starting at initial state {STATE_AVAILABLE}")
+            self.__available(drone)
+        for warehouse in self.warehouses.values():
+            if warehouse.digest_period > 0:
+                self.__schedule(warehouse.digest_period, DIGEST, lambda warehouse=warehouse: self.__publish(warehouse))
+
+        while self.__queue:
+            time, _, kind, callback = heapq.heappop(self.__queue)
+            if self.until is not None and time > self.until:
+                break
+            self.clock.advance_to(time)
+            self.events[kind] += 1
+            callback()
+
+        wall_time = perf_counter() - started
+        delivered = sum(drone.params.orders_delivered for drone in self.delivery_drones)
+        return {
+            "virtual_time": round(self.clock.now(), 3),
+            "wall_time": round(wall_time, 3),
+            "speedup": round(self.clock.now() / wall_time, 1) if wall_time > 0 else inf,
+            "events": dict(self.events),
+            "orders_delivered": delivered,
+            "requests_per_order": round(self.requests / delivered, 3) if delivered else inf,
+            "digests": self.digests,
+            "fleet_distance": round(sum(drone.params.total_distance for drone in self.delivery_drones), 1),
+            "unfinished_drones": [drone.params.id for drone in self.delivery_drones if self.states.get(drone.params.id) != STATE_DEAD]
+        }
+
+    def __schedule(self, time : float, kind : str, callback : Callable) -> None:
+        self.__sequence += 1
+        heapq.heappush(self.__queue, (time, self.__sequence, kind, callback))
+
+    def __send(self, callback : Callable) -> None:
+        # The callback handles the message on the receiving side
+        self.__schedule(self.clock.now() + self.message_delay, MESSAGE, callback)
+
+    def __fly(self, drone : DroneAgent, latitude : float, longitude : float, on_arrival : Callable) -> None:
+        leg = drone.start_leg(latitude, longitude)
+
+        def arrive() -> None:
+            if not drone.end_leg():
+                drone.logger.log("[ERROR] Drone out of battery")
+                drone.died_successfully = False
+                self.__dead(drone)
+                return
+            on_arrival()
+
+        self.__schedule(leg.end_time, ARRIVAL, arrive)
+
+    # ----------------------------------------------------------------------------------------------
+    # Drone states, as in drone.behaviours
+    # ----------------------------------------------------------------------------------------------
+
+    def __available(self, drone : DroneAgent) -> None:
+        self.states[drone.params.id] = STATE_AVAILABLE
+        self.__request(drone, drone.warehouses_to_ask())
+
+    def __request(self, drone : DroneAgent, warehouses : list[str]) -> None:
+        # Every warehouse is asked at once, the answers are handled once they all arrived
+        if not warehouses:
+            self.__suggest(drone, [])
+            return
+        responses : dict[str, tuple] = {}
+
+        def reply(warehouse_id : str, response : tuple) -> None:
+            def receive() -> None:
+                responses[warehouse_id] = response
+                if len(responses) == len(warehouses):
+                    self.__suggest(drone, [responses[warehouse] for warehouse in warehouses])
+            self.__send(receive)
+
+        for warehouse_id in warehouses:
+            self.requests += 1
+            self.__send(lambda warehouse_id=warehouse_id: self.__answer_request(
+                self.warehouses[warehouse_id], drone, lambda response: reply(warehouse_id, response)))
+
+    def __suggest(self, drone : DroneAgent, responses : list[tuple]) -> None:
+        self.states[drone.params.id] = STATE_SUGGEST
+        drone.available_order_sets = {}
+        if not responses and drone.has_inventory():
+            drone.logger.log("[WARN] - No responses from warehouses - Delivering remaining orders...")
+            self.__deliver(drone)
+            return
+        if not responses and not drone.warehouse_positions:
+            drone.logger.log("[FINISH] - No warehouses left")
+            drone.died_successfully = True
+            self.__dead(drone)
+            return
+        if not responses:
+            drone.logger.log("[ERROR] - No responses from warehouses")
+            drone.died_successfully = False
+            self.__dead(drone)
+            return
+
+        for performative, sender, orders in responses:
+            if performative == "propose":
+                drone.handle_proposal(sender, orders)
+            elif performative == "refuse":
+                drone.handle_refusal(sender)
+
+        if not any(drone.available_order_sets.values()) and drone.widen_search():
+            for warehouse in drone.available_order_sets.keys():
+                self.__send(lambda warehouse=warehouse: self.warehouses[warehouse].reject_proposal(str(drone.jid)))
+            self.__available(drone)
+        elif drone.available_order_sets:
+            winner, orders = drone.choose_orders()
+            if winner:
+                order_ids = [order.id for order in orders] if orders else []
+                self.__send(lambda: self.warehouses[winner].accept_proposal(str(drone.jid), order_ids))
+                drone.logger.log(f"[DECIDED] - {winner} - {orders}")
+            for warehouse in drone.available_order_sets.keys():
+                if warehouse != winner:
+                    self.__send(lambda warehouse=warehouse: self.warehouses[warehouse].reject_proposal(str(drone.jid)))
+            drone.logger.log("[DECIDED] - None - None")
+
+            if winner:
+                drone.next_warehouse = winner
+                drone.orders_to_be_picked[winner] = orders
+                self.__pickup(drone)
+            else:
+                self.__deliver(drone)
+        elif drone.has_inventory():
+            drone.logger.log("[ORDER SUGGESTION] - No available orders - Delivering remaining orders...")
+            self.__deliver(drone)
+        else:
+            drone.logger.log(f"[FINISH] - No available orders - {drone.has_inventory()}")
+            drone.died_successfully = True
+            self.__dead(drone)
+
+    def __pickup(self, drone : DroneAgent) -> None:
+        self.states[drone.params.id] = STATE_PICKUP
+
+        def arrive() -> None:
+            drone.recharge()
+            orders = drone.orders_to_be_picked[drone.next_warehouse]
+            if orders is None:
+                self.__after_pickup(drone)
+                return
+            warehouse = self.warehouses[drone.next_warehouse]
+            self.__send(lambda: self.__confirm_pickup(warehouse, drone))
+
+        self.__fly(drone, *drone.get_next_warehouse_position(), arrive)
+
+    def __confirm_pickup(self, warehouse : WarehouseAgent, drone : DroneAgent) -> None:
+        warehouse.pickup_orders(str(drone.jid))
+
+        def confirmed() -> None:
+            orders = drone.orders_to_be_picked.pop(drone.next_warehouse)
+            orders_id = [order.id for order in orders]
+            drone.logger.log("[PICKUP] - {} Orders picked up at {} - {}".format(len(orders_id), drone.next_warehouse, orders_id))
+            for order in orders:
+                drone.add_order(order)
+            self.__after_pickup(drone)
+
+        self.__send(confirmed)
+
+    def __after_pickup(self, drone : DroneAgent) -> None:
+        if drone.prepare_deliveries():
+            self.__deliver(drone)
+        else:
+            self.__available(drone)
+
+    def __deliver(self, drone : DroneAgent) -> None:
+        self.states[drone.params.id] = STATE_DELIVER
+        if not drone.has_inventory():
+            drone.logger.log("[DELIVERING] - No orders to deliver")
+            self.__available(drone)
+            return
+
+        def arrive() -> None:
+            drone.deliver_next_order()
+            self.__available(drone)
+
+        self.__fly(drone, *drone.get_next_order_position(), arrive)
+
+    def __dead(self, drone : DroneAgent) -> None:
+        self.states[drone.params.id] = STATE_DEAD
+        if drone.died_successfully:
+            drone.logger.log("[DEAD BEHAVIOUR] - Drone successfully completed its mission.")
+        else:
+            drone.logger.log("[DEAD BEHAVIOUR] - Something went wrong.")
+        drone.logger.log(f"FSM finished at state {STATE_DEAD}")
+        for warehouse in self.warehouses.values():
+            if str(drone.jid) in warehouse.subscribers:
+                self.__send(lambda warehouse=warehouse: warehouse.unsubscribe(str(drone.jid)))
+        drone.finish()
+
+    # ----------------------------------------------------------------------------------------------
+    # Warehouse side, as in warehouse.behaviours
+    # ----------------------------------------------------------------------------------------------
+
+    def __answer_request(self, warehouse : WarehouseAgent, drone : DroneAgent, reply : Callable) -> None:
+        sender = str(drone.jid)
+        if not warehouse.has_orders():
+            warehouse.logger.log(f"[IDLE] - No orders to be picked - {sender}")
+            warehouse.logger.log(f"[REFUSING] - [MESSAGE] {sender}")
+            reply(("refuse", warehouse.id, None))
+            return
+        warehouse.subscribe(sender)
+
+        if warehouse.batch_window > 0:
+            # Join the warehouse's auction, the first request opens it
+            if warehouse.id not in self.__auctions:
+                self.__auctions[warehouse.id] = []
+                self.__schedule(self.clock.now() + warehouse.batch_window, AUCTION, lambda: self.__auction(warehouse))
+            self.__auctions[warehouse.id].append((drone, reply))
+            return
+
+        orders = warehouse.suggest_orders(sender, drone.params.max_capacity)
+        self.__schedule_expiry(warehouse)
+        reply(("propose", warehouse.id, orders))
+
+    def __auction(self, warehouse : WarehouseAgent) -> None:
+        waiting = self.__auctions.pop(warehouse.id)
+        bundles = warehouse.suggest_batch({
+            str(drone.jid): (drone.params.max_capacity, drone.params.max_autonomy) for drone, _ in waiting
+        })
+        self.__schedule_expiry(warehouse)
+        for drone, reply in waiting:
+            reply(("propose", warehouse.id, bundles[str(drone.jid)]))
+
+    def __schedule_expiry(self, warehouse : WarehouseAgent) -> None:
+        deadline = warehouse.orders_matrix.next_expiry()
+        if deadline is not None:
+            # Reservations expire once the clock is strictly past their deadline
+            self.__schedule(nextafter(deadline, inf), EXPIRY, lambda: self.__expire(warehouse))
+
+    def __publish(self, warehouse : WarehouseAgent) -> None:
+        if all(state == STATE_DEAD for state in self.states.values()):
+            return
+        digest = warehouse.changed_digest() if warehouse.subscribers else None
+        if digest is not None:
+            for drone in self.delivery_drones:
+                if str(drone.jid) in warehouse.subscribers:
+                    self.digests += 1
+                    self.__send(lambda drone=drone: drone.update_digest(digest))
+        self.__schedule(self.clock.now() + warehouse.digest_period, DIGEST, lambda: self.__publish(warehouse))
+
+    def __expire(self, warehouse : WarehouseAgent) -> None:
+        for owner in warehouse.orders_matrix.check_timeout(warehouse.logger):
+            warehouse.logger.log(f"[EXPIRED] - Reservations of {owner} timed out")
@@ -1,11 +1,36 @@
-from warehouse.agent import WarehouseAgent
-from drone.agent import DroneAgent
+from warehouse.agent import WarehouseAgent, WarehouseGroupAgent
+from warehouse.behaviours import MAX_CONCURRENT_REQUESTS, BATCH_WINDOW, DIGEST_PERIOD
+from drone.agent import DroneAgent, FleetAgent
+from drone.utils import TARGET_ALL, NEAREST_WAREHOUSES
+from drone.fleet import FleetKinematics
+from drone.planner import LoopMonitor, set_loop_monitor
 from flask_socketio import SocketIO
+from misc.spatial_index import IndexedPositions
 import spade
-from asyncio import sleep
+from asyncio import sleep, create_task
+
+def host_ids(warehouses : list) -> tuple[str, str]:
+    """
+    Get the ids of the fleet and the warehouse group of a process with `multiplex`, named after its first
+    warehouse so that they are unique across the processes of a sharded run.
+
+    Args:
+        warehouses (list): The warehouses and orders the process runs.
+
+    Returns:
+        tuple[str, str]: The id of the FleetAgent and of the WarehouseGroupAgent.
+    """
+    region = warehouses[0][0]["id"]
+    return f"fleet-{region}", f"warehouses-{region}"
 
 class DeliveryLogic:
-    def __init__(self, delivery_drones : list[dict], warehouses : list[dict], socketio : SocketIO) -> None:
+    def __init__(self, delivery_drones : list[dict], warehouses : list[dict], socketio : SocketIO,
+                 warehouse_workers : int = MAX_CONCURRENT_REQUESTS, batch_window : float = BATCH_WINDOW,
+                 targeting : str = TARGET_ALL, nearest_warehouses : int = NEAREST_WAREHOUSES, digest_period : float = DIGEST_PERIOD,
+                 fleet_service : bool = False, remote_warehouses : list[dict] | None = None, multiplex : bool = False) -> None:
+        
+        # With multiplexing, the agents log to the file of their host, which alone connects
+        fleet_id, group_id = host_ids(warehouses) if multiplex else (None, None)
         
         # Create warehouse agents
         self.warehouses : list[WarehouseAgent] = [
@@ -16,19 +41,27 @@ class DeliveryLogic:
                 warehouse["latitude"],
                 warehouse["longitude"],
                 orders,
-                socketio
+                socketio,
+                max_concurrent_requests=warehouse_workers,
+                batch_window=batch_window,
+                digest_period=digest_period,
+                log_file=group_id
             ) for warehouse, orders in warehouses
         ]
         
-        # Store warehouse positions for drone navigation
-        warehouse_positions : dict = {}
-        for warehouse, _ in warehouses:
+        # Store warehouse positions for drone navigation, indexed for nearest warehouse queries
+        warehouse_positions : IndexedPositions = IndexedPositions()
+        # Warehouses run by other processes (see `shard`) are asked for orders like the local ones
+        for warehouse in [warehouse for warehouse, _ in warehouses] + (remote_warehouses or []):
             warehouse_positions[warehouse["id"]] = {
                 "latitude": warehouse["latitude"],
                 "longitude": warehouse["longitude"],
                 "jid": warehouse["jid"]
             }
                 
+        # With the fleet service, a single task times every flight and emits every position
+        self.fleet : FleetKinematics | None = FleetKinematics(socketio) if fleet_service else None
+        
         # Create drone agents
         self.delivery_drones = [
             DroneAgent(
@@ -40,26 +73,68 @@ class DeliveryLogic:
                 drone["autonomy"],
                 drone["velocity"],
                 warehouse_positions.copy(), # Need to copy the dictionary to avoid reference issues
-                socketio
+                socketio,
+                targeting=targeting,
+                nearest_warehouses=nearest_warehouses,
+                fleet=self.fleet,
+                log_file=fleet_id
             ) for drone in delivery_drones
         ]
+        
+        # The agents started, each host starting its own
+        self.hosts : list[FleetAgent | WarehouseGroupAgent] = []
+        if multiplex:
+            password = warehouses[0][0]["password"]
+            self.warehouse_group = WarehouseGroupAgent(group_id, f"{group_id}@localhost", password, self.warehouses)
+            self.fleet_host = FleetAgent(fleet_id, f"{fleet_id}@localhost", password, self.delivery_drones)
+            # Warehouses of other processes are reached through their group, see `shard`
+            for warehouse in remote_warehouses or []:
+                if "host" in warehouse:
+                    self.fleet_host.add_route(warehouse["jid"], warehouse["host"])
+            self.hosts = [self.warehouse_group, self.fleet_host]
 
         # Start the agents and pray they work as expected.
         spade.run(self.start_logic())
         
     async def start_logic(self):
+        await self.start_warehouses()
+        await sleep(2) # Wait for the warehouses to be ready
+        await self.start_drones()
+        await self.wait_drones()
+        await self.stop_agents()
+    
+    async def start_warehouses(self):
+        if self.hosts:
+            await self.warehouse_group.start()
+            return
         for warehouse in self.warehouses:
             await warehouse.start()
-            
-        await sleep(2) # Wait for the warehouses to be ready
+    
+    async def start_drones(self):
+        # Measure how long the event loop is blocked, e.g. by the planning of the drones
+        self.monitor = LoopMonitor()
+        create_task(self.monitor.run())
+        set_loop_monitor(self.monitor)
         
-        for drone in self.delivery_drones:
-            await drone.start()
-
+        if self.hosts:
+            await self.fleet_host.start()
+        else:
+            for drone in self.delivery_drones:
+                await drone.start()
+        if self.fleet is not None:
+            create_task(self.fleet.run())
+    
+    async def wait_drones(self):
         for drone in self.delivery_drones:
             await spade.wait_until_finished(drone)
-            
+    
+    async def stop_agents(self):
         for drone in self.delivery_drones:
             await drone.stop()
         for warehouse in self.warehouses:
+            warehouse.logger.log(f"[SERVICE] - {warehouse.service_metrics.summary()}")
             await warehouse.stop()
+        for host in self.hosts:
+            await host.stop()
+        self.monitor.stop()
+        set_loop_monitor(None)
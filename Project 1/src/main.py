@@ -1,11 +1,31 @@
 import argparse
+import numpy as np
 
-from logic import DeliveryLogic
-from parse_data import parse_data
+from logic import DeliveryLogic, host_ids
+from warehouse.behaviours import MAX_CONCURRENT_REQUESTS, BATCH_WINDOW, DIGEST_PERIOD
+from headless import HeadlessSimulation
+from shard import ShardedSimulation, partition
+from drone.utils import TARGETING_POLICIES, TARGET_ALL, NEAREST_WAREHOUSES
+from drone.planner import PLANNERS, INLINE, PLANNER_WORKERS, set_planner, shutdown_planner
+from parse_data import parse_data, create_agents
+from misc.distance_matrix import DistanceMatrix, set_shared_matrix, shared_matrix, MAX_MATRIX_POINTS
+from misc.distance import LocalProjection, set_projection, current_projection
+from misc.codec import CODECS, set_codec
+from misc.transport import TRANSPORTS, XMPP, set_transport
+from order import OrderCatalog, set_catalog
 import threading
 from visualization import WebApp
 from time import sleep
 
+def positive_int(value : str) -> int:
+    """
+    Parse an argument that must be an integer of at least 1.
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
 def parse_args() -> argparse.Namespace:
     """
     Parse command line arguments.
@@ -18,6 +38,66 @@ def parse_args() -> argparse.Namespace:
         "-d", "--data", type=str, default="original", choices=["original", "small"],
         help="Data to use for the simulation. Options: original, small. Default: original."
     )
+    parser.add_argument(
+        "--float32", action="store_true",
+        help="Store the precomputed distance matrix as float32 to halve its memory."
+    )
+    parser.add_argument(
+        "--planar", action="store_true",
+        help="Measure distances on a local flat projection of the scenario instead of with haversine."
+    )
+    parser.add_argument(
+        "--codec", type=str, default="catalog", choices=list(CODECS.keys()),
+        help="Encoding of the orders in the messages between drones and warehouses. catalog sends ids only, binary and json the whole orders, json is readable, for debugging. Default: catalog."
+    )
+    parser.add_argument(
+        "--transport", type=str, default="local", choices=list(TRANSPORTS),
+        help="How agents exchange messages. local keeps them in memory, in this process. xmpp goes through the prosody server. Default: local."
+    )
+    parser.add_argument(
+        "--warehouse-workers", type=positive_int, default=MAX_CONCURRENT_REQUESTS,
+        help=f"Messages of different drones each warehouse serves at once. 1 serves them one at a time. Default: {MAX_CONCURRENT_REQUESTS}."
+    )
+    parser.add_argument(
+        "--batch-window", type=float, default=BATCH_WINDOW,
+        help=f"Seconds each warehouse collects requests for orders before sharing its orders between them in one auction. 0 answers each request at once. Default: {BATCH_WINDOW}."
+    )
+    parser.add_argument(
+        "--targeting", type=str, default=TARGET_ALL, choices=list(TARGETING_POLICIES),
+        help="Warehouses a drone asks for orders. all asks every one, nearest the closest ones, reach those within its autonomy. Drones that get no orders look further away. Default: all."
+    )
+    parser.add_argument(
+        "--nearest-warehouses", type=positive_int, default=NEAREST_WAREHOUSES,
+        help=f"Warehouses a drone asks with --targeting nearest. Default: {NEAREST_WAREHOUSES}."
+    )
+    parser.add_argument(
+        "--digest-period", type=float, default=DIGEST_PERIOD,
+        help=f"Seconds between each warehouse's checks for changes in its inventory, to push a digest of it to the drones that asked it for orders. Drones skip warehouses whose digest shows nothing for them. 0 pushes none. Default: {DIGEST_PERIOD}."
+    )
+    parser.add_argument(
+        "--fleet-service", action="store_true",
+        help="Time every flight and emit every drone position from a single task over NumPy arrays, instead of a timer and a position emitter per drone. Ignored with --headless, which already times flights on its own clock."
+    )
+    parser.add_argument(
+        "--planner", type=str, default=INLINE, choices=list(PLANNERS),
+        help="Where drones plan their orders. inline in the event loop, blocking every agent meanwhile, thread in a thread pool, process in a process pool. Default: inline."
+    )
+    parser.add_argument(
+        "--planner-workers", type=positive_int, default=PLANNER_WORKERS,
+        help=f"Threads or processes of the planner pool. Default: {PLANNER_WORKERS}."
+    )
+    parser.add_argument(
+        "--shards", type=positive_int, default=1,
+        help="Processes the simulation runs in, each with the warehouses of one region and the drones starting there. Drones still ask the warehouses of other regions for orders. Ignored with --headless. Default: 1."
+    )
+    parser.add_argument(
+        "--multiplex", action="store_true",
+        help="Host the drones in one agent and the warehouses in another, so that each process opens two connections and log files instead of one per drone and warehouse. Ignored with --headless."
+    )
+    parser.add_argument(
+        "--headless", action="store_true",
+        help="Run the simulation on a virtual clock, without XMPP, the web app or waiting in real time."
+    )
     return parser.parse_args()
 
 def main() -> None:
@@ -25,9 +105,42 @@ def main() -> None:
     args = parse_args()
     
     print(f"Using data: {args.data}")
+    set_codec(args.codec)
+    set_transport(args.transport)
     
     # Parse data
-    delivery_drones, warehouses = parse_data(args.data == "original")
+    delivery_drones, warehouses = parse_data(args.data == "original", create_users=args.transport == XMPP and not args.headless)
+    
+    # Load every order once, shared by the warehouses and the drones
+    catalog = OrderCatalog.from_scenario(warehouses)
+    set_catalog(catalog)
+    print(f"Order catalog: {len(catalog)} orders, {catalog.table.nbytes() / 1_000:.1f} kB")
+    
+    if args.planar:
+        latitudes = [warehouse["latitude"] for warehouse, _ in warehouses] \
+            + [order["latitude"] for _, orders in warehouses for order in orders]
+        longitudes = [warehouse["longitude"] for warehouse, _ in warehouses] \
+            + [order["longitude"] for _, orders in warehouses for order in orders]
+        projection = LocalProjection.from_points(latitudes, longitudes)
+        set_projection(projection)
+        print(f"Planar mode around ({projection.latitude:.6f}, {projection.longitude:.6f}) - "
+              f"error against haversine: {projection.max_error(latitudes, longitudes)}")
+    
+    # Precompute the distances between warehouses and orders, shared by every agent
+    points = sum(1 + len(orders) for _, orders in warehouses)
+    if points <= MAX_MATRIX_POINTS:
+        matrix = DistanceMatrix.from_scenario(warehouses, dtype=np.float32 if args.float32 else np.float64)
+        set_shared_matrix(matrix)
+        print(f"Distance matrix: {len(matrix)} points, {matrix.nbytes() / 1_000_000:.2f} MB")
+    else:
+        print(f"Distance matrix: skipped, {points} points is over the limit of {MAX_MATRIX_POINTS}")
+    
+    if args.headless:
+        summary = HeadlessSimulation(delivery_drones, warehouses, batch_window=args.batch_window,
+                                     targeting=args.targeting, nearest_warehouses=args.nearest_warehouses,
+                                     digest_period=args.digest_period).run()
+        print(f"Headless run: {summary}")
+        return
     
     # Setup web app on a separate thread
     web_app = WebApp()
@@ -38,8 +151,28 @@ def main() -> None:
     # Wait for the server to start
     sleep(2)
     
+    logic_kwargs = dict(warehouse_workers=args.warehouse_workers, batch_window=args.batch_window, targeting=args.targeting,
+                        nearest_warehouses=args.nearest_warehouses, digest_period=args.digest_period, fleet_service=args.fleet_service,
+                        multiplex=args.multiplex)
+    if args.multiplex and args.transport == XMPP:
+        # Only the hosts connect, one fleet and one warehouse group per process
+        regions = partition(delivery_drones, warehouses, args.shards)
+        create_agents([host for _, region in regions for host in host_ids(region)])
+    if args.shards > 1:
+        # Each shard applies the same settings in its own process
+        settings = {"codec": args.codec, "transport": args.transport, "projection": current_projection(),
+                    "matrix": shared_matrix(), "planner": args.planner, "planner_workers": args.planner_workers}
+        summary = ShardedSimulation(delivery_drones, warehouses, web_app.socketio, args.shards, settings, **logic_kwargs).run()
+        print(f"Sharded run: {summary}")
+        exit(0)
+    
+    # After the distance matrix and projection, which planner processes copy
+    set_planner(args.planner, args.planner_workers)
+    
     # Setup delivery logic
-    DeliveryLogic(delivery_drones, warehouses, web_app.socketio)
+    logic = DeliveryLogic(delivery_drones, warehouses, web_app.socketio, **logic_kwargs)
+    shutdown_planner()
+    print(f"Event loop: {logic.monitor.summary()}")
     
     # Kill the server thread
     exit(0)
@@ -0,0 +1,48 @@
+from time import time
+
+class WallClock:
+    """
+    Clock that reads the time of the machine, in seconds.
+    Any object with a `now()` method returning seconds can be used where a clock is expected.
+    """
+    def now(self) -> float:
+        return time()
+
+class ScaledClock:
+    """
+    Clock that runs `multiplier` times faster than the time of the machine, for accelerated simulations.
+    Starts at the current time of the machine.
+
+    Args:
+        multiplier (float): How many simulated seconds pass per real second.
+    """
+    def __init__(self, multiplier : float) -> None:
+        self.multiplier : float = multiplier
+        self.__start : float = time()
+
+    def now(self) -> float:
+        return self.__start + (time() - self.__start) * self.multiplier
+
+class VirtualClock:
+    """
+    Clock of a discrete-event simulation: time only moves when the simulation advances it to its next event.
+
+    Args:
+        start (float, optional): The time to start at, in seconds. Defaults to 0.0.
+    """
+    def __init__(self, start : float = 0.0) -> None:
+        self.__time : float = start
+
+    def now(self) -> float:
+        return self.__time
+
+    def advance_to(self, time : float) -> None:
+        """
+        Move the clock forward to the given time.
+
+        Raises:
+            ValueError: If the time is in the past.
+        """
+        if time < self.__time:
+            raise ValueError(f"Can't move the clock back from {self.__time} to {time}.")
+        self.__time = time
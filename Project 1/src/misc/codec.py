@@ -0,0 +1,159 @@
+import base64
+import json
+import struct
+
+import numpy as np
+
+from order import DeliveryOrder, OrderTable, shared_catalog
+
+METADATA_CODEC = "codec" # metadata field of a message naming the codec of its body
+
+_HEADER = struct.Struct("<BI") # format version, number of orders
+_VERSION = 1
+
+def _read_header(payload : bytes) -> int:
+    version, count = _HEADER.unpack_from(payload)
+    if version != _VERSION:
+        raise ValueError(f"Unknown version {version} of the binary codec.")
+    return count
+
+# ----------------------------------------------------------------------------------------------
+
+class JsonCodec:
+    """
+    Encodes the orders of a message as readable JSON, one object per order. Meant for debugging.
+    """
+    name = "json"
+
+    def encode_orders(self, orders : list[DeliveryOrder]) -> str:
+        return json.dumps([{
+            "id": order.id,
+            "origin_lat": order.start_position["latitude"],
+            "origin_long": order.start_position["longitude"],
+            "dest_lat": order.dest_lat,
+            "dest_long": order.dest_lon,
+            "weight": order.weight
+        } for order in orders])
+
+    def decode_orders(self, body : str) -> list[DeliveryOrder]:
+        records = json.loads(body) if body else []
+        return list(OrderTable.from_columns(
+            [record["id"] for record in records],
+            [record["origin_lat"] for record in records],
+            [record["origin_long"] for record in records],
+            [record["dest_lat"] for record in records],
+            [record["dest_long"] for record in records],
+            [record["weight"] for record in records]
+        ))
+
+    def encode_ids(self, ids : list[str]) -> str:
+        return json.dumps(ids)
+
+    def decode_ids(self, body : str) -> list[str]:
+        return json.loads(body) if body else []
+
+# ----------------------------------------------------------------------------------------------
+
+class BinaryCodec:
+    """
+    Encodes the orders of a message as packed little-endian arrays, in base64 so it fits in a message body:
+    a header with the number of orders, the origin latitudes, origin longitudes, destination latitudes and
+    destination longitudes as float64, the weights as int32, and the ids in UTF-8 separated by newlines.
+    Coordinates are kept exact so they still match the points of the distance matrix.
+    """
+    name = "binary"
+
+    def encode_orders(self, orders : list[DeliveryOrder]) -> str:
+        count = len(orders)
+        coordinates = np.empty((4, count), dtype="<f8")
+        for i, order in enumerate(orders):
+            start = order.start_position
+            coordinates[:, i] = (start["latitude"], start["longitude"], order.dest_lat, order.dest_lon)
+        weights = np.fromiter((order.weight for order in orders), dtype="<i4", count=count)
+        payload = b"".join((
+            _HEADER.pack(_VERSION, count),
+            coordinates.tobytes(),
+            weights.tobytes(),
+            "\n".join(order.id for order in orders).encode()
+        ))
+        return base64.b64encode(payload).decode("ascii")
+
+    def decode_orders(self, body : str) -> list[DeliveryOrder]:
+        payload = base64.b64decode(body)
+        count = _read_header(payload)
+        offset = _HEADER.size
+        coordinates = np.frombuffer(payload, dtype="<f8", count=4 * count, offset=offset).reshape(4, count)
+        offset += coordinates.nbytes
+        weights = np.frombuffer(payload, dtype="<i4", count=count, offset=offset)
+        offset += weights.nbytes
+        ids = payload[offset:].decode().split("\n") if count else []
+        return list(OrderTable.from_columns(ids, *coordinates, weights))
+
+    def encode_ids(self, ids : list[str]) -> str:
+        payload = _HEADER.pack(_VERSION, len(ids)) + "\n".join(ids).encode()
+        return base64.b64encode(payload).decode("ascii")
+
+    def decode_ids(self, body : str) -> list[str]:
+        payload = base64.b64decode(body)
+        count = _read_header(payload)
+        return payload[_HEADER.size:].decode().split("\n") if count else []
+
+# ----------------------------------------------------------------------------------------------
+
+class CatalogCodec(BinaryCodec):
+    """
+    Encodes the orders of a message by id only, with their status code as int8, in the same layout as
+    the binary codec: a header, the statuses and the ids. The receiver resolves the ids in the order
+    catalog of its process (see `order.OrderCatalog`), so decoding builds no order at all and both sides
+    hold the very same order. Orders that aren't in the catalog can't be sent this way.
+    """
+    name = "catalog"
+
+    def encode_orders(self, orders : list[DeliveryOrder]) -> str:
+        count = len(orders)
+        statuses = np.fromiter((order.table.item("status", order.row) for order in orders), dtype="i1", count=count)
+        payload = b"".join((
+            _HEADER.pack(_VERSION, count),
+            statuses.tobytes(),
+            "\n".join(order.id for order in orders).encode()
+        ))
+        return base64.b64encode(payload).decode("ascii")
+
+    def decode_orders(self, body : str) -> list[DeliveryOrder]:
+        catalog = shared_catalog()
+        if catalog is None:
+            raise ValueError("The catalog codec needs an order catalog, see order.set_catalog.")
+        payload = base64.b64decode(body)
+        count = _read_header(payload)
+        statuses = np.frombuffer(payload, dtype="i1", count=count, offset=_HEADER.size)
+        ids = payload[_HEADER.size + count:].decode().split("\n") if count else []
+        return catalog.resolve(ids, statuses.tolist())
+
+# ----------------------------------------------------------------------------------------------
+
+CODECS = {codec.name: codec for codec in (JsonCodec(), BinaryCodec(), CatalogCodec())}
+
+_codec = CODECS["binary"]
+
+def set_codec(name : str) -> None:
+    """
+    Choose the codec the agents of the process use for the messages they start.
+    Replies use the codec of the message they answer.
+
+    Args:
+        name (str): One of the keys of CODECS.
+    """
+    global _codec
+    _codec = CODECS[name]
+
+def current_codec() -> JsonCodec | BinaryCodec | CatalogCodec:
+    """
+    Get the codec the agents of the process use for the messages they start.
+    """
+    return _codec
+
+def codec_for(message) -> JsonCodec | BinaryCodec | CatalogCodec:
+    """
+    Get the codec a message was encoded with, from its metadata. Messages without one are JSON.
+    """
+    return CODECS[message.metadata.get(METADATA_CODEC, JsonCodec.name)]
@@ -1,7 +1,20 @@
 from math import radians, cos, sin, asin, sqrt, atan2, degrees
+import numpy as np
 
 EARTH_RADIUS = 6_371 # Radius of earth in kilometers.
 
+_projection = None # LocalProjection in use, None means exact (haversine) mode
+
+def earth_radius(unit : str = "m") -> float:
+    """
+    Args:
+        unit (str, optional): Unit of the radius. Can be "km" or "m". Defaults to "m".
+
+    Returns:
+        float: Radius of the earth in the specified unit.
+    """
+    return EARTH_RADIUS if unit == "km" else EARTH_RADIUS * 1_000
+
 def haversine_distance(lat1 : float , lon1 : float, lat2 : float, lon2 : float, unit : str = "m") -> float:
     """
     Args:
@@ -14,7 +27,7 @@ def haversine_distance(lat1 : float , lon1 : float, lat2 : float, lon2 : float,
     Returns:
         float: Distance between the two points in the specified unit.
     """
-    R = EARTH_RADIUS if unit == "km" else EARTH_RADIUS * 1_000
+    R = earth_radius(unit)
 
     dLat = radians(lat2 - lat1)
     dLon = radians(lon2 - lon1)
@@ -39,7 +52,7 @@ def next_position(curr_lat : float, curr_lon : float, target_lat : float, target
         tuple[dict, float]: The next position of the drone and the distance to the target point.
     """
     
-    distance = haversine_distance(curr_lat, curr_lon, target_lat, target_lon)
+    distance = geo_distance(curr_lat, curr_lon, target_lat, target_lon)
     if distance == 0.0:
         return {
             "latitude": target_lat,
@@ -54,4 +67,228 @@ def next_position(curr_lat : float, curr_lon : float, target_lat : float, target
     return {
         "latitude": new_lat,
         "longitude": new_lon
-    }, distance_covered
\ No newline at end of file
+    }, distance_covered
+
+# ----------------------------------------------------------------------------------------------
+# Array versions of the functions above. They follow the same formulas, so results match the
+# scalar functions within float tolerance, but work on whole NumPy arrays at once.
+# ----------------------------------------------------------------------------------------------
+
+def _haversine(lats1 : np.ndarray, lons1 : np.ndarray, lats2 : np.ndarray, lons2 : np.ndarray, unit : str) -> np.ndarray:
+    # Element-wise haversine, the inputs are broadcast against each other
+    dLat = np.radians(lats2 - lats1)
+    dLon = np.radians(lons2 - lons1)
+    lats1 = np.radians(lats1)
+    lats2 = np.radians(lats2)
+
+    a = np.sin(dLat/2)**2 + np.cos(lats1)*np.cos(lats2)*np.sin(dLon/2)**2
+    c = 2*np.arcsin(np.sqrt(a))
+
+    return earth_radius(unit) * c
+
+def haversine_distances(lat : float, lon : float, lats : np.ndarray, lons : np.ndarray, unit : str = "m") -> np.ndarray:
+    """
+    Distances from one point to many.
+
+    Args:
+        lat (float): Latitude of the point.
+        lon (float): Longitude of the point.
+        lats (np.ndarray): Latitudes of the other points.
+        lons (np.ndarray): Longitudes of the other points.
+        unit (str, optional): Unit of the distance. Can be "km" or "m". Defaults to "m".
+
+    Returns:
+        np.ndarray: Distance from the point to each of the other points.
+    """
+    return _haversine(lat, lon, np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64), unit)
+
+def haversine_matrix(lats1 : np.ndarray, lons1 : np.ndarray, lats2 : np.ndarray, lons2 : np.ndarray, unit : str = "m") -> np.ndarray:
+    """
+    Distances between every pair of points of two sets.
+
+    Args:
+        lats1 (np.ndarray): Latitudes of the N first points.
+        lons1 (np.ndarray): Longitudes of the N first points.
+        lats2 (np.ndarray): Latitudes of the M second points.
+        lons2 (np.ndarray): Longitudes of the M second points.
+        unit (str, optional): Unit of the distance. Can be "km" or "m". Defaults to "m".
+
+    Returns:
+        np.ndarray: N x M matrix with the distance between the i-th first point and the j-th second point.
+    """
+    lats1 = np.asarray(lats1, dtype=np.float64)[:, np.newaxis]
+    lons1 = np.asarray(lons1, dtype=np.float64)[:, np.newaxis]
+    lats2 = np.asarray(lats2, dtype=np.float64)[np.newaxis, :]
+    lons2 = np.asarray(lons2, dtype=np.float64)[np.newaxis, :]
+    return _haversine(lats1, lons1, lats2, lons2, unit)
+
+def next_positions(curr_lats : np.ndarray, curr_lons : np.ndarray, target_lats : np.ndarray, target_lons : np.ndarray,
+                   velocities : np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Advance many drones one step each, the i-th drone moving from its current point towards its target.
+    A drone that can reach its target in this step lands exactly on it.
+
+    Args:
+        curr_lats (np.ndarray): Current latitudes of the drones.
+        curr_lons (np.ndarray): Current longitudes of the drones.
+        target_lats (np.ndarray): Latitudes of their target points.
+        target_lons (np.ndarray): Longitudes of their target points.
+        velocities (np.ndarray): Distance each drone can cover in this step.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: The new latitudes, the new longitudes and the distance covered by each drone.
+    """
+    curr_lats = np.asarray(curr_lats, dtype=np.float64)
+    curr_lons = np.asarray(curr_lons, dtype=np.float64)
+    target_lats = np.asarray(target_lats, dtype=np.float64)
+    target_lons = np.asarray(target_lons, dtype=np.float64)
+    velocities = np.asarray(velocities, dtype=np.float64)
+
+    if _projection is None:
+        distances = _haversine(curr_lats, curr_lons, target_lats, target_lons, "m")
+    else:
+        distances = _projection.planar_distances(curr_lats, curr_lons, target_lats, target_lons)
+    arrived = distances <= velocities
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fraction = np.where(arrived, 1.0, velocities / distances)
+    new_lats = np.where(arrived, target_lats, curr_lats + fraction * (target_lats - curr_lats))
+    new_lons = np.where(arrived, target_lons, curr_lons + fraction * (target_lons - curr_lons))
+    distance_covered = np.where(arrived, distances, velocities)
+
+    return new_lats, new_lons, distance_covered
+
+# ----------------------------------------------------------------------------------------------
+# Planar mode. Every point of a scenario lies in the same city, so distances can be measured on
+# a flat local projection instead of the sphere. The geo_* functions below are what the simulation
+# uses, and they follow whichever mode is active.
+# ----------------------------------------------------------------------------------------------
+
+class LocalProjection:
+    """
+    Equirectangular projection around a reference point, usually the centroid of the scenario.
+    Maps latitude/longitude to x/y meters east/north of the reference point, where distances are plain Euclidean.
+
+    The projection is linear in latitude and longitude, so moving in a straight line on the plane is
+    the same as interpolating latitude and longitude, and drones can keep their positions in degrees.
+
+    Example of usage:
+    ```py
+    projection = LocalProjection.from_points(latitudes, longitudes)
+    print(projection.max_error(latitudes, longitudes))
+    set_projection(projection) # planar mode
+    set_projection(None)       # back to exact mode
+    ```
+
+    Args:
+        latitude (float): Latitude of the reference point.
+        longitude (float): Longitude of the reference point.
+    """
+    def __init__(self, latitude : float, longitude : float) -> None:
+        self.latitude : float = latitude
+        self.longitude : float = longitude
+        self.meters_per_degree_lat : float = radians(1) * earth_radius("m")
+        self.meters_per_degree_lon : float = radians(1) * earth_radius("m") * cos(radians(latitude))
+
+    @classmethod
+    def from_points(cls, latitudes : np.ndarray, longitudes : np.ndarray) -> "LocalProjection":
+        """
+        Build the projection around the centroid of the given points.
+        """
+        return cls(float(np.mean(latitudes)), float(np.mean(longitudes)))
+
+    def to_xy(self, latitudes : np.ndarray, longitudes : np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Project coordinates to meters east (x) and north (y) of the reference point. Works on floats and arrays.
+        """
+        x = (np.asarray(longitudes, dtype=np.float64) - self.longitude) * self.meters_per_degree_lon
+        y = (np.asarray(latitudes, dtype=np.float64) - self.latitude) * self.meters_per_degree_lat
+        return x, y
+
+    def to_latlon(self, x : np.ndarray, y : np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Inverse of `to_xy`.
+        """
+        latitudes = self.latitude + np.asarray(y, dtype=np.float64) / self.meters_per_degree_lat
+        longitudes = self.longitude + np.asarray(x, dtype=np.float64) / self.meters_per_degree_lon
+        return latitudes, longitudes
+
+    def planar_distance(self, lat1 : float, lon1 : float, lat2 : float, lon2 : float) -> float:
+        """
+        Euclidean distance in meters between two points on the projection.
+        """
+        dx = (lon2 - lon1) * self.meters_per_degree_lon
+        dy = (lat2 - lat1) * self.meters_per_degree_lat
+        return sqrt(dx*dx + dy*dy)
+
+    def planar_distances(self, lats1 : np.ndarray, lons1 : np.ndarray, lats2 : np.ndarray, lons2 : np.ndarray) -> np.ndarray:
+        """
+        Element-wise `planar_distance`, the inputs are broadcast against each other.
+        """
+        x1, y1 = self.to_xy(lats1, lons1)
+        x2, y2 = self.to_xy(lats2, lons2)
+        return np.hypot(x2 - x1, y2 - y1)
+
+    def max_error(self, latitudes : np.ndarray, longitudes : np.ndarray, sample : int = 2_000) -> dict:
+        """
+        Worst-case error of the planar distances against haversine over every pair of the given points.
+        Only a random sample of the points is compared when there are more than `sample`.
+
+        Returns:
+            dict: The largest absolute error in meters and the largest error relative to the haversine distance.
+        """
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        if len(latitudes) > sample:
+            chosen = np.random.default_rng(0).choice(len(latitudes), sample, replace=False)
+            latitudes, longitudes = latitudes[chosen], longitudes[chosen]
+
+        exact = haversine_matrix(latitudes, longitudes, latitudes, longitudes)
+        planar = self.planar_distances(latitudes[:, np.newaxis], longitudes[:, np.newaxis], latitudes[np.newaxis, :], longitudes[np.newaxis, :])
+        error = np.abs(planar - exact)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            relative = np.where(exact > 0, error / exact, 0.0)
+        return {
+            "max_abs_error_m": float(error.max(initial=0.0)),
+            "max_rel_error": float(relative.max(initial=0.0))
+        }
+
+def set_projection(projection : LocalProjection | None) -> None:
+    """
+    Switch to planar mode with the given projection, or back to exact (haversine) mode with None.
+    """
+    global _projection
+    _projection = projection
+
+def current_projection() -> LocalProjection | None:
+    """
+    Get the projection of the planar mode, None when in exact mode.
+    """
+    return _projection
+
+def geo_distance(lat1 : float, lon1 : float, lat2 : float, lon2 : float) -> float:
+    """
+    Distance in meters between two points in the current mode: haversine, or Euclidean on the projection.
+    """
+    if _projection is None:
+        return haversine_distance(lat1, lon1, lat2, lon2)
+    return _projection.planar_distance(lat1, lon1, lat2, lon2)
+
+def geo_distances(lat : float, lon : float, lats : np.ndarray, lons : np.ndarray) -> np.ndarray:
+    """
+    Distances in meters from one point to many in the current mode. See `haversine_distances`.
+    """
+    if _projection is None:
+        return haversine_distances(lat, lon, lats, lons)
+    return _projection.planar_distances(lat, lon, lats, lons)
+
+def geo_distance_matrix(lats1 : np.ndarray, lons1 : np.ndarray, lats2 : np.ndarray, lons2 : np.ndarray) -> np.ndarray:
+    """
+    Distances in meters between every pair of points of two sets in the current mode. See `haversine_matrix`.
+    """
+    if _projection is None:
+        return haversine_matrix(lats1, lons1, lats2, lons2)
+    return _projection.planar_distances(
+        np.asarray(lats1, dtype=np.float64)[:, np.newaxis], np.asarray(lons1, dtype=np.float64)[:, np.newaxis],
+        np.asarray(lats2, dtype=np.float64)[np.newaxis, :], np.asarray(lons2, dtype=np.float64)[np.newaxis, :]
+    )
@@ -0,0 +1,132 @@
+import numpy as np
+
+from misc.distance import geo_distance, geo_distance_matrix
+
+MAX_MATRIX_POINTS = 5_000 # Above this the matrix takes hundreds of megabytes, so it is not built
+
+_shared_matrix = None
+
+class DistanceMatrix:
+    """
+    Pairwise distances, in meters, between the fixed points of a scenario (warehouses and order destinations).
+    Warehouses and orders never move, so the matrix is built once when the scenario is loaded
+    and looked up by index afterwards. Distances follow the mode of `misc.distance` at build time.
+
+    Example of usage:
+    ```py
+    matrix = DistanceMatrix.from_scenario(warehouses, dtype=np.float32)
+    set_shared_matrix(matrix)
+
+    matrix.between("center1", "order1_1")
+    ```
+
+    Args:
+        points (dict[str, tuple[float, float]]): The latitude and longitude of every point, by id.
+        dtype (type, optional): The float type of the matrix, np.float32 halves its size. Defaults to np.float64.
+
+    Attributes:
+        ids (list[str]): The id of the point in each row/column.
+        index (dict[str, int]): The row/column of each point id.
+        matrix (np.ndarray): The distances between every pair of points.
+    """
+    def __init__(self, points : dict[str, tuple[float, float]], dtype : type = np.float64) -> None:
+        self.ids : list[str] = list(points.keys())
+        self.index : dict[str, int] = {point_id: i for i, point_id in enumerate(self.ids)}
+        self.__coordinates : dict[tuple[float, float], int] = {}
+
+        for i, point_id in enumerate(self.ids):
+            self.__coordinates.setdefault(points[point_id], i)
+
+        coordinates = np.array(list(points.values()), dtype=np.float64).reshape(-1, 2)
+        self.matrix : np.ndarray = geo_distance_matrix(
+            coordinates[:, 0], coordinates[:, 1],
+            coordinates[:, 0], coordinates[:, 1]
+        ).astype(dtype, copy=False)
+
+    @classmethod
+    def from_scenario(cls, warehouses : list[tuple[dict, list[dict]]], dtype : type = np.float64) -> "DistanceMatrix":
+        """
+        Build the matrix from the warehouses and orders returned by `parse_data`.
+
+        Args:
+            warehouses (list[tuple[dict, list[dict]]]): Each warehouse with its orders.
+            dtype (type, optional): The float type of the matrix. Defaults to np.float64.
+
+        Returns:
+            DistanceMatrix: The distances between every warehouse and order destination.
+        """
+        points : dict[str, tuple[float, float]] = {}
+        for warehouse, orders in warehouses:
+            points[warehouse["id"]] = (warehouse["latitude"], warehouse["longitude"])
+            for order in orders:
+                points[order["id"]] = (order["latitude"], order["longitude"])
+        return cls(points, dtype)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, point_id : str) -> bool:
+        return point_id in self.index
+
+    def locate(self, latitude : float, longitude : float) -> int | None:
+        """
+        Find the point that sits exactly at the given coordinates.
+
+        Args:
+            latitude (float): The latitude of the position.
+            longitude (float): The longitude of the position.
+
+        Returns:
+            int | None: The row/column of the point, None if there isn't one at that position.
+        """
+        return self.__coordinates.get((latitude, longitude))
+
+    def item(self, i : int, j : int) -> float:
+        """
+        Get the distance between two points by index.
+
+        Returns:
+            float: The distance in meters.
+        """
+        return self.matrix.item(i, j)
+
+    def between(self, id1 : str, id2 : str) -> float:
+        """
+        Get the distance between two points by id.
+
+        Returns:
+            float: The distance in meters.
+        """
+        return self.matrix.item(self.index[id1], self.index[id2])
+
+    def distance(self, lat1 : float, lon1 : float, lat2 : float, lon2 : float) -> float:
+        """
+        Distance between two positions, looked up when both are points of the matrix.
+        Falls back to computing it otherwise (e.g. a drone in the middle of a flight).
+
+        Returns:
+            float: The distance in meters.
+        """
+        i = self.__coordinates.get((lat1, lon1))
+        j = self.__coordinates.get((lat2, lon2))
+        if i is None or j is None:
+            return geo_distance(lat1, lon1, lat2, lon2)
+        return self.matrix.item(i, j)
+
+    def nbytes(self) -> int:
+        return self.matrix.nbytes
+
+# ----------------------------------------------------------------------------------------------
+
+def set_shared_matrix(matrix : DistanceMatrix | None) -> None:
+    """
+    Share a distance matrix with every agent of the process. None stops using it.
+    """
+    global _shared_matrix
+    _shared_matrix = matrix
+
+def shared_matrix() -> DistanceMatrix | None:
+    """
+    Get the distance matrix shared by the agents of the process, if any.
+    """
+    return _shared_matrix
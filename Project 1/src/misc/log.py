@@ -1,16 +1,22 @@
 import logging
 
+_handlers : dict[str, logging.FileHandler] = {} # a single open file per path, however many loggers write to it
 
 class Logger:
-    def __init__(self, *, filename : str) -> None:
-        self.logger = logging.getLogger(filename)
+    def __init__(self, *, filename : str, name : str | None = None) -> None:
+        self.logger = logging.getLogger(name or filename)
         filepath = "logs/" + filename + ".log"
-        
-        handler = logging.FileHandler(filepath)
-        formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-        handler.setFormatter(formatter)
-        self.logger.addHandler(handler)
+
+        # Agents sharing a file, e.g. the entities of a host, are told apart by their name
+        handler = _handlers.get(filepath)
+        if handler is None:
+            handler = logging.FileHandler(filepath)
+            formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+            handler.setFormatter(formatter)
+            _handlers[filepath] = handler
+        if handler not in self.logger.handlers:
+            self.logger.addHandler(handler)
         self.logger.setLevel(logging.INFO)
-    
+
     def log(self, message):
-        self.logger.info(message)    
\ No newline at end of file
+        self.logger.info(message)
\ No newline at end of file
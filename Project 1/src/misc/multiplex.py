@@ -0,0 +1,159 @@
+from spade.agent import Agent
+from spade.behaviour import CyclicBehaviour
+from spade.message import Message
+from spade.trace import TraceStore
+
+from misc.log import Logger
+from misc.transport import LocalTransportMixin
+
+# ----------------------------------------------------------------------------------------------
+
+METADATA_ENTITY_TO = "entity_to"     # the logical recipient of a message relayed between hosts
+METADATA_ENTITY_FROM = "entity_from" # its logical sender
+
+HOSTED_TRACES = 0 # messages each hosted entity keeps in its SPADE trace store, nothing reads it
+
+# ----------------------------------------------------------------------------------------------
+
+class HostedRoute:
+    """
+    Stands in the container for an entity hosted by another host, so that entities send to it as to a
+    local agent. The container hands it the messages, and it relays them through the local host.
+    """
+    def __init__(self, jid : str, host : "HostAgent") -> None:
+        self.jid : str = jid
+        self.host : HostAgent = host
+
+    def set_container(self, container) -> None:
+        pass
+
+    def set_loop(self, loop) -> None:
+        pass
+
+    def dispatch(self, msg : Message) -> list:
+        return [self.host.submit(self.host.relay.forward(msg))]
+
+class RelayBehaviour(CyclicBehaviour):
+    '''
+    Relays the messages of the entities of a host to the entities of other hosts, and back
+
+    Args:
+        CyclicBehaviour (CyclicBehaviour): Base class for cyclic behaviours
+    '''
+    async def forward(self, msg : Message) -> None:
+        '''
+        Send the message of a hosted entity to the host of its recipient, which gets its logical
+        recipient and sender from the metadata
+
+        Args:
+            msg (Message): The message, addressed to the logical recipient
+        '''
+        relayed = Message(to=self.agent.routes[str(msg.to)], body=msg.body, thread=msg.thread, metadata=dict(msg.metadata))
+        relayed.set_metadata(METADATA_ENTITY_TO, str(msg.to))
+        relayed.set_metadata(METADATA_ENTITY_FROM, str(msg.sender))
+        await self.send(relayed)
+        self.agent.relayed_out += 1
+
+    async def run(self):
+        msg = await self.receive(timeout=10)
+        if msg is None:
+            return
+        metadata = dict(msg.metadata)
+        to, sender = metadata.pop(METADATA_ENTITY_TO, None), metadata.pop(METADATA_ENTITY_FROM, None)
+        entity = self.agent.entities.get(to)
+        if entity is None or sender is None:
+            self.agent.logger.log(f"[RELAY] - Dropped a message from {msg.sender} to unknown entity {to}")
+            return
+        # Replies to the sender go back through the host it came from
+        self.agent.add_route(sender, str(msg.sender))
+        self.agent.relayed_in += 1
+        entity.dispatch(Message(to=to, sender=sender, body=msg.body, thread=msg.thread, metadata=metadata))
+
+# ----------------------------------------------------------------------------------------------
+
+class HostAgent(LocalTransportMixin, Agent):
+    """
+    A SPADE agent that hosts many logical entities, each a full agent with its own behaviours, over the
+    connection of the host only.
+
+    Hosted entities never connect to the server: they start like with the local transport, keep no
+    message trace and have no SPADE web interface, so each costs little more than its own state, and they
+    log to the file of their host when given it as `log_file`. Messages between entities of the same
+    process go through SPADE's container as always.
+
+    Messages to an entity of another host, i.e. another process, are relayed: the sender's host sends
+    them to the recipient's host, with the logical recipient and sender in the metadata, and that host
+    dispatches them to the entity. Routes to remote entities are given with `add_route` or learned from
+    the messages they send, so replies find their way back.
+
+    Example of usage:
+    ```py
+    host = HostAgent("fleet", "fleet@localhost", password, drones)
+    host.add_route("center1@localhost", "warehouses@localhost")
+    await host.start() # starts the drones too
+    ```
+
+    Args:
+        id (str): The id of the host, also the name of its log file.
+        jid (str): The jid of the host, the only one that connects.
+        password (str): The password of the jid.
+        entities (list[Agent]): The entities it hosts.
+
+    Attributes:
+        entities (dict[str, Agent]): The hosted entities, by jid.
+        routes (dict[str, str]): The jid of the host of each known remote entity, by jid of the entity.
+        relayed_in (int): The messages relayed to the hosted entities.
+        relayed_out (int): The messages relayed from them.
+    """
+    def __init__(self, id : str, jid : str, password : str, entities : list[Agent]) -> None:
+        super().__init__(jid, password)
+        self.id : str = id
+        self.entities : dict[str, Agent] = {}
+        self.routes : dict[str, str] = {}
+        self.relayed_in : int = 0
+        self.relayed_out : int = 0
+        self.logger : Logger = Logger(filename=id)
+        self.relay : RelayBehaviour = RelayBehaviour()
+        for entity in entities:
+            self.host(entity)
+
+    def host(self, entity : Agent) -> None:
+        """
+        Host an entity, before it starts.
+        """
+        entity.host = self
+        entity.traces = TraceStore(size=HOSTED_TRACES)
+        entity.web = None # SPADE's web interface of a single agent, never started for hosted entities
+        self.entities[str(entity.jid)] = entity
+
+    def add_route(self, entity_jid : str, host_jid : str) -> None:
+        """
+        Relay the messages to a remote entity through its host. Entities of the process are reached directly.
+
+        Args:
+            entity_jid (str): The jid of the entity.
+            host_jid (str): The jid of its host.
+        """
+        if entity_jid in self.entities or (self.container.has_agent(entity_jid) and entity_jid not in self.routes):
+            return
+        if entity_jid not in self.routes:
+            self.container.register(HostedRoute(entity_jid, self))
+        self.routes[entity_jid] = host_jid
+
+    async def setup(self) -> None:
+        self.logger.log(f"{self.id} - [SETUP] - hosting {len(self.entities)} entities")
+        self.add_behaviour(self.relay)
+
+    async def start(self, auto_register : bool = True) -> None:
+        await super().start(auto_register=auto_register)
+        for entity in self.entities.values():
+            await entity.start()
+
+    async def stop(self) -> None:
+        for entity in self.entities.values():
+            if entity.is_alive():
+                await entity.stop()
+        self.logger.log(f"[RELAY] - {self.relayed_in} messages in, {self.relayed_out} out")
+        await super().stop()
+
+# ----------------------------------------------------------------------------------------------
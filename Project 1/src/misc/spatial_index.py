@@ -0,0 +1,299 @@
+import heapq
+from math import radians, cos, sin, pi
+from typing import Hashable, Iterable
+
+from misc.distance import current_projection, earth_radius, geo_distance
+
+REBUILD_RATIO = 0.5 # Rebuild the tree once this fraction of its points was removed or added since the last build
+
+# ----------------------------------------------------------------------------------------------
+
+class _Node:
+    __slots__ = ("key", "point", "axis", "left", "right", "parent", "alive")
+
+    def __init__(self, key : Hashable, point : tuple, axis : int) -> None:
+        self.key = key
+        self.point : tuple = point
+        self.axis : int = axis
+        self.left : _Node | None = None
+        self.right : _Node | None = None
+        self.parent : _Node | None = None
+        self.alive : int = 1 # Number of points in this subtree that were not removed
+
+# ----------------------------------------------------------------------------------------------
+
+class SpatialIndex:
+    """
+    KD-tree over positions given in latitude/longitude, answering nearest, k-nearest and radius queries
+    in sub-linear time.
+
+    In exact mode the points are stored as 3-D vectors on the sphere, where straight-line distance grows
+    with the haversine distance, so results come out in the same order as a haversine scan. In planar mode
+    (see `misc.distance.set_projection`) they are stored on the projection. The mode is read when the
+    index is built.
+
+    Removed points are only marked as such, and new points wait in a small list that is scanned linearly;
+    the tree is rebuilt once either grows past REBUILD_RATIO of its size.
+
+    Example of usage:
+    ```py
+    index = SpatialIndex({"center1": (18.994237, 72.825553), "center2": (18.927584, 72.832585)})
+    index.nearest(18.95, 72.83)        # "center2"
+    index.k_nearest(18.95, 72.83, k=2) # [("center2", 2518.4...), ("center1", 4708.7...)]
+    index.remove("center2")
+    ```
+
+    Args:
+        points (dict[Hashable, tuple[float, float]], optional): Latitude and longitude of each point, by key.
+    """
+    def __init__(self, points : dict[Hashable, tuple[float, float]] | None = None) -> None:
+        self.__positions : dict[Hashable, tuple[float, float]] = dict(points or {})
+        self.__root : _Node | None = None
+        self.__nodes : dict[Hashable, _Node] = {}
+        self.__pending : dict[Hashable, tuple] = {}
+        self.__removed : int = 0
+        self.__rebuild()
+
+    # ----------------------------------------------------------------------------------------------
+
+    def __to_point(self, latitude : float, longitude : float) -> tuple:
+        if self.__projection is not None:
+            return ((longitude - self.__projection.longitude) * self.__projection.meters_per_degree_lon,
+                    (latitude - self.__projection.latitude) * self.__projection.meters_per_degree_lat)
+        lat, lon = radians(latitude), radians(longitude)
+        return (cos(lat) * cos(lon), cos(lat) * sin(lon), sin(lat))
+
+    def __to_search_radius(self, radius : float) -> float:
+        # Radius in meters to a radius in the coordinates of the tree
+        if self.__projection is not None:
+            return radius
+        return 2 * sin(min(radius / earth_radius("m"), pi) / 2)
+
+    def __rebuild(self) -> None:
+        self.__projection = current_projection()
+        entries = [(key, self.__to_point(*position)) for key, position in self.__positions.items()]
+        self.__nodes = {}
+        self.__pending = {}
+        self.__removed = 0
+        self.__root = self.__build(entries, 0)
+
+    def __build(self, entries : list, depth : int) -> _Node | None:
+        if not entries:
+            return None
+        axis = depth % len(entries[0][1])
+        entries.sort(key=lambda entry: entry[1][axis])
+        median = len(entries) // 2
+
+        node = _Node(entries[median][0], entries[median][1], axis)
+        self.__nodes[node.key] = node
+        node.left = self.__build(entries[:median], depth + 1)
+        node.right = self.__build(entries[median + 1:], depth + 1)
+        for child in (node.left, node.right):
+            if child is not None:
+                child.parent = node
+        node.alive = len(entries)
+        return node
+
+    def __needs_rebuild(self) -> bool:
+        return self.__removed + len(self.__pending) > max(len(self.__nodes), 8) * REBUILD_RATIO
+
+    # ----------------------------------------------------------------------------------------------
+
+    def __len__(self) -> int:
+        return len(self.__positions)
+
+    def __contains__(self, key : Hashable) -> bool:
+        return key in self.__positions
+
+    def __iter__(self) -> Iterable[Hashable]:
+        return iter(self.__positions)
+
+    def insert(self, key : Hashable, latitude : float, longitude : float) -> None:
+        """
+        Add a point to the index, replacing the one with the same key if there is one.
+        """
+        if key in self.__positions:
+            self.remove(key)
+        self.__positions[key] = (latitude, longitude)
+        self.__pending[key] = self.__to_point(latitude, longitude)
+        if self.__needs_rebuild():
+            self.__rebuild()
+
+    def remove(self, key : Hashable) -> None:
+        """
+        Remove a point from the index. Does nothing if the key isn't there.
+        """
+        if key not in self.__positions:
+            return
+        del self.__positions[key]
+        if self.__pending.pop(key, None) is not None:
+            return
+
+        # Update the number of points alive in every subtree holding the node
+        node = self.__nodes.pop(key)
+        while node is not None:
+            node.alive -= 1
+            node = node.parent
+        self.__removed += 1
+        if self.__needs_rebuild():
+            self.__rebuild()
+
+    def position(self, key : Hashable) -> tuple[float, float]:
+        """
+        Get the latitude and longitude of a point.
+        """
+        return self.__positions[key]
+
+    # ----------------------------------------------------------------------------------------------
+
+    def k_nearest(self, latitude : float, longitude : float, k : int = 1) -> list[tuple[Hashable, float]]:
+        """
+        Find the k points closest to the given position.
+
+        Args:
+            latitude (float): Latitude of the position.
+            longitude (float): Longitude of the position.
+            k (int, optional): Number of points to find. Defaults to 1.
+
+        Returns:
+            list[tuple[Hashable, float]]: Key and distance in meters of each point, closest first.
+        """
+        if k <= 0:
+            return []
+        query = self.__to_point(latitude, longitude)
+        best : list[tuple[float, int, Hashable]] = [] # max-heap of (-squared distance, tiebreak, key)
+        counter = 0
+
+        def consider(key : Hashable, point : tuple) -> None:
+            nonlocal counter
+            squared = sum((a - b) ** 2 for a, b in zip(point, query))
+            counter += 1
+            if len(best) < k:
+                heapq.heappush(best, (-squared, -counter, key))
+            elif squared < -best[0][0]:
+                heapq.heapreplace(best, (-squared, -counter, key))
+
+        def search(node : _Node | None) -> None:
+            if node is None or node.alive == 0:
+                return
+            if self.__nodes.get(node.key) is node:
+                consider(node.key, node.point)
+            difference = query[node.axis] - node.point[node.axis]
+            near, far = (node.left, node.right) if difference < 0 else (node.right, node.left)
+            search(near)
+            if len(best) < k or difference * difference < -best[0][0]:
+                search(far)
+
+        search(self.__root)
+        for key, point in self.__pending.items():
+            consider(key, point)
+
+        found = sorted(best, key=lambda entry: (-entry[0], -entry[1]))
+        return [(key, geo_distance(latitude, longitude, *self.__positions[key])) for _, _, key in found]
+
+    def nearest(self, latitude : float, longitude : float) -> Hashable | None:
+        """
+        Find the point closest to the given position.
+
+        Returns:
+            Hashable | None: The key of the closest point, None if the index is empty.
+        """
+        found = self.k_nearest(latitude, longitude, 1)
+        return found[0][0] if found else None
+
+    def within(self, latitude : float, longitude : float, radius : float) -> list[tuple[Hashable, float]]:
+        """
+        Find every point up to a given distance from a position.
+
+        Args:
+            latitude (float): Latitude of the position.
+            longitude (float): Longitude of the position.
+            radius (float): Maximum distance in meters.
+
+        Returns:
+            list[tuple[Hashable, float]]: Key and distance in meters of each point, closest first.
+        """
+        query = self.__to_point(latitude, longitude)
+        limit = self.__to_search_radius(radius)
+        squared_limit = limit * limit
+        found : list[Hashable] = []
+
+        def search(node : _Node | None) -> None:
+            if node is None or node.alive == 0:
+                return
+            if self.__nodes.get(node.key) is node and sum((a - b) ** 2 for a, b in zip(node.point, query)) <= squared_limit:
+                found.append(node.key)
+            difference = query[node.axis] - node.point[node.axis]
+            if difference - limit <= 0:
+                search(node.left)
+            if difference + limit >= 0:
+                search(node.right)
+
+        search(self.__root)
+        found.extend(key for key, point in self.__pending.items() if sum((a - b) ** 2 for a, b in zip(point, query)) <= squared_limit)
+
+        distances = [(key, geo_distance(latitude, longitude, *self.__positions[key])) for key in found]
+        return sorted((entry for entry in distances if entry[1] <= radius), key=lambda entry: entry[1])
+
+# ----------------------------------------------------------------------------------------------
+
+class IndexedPositions(dict):
+    """
+    Dictionary of positions by id, e.g. `{"center1": {"latitude": ..., "longitude": ..., "jid": ...}}`,
+    that keeps a `SpatialIndex` of its entries up to date. Can be used anywhere a plain dictionary of
+    positions is expected; `closest_warehouse` uses the index instead of scanning it.
+
+    Every method of dict that adds or removes entries is overridden to update the index too. It is
+    pickled as its entries, and the index is rebuilt from them.
+    """
+    def __init__(self, positions : dict | None = None) -> None:
+        super().__init__(positions or {})
+        self.index : SpatialIndex = SpatialIndex({
+            key: (position["latitude"], position["longitude"]) for key, position in self.items()
+        })
+
+    def __setitem__(self, key : str, position : dict) -> None:
+        super().__setitem__(key, position)
+        self.index.insert(key, position["latitude"], position["longitude"])
+
+    def __delitem__(self, key : str) -> None:
+        super().__delitem__(key)
+        self.index.remove(key)
+
+    def pop(self, key : str, *default):
+        if key not in self:
+            return super().pop(key, *default)
+        position = super().pop(key)
+        self.index.remove(key)
+        return position
+
+    def popitem(self) -> tuple[str, dict]:
+        key, position = super().popitem()
+        self.index.remove(key)
+        return key, position
+
+    def setdefault(self, key : str, default : dict | None = None) -> dict:
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *others, **positions) -> None:
+        for key, position in dict(*others, **positions).items():
+            self[key] = position
+
+    def __ior__(self, other) -> "IndexedPositions":
+        self.update(other)
+        return self
+
+    def clear(self) -> None:
+        super().clear()
+        self.index = SpatialIndex()
+
+    def copy(self) -> "IndexedPositions":
+        return IndexedPositions(self)
+
+    def __reduce__(self) -> tuple:
+        return (IndexedPositions, (dict(self),))
+
+    def nearest(self, latitude : float, longitude : float) -> str | None:
+        return self.index.nearest(latitude, longitude)
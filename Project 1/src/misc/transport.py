@@ -0,0 +1,68 @@
+from spade.behaviour import FSMBehaviour
+
+XMPP = "xmpp"
+LOCAL = "local"
+TRANSPORTS = (LOCAL, XMPP)
+
+_transport = LOCAL
+
+# ----------------------------------------------------------------------------------------------
+
+class LocalTransportMixin:
+    """
+    Lets a SPADE agent run without an XMPP server when the local transport is selected.
+
+    SPADE's container already hands a message straight to the receiving agent when both live in the
+    same process, through the same `dispatch` and behaviour templates as messages coming from the
+    server. What still needs the server is the connection every agent opens when it starts, so with
+    the local transport the agent skips it: `start` only runs `setup` and the behaviours, and `stop`
+    only kills them. `send`, `receive` and the message metadata work as with XMPP.
+
+    Agents hosted by a `misc.multiplex.HostAgent` start the same way whatever the transport, since only their host connects.
+
+    Must come before `Agent` in the bases of the agent, e.g. `class DroneAgent(LocalTransportMixin, Agent)`.
+    """
+    host = None # the HostAgent that hosts the agent, if any
+    
+    async def start(self, auto_register : bool = True) -> None:
+        if _transport != LOCAL and self.host is None:
+            return await super().start(auto_register=auto_register)
+
+        await self.setup()
+        self._alive.set()
+        for behaviour in self.behaviours:
+            if not behaviour.is_running:
+                behaviour.set_agent(self)
+                if isinstance(behaviour, FSMBehaviour):
+                    for state in behaviour.get_states().values():
+                        state.set_agent(self)
+                behaviour.start()
+
+    async def stop(self) -> None:
+        if _transport != LOCAL and self.host is None:
+            return await super().stop()
+
+        for behaviour in self.behaviours:
+            behaviour.kill()
+        self._alive.clear()
+
+# ----------------------------------------------------------------------------------------------
+
+def set_transport(name : str) -> None:
+    """
+    Choose how the agents of the process exchange messages: in memory, or through the prosody server.
+    Must be called before the agents start.
+
+    Args:
+        name (str): One of TRANSPORTS.
+    """
+    global _transport
+    if name not in TRANSPORTS:
+        raise ValueError(f"Unknown transport {name}, expected one of {TRANSPORTS}.")
+    _transport = name
+
+def current_transport() -> str:
+    """
+    Get how the agents of the process exchange messages.
+    """
+    return _transport
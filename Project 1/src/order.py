@@ -1,21 +1,272 @@
-from typing import Any
+from typing import Any, Iterable
 import json
 
+import numpy as np
+
 STATUS = {
     "FREE": False,
     "DELIVERED": True,
     "TAKEN": True
 }
 
+# Codes of the status column of an OrderTable
+FREE, TAKEN, DELIVERED = 0, 1, 2
+
+# ----------------------------------------------------------------------------------------------
+
+class OrderTable:
+    """
+    Column store of orders: one NumPy array per field instead of one Python object per order.
+    Each warehouse owns the table of its inventory, and `DeliveryOrder` objects are small views
+    on one of its rows. The columns can also be read directly for vectorised computations.
+    
+    Example of usage:
+    ```py
+    table = OrderTable.from_records(orders, warehouse["latitude"], warehouse["longitude"])
+    order = table["order1_1"]      # DeliveryOrder view
+    table.column("dest_lat")       # destination latitude of every order
+    ```
+    
+    Args:
+        capacity (int, optional): Number of rows to allocate up front. Defaults to 16.
+        
+    Attributes:
+        ids (list[str]): The id of the order in each row.
+        index (dict[str, int]): The row of each order id.
+    """
+    COLUMNS = {
+        "origin_lat": np.float64,
+        "origin_lon": np.float64,
+        "dest_lat": np.float64,
+        "dest_lon": np.float64,
+        "weight": np.int32,
+        "status": np.int8
+    }
+    
+    def __init__(self, capacity : int = 16) -> None:
+        self.ids : list[str] = []
+        self.index : dict[str, int] = {}
+        self.frozen : bool = False
+        self.__views : list[DeliveryOrder] = []
+        self.__columns : dict[str, np.ndarray] = {
+            name: np.zeros(max(capacity, 1), dtype=dtype) for name, dtype in self.COLUMNS.items()
+        }
+    
+    @classmethod
+    def from_records(cls, records : list[dict], origin_lat : float, origin_long : float) -> "OrderTable":
+        """
+        Build the table of a warehouse from the orders returned by `parse_data`.
+        
+        Args:
+            records (list[dict]): The orders, with id, latitude, longitude and weight.
+            origin_lat (float): The latitude of the warehouse.
+            origin_long (float): The longitude of the warehouse.
+            
+        Returns:
+            OrderTable: The table, with every order free.
+        """
+        return cls.from_columns(
+            [record["id"] for record in records],
+            origin_lat,
+            origin_long,
+            [record["latitude"] for record in records],
+            [record["longitude"] for record in records],
+            [record["weight"] for record in records]
+        )
+    
+    @classmethod
+    def from_columns(cls, ids : list[str], origin_lat, origin_long, dest_lat, dest_long, weight) -> "OrderTable":
+        """
+        Build a table from whole columns at once, e.g. decoded from a message.
+        Every column but the ids can be a sequence or a single value shared by all the orders.
+        
+        Returns:
+            OrderTable: The table, with every order free.
+        """
+        table = cls(len(ids))
+        size = len(ids)
+        values = (origin_lat, origin_long, dest_lat, dest_long, weight)
+        for name, value in zip(("origin_lat", "origin_lon", "dest_lat", "dest_lon", "weight"), values):
+            table.__columns[name][:size] = value
+        for order_id in ids:
+            table.__add_row(order_id)
+        return table
+    
+    # ----------------------------------------------------------------------------------------------
+    
+    def __len__(self) -> int:
+        return len(self.ids)
+    
+    def __contains__(self, order_id : str) -> bool:
+        return order_id in self.index
+    
+    def __getitem__(self, order_id : str) -> "DeliveryOrder":
+        return self.__views[self.index[order_id]]
+    
+    def __iter__(self) -> Iterable["DeliveryOrder"]:
+        return iter(self.__views)
+    
+    def __add_row(self, order_id : str) -> "DeliveryOrder":
+        row = len(self.ids)
+        self.ids.append(order_id)
+        self.index[order_id] = row
+        view = DeliveryOrder.view(self, row)
+        self.__views.append(view)
+        return view
+    
+    def append(self, id : str, origin_lat : float, origin_long : float, dest_lat : float, dest_long : float, weight : int) -> "DeliveryOrder":
+        """
+        Add an order to the table, growing the columns if they are full.
+        
+        Returns:
+            DeliveryOrder: The view on the new row.
+        """
+        if self.frozen:
+            raise Exception("Orders can't be added to a frozen table.")
+        row = len(self.ids)
+        if row == len(self.__columns["weight"]):
+            for name, column in self.__columns.items():
+                grown = np.zeros(2 * len(column), dtype=column.dtype)
+                grown[:row] = column
+                self.__columns[name] = grown
+        
+        values = (origin_lat, origin_long, dest_lat, dest_long, weight, FREE)
+        for column, value in zip(self.__columns.values(), values):
+            column[row] = value
+        return self.__add_row(id)
+    
+    def column(self, name : str) -> np.ndarray:
+        """
+        Get a column of the table, one entry per row. The array is a view, not a copy.
+        
+        Args:
+            name (str): One of origin_lat, origin_lon, dest_lat, dest_lon, weight and status.
+        """
+        return self.__columns[name][:len(self.ids)]
+    
+    def item(self, name : str, row : int) -> Any:
+        return self.__columns[name].item(row)
+    
+    def set_item(self, name : str, row : int, value : Any) -> None:
+        self.__columns[name][row] = value
+    
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in self.__columns.values())
+    
+    def freeze(self) -> None:
+        """
+        Make every column but the status read-only and stop rows from being added.
+        """
+        self.frozen = True
+        for name, column in self.__columns.items():
+            if name != "status":
+                column.flags.writeable = False
+
+# ----------------------------------------------------------------------------------------------
+
+class OrderCatalog:
+    """
+    Every order of the scenario, loaded once and shared by all the agents of the process.
+    The fields of an order never change, so they are frozen, and each order has a single view that
+    warehouses and drones both hold. Only the status is mutable, so it can't diverge between copies.
+    Messages can then name orders by id instead of carrying them (see the catalog codec of `misc.codec`).
+    
+    Example of usage:
+    ```py
+    catalog = OrderCatalog.from_scenario(warehouses)
+    set_catalog(catalog)
+    shared_catalog().resolve(["order1_1", "order2_1"]) # the DeliveryOrder views
+    ```
+    
+    Args:
+        table (OrderTable): The table of every order. It is frozen.
+    """
+    def __init__(self, table : OrderTable) -> None:
+        table.freeze()
+        self.table : OrderTable = table
+    
+    @classmethod
+    def from_scenario(cls, warehouses : list) -> "OrderCatalog":
+        """
+        Build the catalog of the warehouses and orders returned by `parse_data`.
+        
+        Returns:
+            OrderCatalog: The catalog, with every order free.
+        """
+        records = [(warehouse, order) for warehouse, orders in warehouses for order in orders]
+        return cls(OrderTable.from_columns(
+            [order["id"] for _, order in records],
+            [warehouse["latitude"] for warehouse, _ in records],
+            [warehouse["longitude"] for warehouse, _ in records],
+            [order["latitude"] for _, order in records],
+            [order["longitude"] for _, order in records],
+            [order["weight"] for _, order in records]
+        ))
+    
+    def __len__(self) -> int:
+        return len(self.table)
+    
+    def __contains__(self, order_id : str) -> bool:
+        return order_id in self.table
+    
+    def __getitem__(self, order_id : str) -> "DeliveryOrder":
+        return self.table[order_id]
+    
+    def resolve(self, ids : list[str], statuses : Iterable[int] | None = None) -> list["DeliveryOrder"]:
+        """
+        Get the orders with the given ids, without building anything.
+        
+        Args:
+            ids (list[str]): The ids of the orders.
+            statuses (Iterable[int] | None, optional): Status codes sent along with the ids, written to the
+                catalog when they are ahead of it, e.g. when the sender runs in another process. A status
+                only moves forward (FREE, TAKEN, DELIVERED), so a late message never undoes a newer one. Defaults to None.
+        
+        Returns:
+            list[DeliveryOrder]: The view of each order, in the same order as the ids.
+        
+        Raises:
+            KeyError: If an id isn't in the catalog.
+        """
+        orders = [self.table[order_id] for order_id in ids]
+        if statuses is not None:
+            for order, status in zip(orders, statuses):
+                if status > self.table.item("status", order.row):
+                    self.table.set_item("status", order.row, status)
+        return orders
+
+_catalog : OrderCatalog | None = None
+
+def set_catalog(catalog : OrderCatalog | None) -> None:
+    """
+    Share an order catalog with every agent of the process. None stops using it.
+    """
+    global _catalog
+    _catalog = catalog
+
+def shared_catalog() -> OrderCatalog | None:
+    """
+    Get the order catalog shared by the agents of the process, if any.
+    """
+    return _catalog
+
+# ----------------------------------------------------------------------------------------------
+
 class DeliveryOrder:
     """
     DeliveryOrder class to represent a delivery order.
     In a future implementation, in a given time interval, each delivery current position will be updated
     to be displayed in a map.
+    
+    An order is a view on a row of an `OrderTable`. The fields read in the planning loops (id, weight and
+    destination) are kept on the view itself, the rest is read from the table.
     """
+    __slots__ = ("id", "weight", "dest_lat", "dest_lon", "table", "row")
+    
     def __init__(self, id : str, origin_lat : float, origin_long : float, dest_lat : float, dest_long : float, weight : int) -> None:
         """
         DeliveryOrder class to represent a delivery order.
+        The order gets a table of its own, with a single row, freed along with it.
         
         Args:
             id (str): The order id.
@@ -25,26 +276,49 @@ class DeliveryOrder:
             dest_long (float): The longitude of the destination position.
             weight (int): The weight of the order.
         """
-        self.id : str = id
-        self.weight : int = weight
+        self.__bind(OrderTable.from_columns([id], origin_lat, origin_long, dest_lat, dest_long, weight), 0)
         
-        self.start_position : dict = {
-            "latitude": origin_lat,
-            "longitude": origin_long
+    @classmethod
+    def view(cls, table : OrderTable, row : int) -> "DeliveryOrder":
+        """
+        Get a view on a row of a table, without adding anything to it.
+        """
+        order = cls.__new__(cls)
+        order.__bind(table, row)
+        return order
+    
+    def __bind(self, table : OrderTable, row : int) -> None:
+        self.table : OrderTable = table
+        self.row : int = row
+        self.id : str = table.ids[row]
+        self.weight : int = table.item("weight", row)
+        self.dest_lat : float = table.item("dest_lat", row)
+        self.dest_lon : float = table.item("dest_lon", row)
+    
+    @property
+    def start_position(self) -> dict:
+        return {
+            "latitude": self.table.item("origin_lat", self.row),
+            "longitude": self.table.item("origin_lon", self.row)
         }
-        self.destination_position : dict = {
-            "latitude": dest_lat,
-            "longitude": dest_long
+    
+    @property
+    def destination_position(self) -> dict:
+        return {
+            "latitude": self.dest_lat,
+            "longitude": self.dest_lon
         }
-        
-        self.order_status : bool = STATUS["FREE"]
+    
+    @property
+    def order_status(self) -> bool:
+        return self.table.item("status", self.row) != FREE
         
     def mark_as_taken(self) -> None:
         """
         Mark the order as taken by a drone.
         """
         if self.order_status == STATUS["FREE"]:
-            self.order_status = STATUS["TAKEN"]
+            self.table.set_item("status", self.row, TAKEN)
         else:
             raise Exception("Order is not available to be taken.")
 
@@ -53,7 +327,7 @@ class DeliveryOrder:
         Mark the order as delivered by a drone.
         """
         if self.order_status == STATUS["TAKEN"]:
-            self.order_status = STATUS["DELIVERED"]
+            self.table.set_item("status", self.row, DELIVERED)
         else:
             raise Exception("Order cannot be delivered as it hasn't been taken.")
 
@@ -75,8 +349,8 @@ class DeliveryOrder:
         """
         return {
             "id": self.id,
-            "latitude": self.destination_position['latitude'],
-            "longitude": self.destination_position['longitude'],
+            "latitude": self.dest_lat,
+            "longitude": self.dest_lon,
             "status": self.order_status,
             "type": "order"
         }
@@ -94,8 +368,8 @@ class DeliveryOrder:
         return "Order {} - from {} to {} with weight {}"\
             .format(self.id, (self.start_position['latitude'], 
                               self.start_position['longitude']), 
-                            (self.destination_position['latitude'], 
-                            self.destination_position['longitude']), 
+                            (self.dest_lat, 
+                            self.dest_lon), 
                     self.weight)        
             
     def __repr__(self) -> str:
@@ -103,8 +377,8 @@ class DeliveryOrder:
             "id": self.id,
             "origin_lat": self.start_position['latitude'],
             "origin_long": self.start_position['longitude'],
-            "dest_lat": self.destination_position['latitude'],
-            "dest_long": self.destination_position['longitude'],
+            "dest_lat": self.dest_lat,
+            "dest_long": self.dest_lon,
             "weight": self.weight
         })
         
@@ -114,8 +388,14 @@ class DeliveryOrder:
     def __lt__(self, weight : float) -> bool:
         return self.weight < weight
     
-    def __eq__(self, id : str) -> bool:
-        return self.id == id
+    def __eq__(self, other) -> bool:
+        # Orders are compared by id, with each other or with an id
+        if isinstance(other, DeliveryOrder):
+            return self.id == other.id
+        return self.id == other
+    
+    def __hash__(self) -> int:
+        return hash(self.id)
     
     def __le__(self, weight : float) -> bool:
         return self.weight <= weight
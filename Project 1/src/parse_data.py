@@ -67,7 +67,14 @@ def parse_warehouses_and_orders(warehouse_and_orders : pd.DataFrame) -> list[dic
     
     return warehouse, orders.to_dict('records')
 
-def parse_data(isOriginalData : bool = True) -> tuple[list[dict], list[list]]:    
+def parse_data(isOriginalData : bool = True, create_users : bool = True) -> tuple[list[dict], list[list]]:    
+    """
+    Read the drones, warehouses and orders of a scenario.
+    
+    Args:
+        isOriginalData (bool, optional): Read the original data instead of the small one. Defaults to True.
+        create_users (bool, optional): Register the agents in the prosody server. Not needed by runs without XMPP. Defaults to True.
+    """
 
     if isOriginalData:
         folder = DATA_FOLDER + 'original/'
@@ -87,7 +94,8 @@ def parse_data(isOriginalData : bool = True) -> tuple[list[dict], list[list]]:
         + [warehouse_2_fields['id'].head(1).values[0]]
         
     # Create agents in prosody server
-    create_agents(agents_uids)
+    if create_users:
+        create_agents(agents_uids)
     
     # Setup delivery drones
     delivery_drones : list[dict] = parse_delivery_drones(delivery_drones_fields)
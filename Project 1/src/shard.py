@@ -0,0 +1,335 @@
+import asyncio
+import multiprocessing
+import queue
+from time import perf_counter
+
+from spade.container import Container
+from spade.message import Message
+
+from logic import DeliveryLogic, host_ids
+from order import OrderCatalog, set_catalog
+from misc.codec import set_codec
+from misc.distance import set_projection
+from misc.distance_matrix import set_shared_matrix
+from misc.transport import LOCAL, set_transport
+from drone.planner import set_planner, shutdown_planner
+
+# ----------------------------------------------------------------------------------------------
+
+GO = "go"     # every shard is ready, drones may start
+STOP = "stop" # every drone of every shard finished, warehouses may stop
+
+# Kinds of the items shards put in the outbox of the coordinator
+READY = "ready"
+FINISHED = "finished"
+RESULT = "result"
+EMIT = "emit"
+
+# ----------------------------------------------------------------------------------------------
+
+def partition(delivery_drones : list[dict], warehouses : list, shards : int) -> list[tuple[list[dict], list]]:
+    """
+    Split the scenario into regions. The region with the most orders is cut in two along its wider side,
+    at the warehouse that leaves about half of its orders on each side, until there are `shards` regions.
+    Each drone goes to the region of the warehouse it starts at.
+
+    Args:
+        delivery_drones (list[dict]): The drones returned by `parse_data`.
+        warehouses (list): The warehouses and their orders returned by `parse_data`.
+        shards (int): The number of regions. There are fewer if there are fewer warehouses.
+
+    Returns:
+        list[tuple[list[dict], list]]: The drones and the warehouses of each region.
+    """
+    regions = [list(warehouses)]
+    while len(regions) < shards:
+        splittable = [region for region in regions if len(region) > 1]
+        if not splittable:
+            break
+        region = max(splittable, key=lambda region: sum(len(orders) for _, orders in region))
+        lat_span = max(w["latitude"] for w, _ in region) - min(w["latitude"] for w, _ in region)
+        lon_span = max(w["longitude"] for w, _ in region) - min(w["longitude"] for w, _ in region)
+        axis = "latitude" if lat_span >= lon_span else "longitude"
+        region.sort(key=lambda item: item[0][axis])
+
+        total = sum(len(orders) for _, orders in region)
+        cut, weight = 1, len(region[0][1])
+        while cut < len(region) - 1 and weight + len(region[cut][1]) <= total / 2:
+            weight += len(region[cut][1])
+            cut += 1
+        regions.remove(region)
+        regions += [region[:cut], region[cut:]]
+
+    region_of = {warehouse["id"]: i for i, region in enumerate(regions) for warehouse, _ in region}
+    drones = [[] for _ in regions]
+    for drone in delivery_drones:
+        drones[region_of[drone["initialPos"]]].append(drone)
+    return list(zip(drones, regions))
+
+# ----------------------------------------------------------------------------------------------
+
+class RemoteAgent:
+    """
+    Stands in the container of a shard for an agent of another shard. The container hands it the
+    messages sent to that agent, like to any local agent, and it puts them in the inbox of the other shard.
+    """
+    def __init__(self, jid : str, inbox, router : "ShardRouter") -> None:
+        self.jid : str = jid
+        self.inbox = inbox
+        self.router : ShardRouter = router
+
+    def set_container(self, container) -> None:
+        pass
+
+    def set_loop(self, loop) -> None:
+        pass
+
+    def dispatch(self, msg : Message) -> list:
+        self.inbox.put((str(msg.to), str(msg.sender), msg.body, msg.thread, dict(msg.metadata)))
+        self.router.routed_out += 1
+        return []
+
+class ShardRouter:
+    """
+    Carries the messages between agents of different shards, through one inbox queue per shard.
+
+    `install` registers a `RemoteAgent` in the container of the shard for every agent of the other
+    shards, so agents send to them as to local agents. `pump` reads the inbox of the shard and dispatches
+    each message to its local recipient. The coordinator also puts GO and STOP in the inboxes.
+
+    With XMPP the server already carries messages between processes, so no agent is registered and
+    the inboxes only carry GO and STOP.
+
+    Args:
+        shard_of (dict[str, int]): The shard of each agent, or of each host with multiplexing, by jid. Empty with XMPP.
+        inboxes (list): The inbox queue of each shard.
+
+    Attributes:
+        routed_out (int): The messages sent to other shards.
+        routed_in (int): The messages received from other shards.
+    """
+    def __init__(self, shard_of : dict[str, int], inboxes : list) -> None:
+        self.shard_of : dict[str, int] = shard_of
+        self.inboxes : list = inboxes
+        self.routed_out : int = 0
+        self.routed_in : int = 0
+        self.started : asyncio.Event = asyncio.Event() # GO received
+        self.stopped : asyncio.Event = asyncio.Event() # STOP received
+
+    def install(self, shard : int) -> None:
+        """
+        Register the agents of the other shards in the container of this one.
+        """
+        container = Container()
+        for jid, other in self.shard_of.items():
+            if other != shard:
+                container.register(RemoteAgent(jid, self.inboxes[other], self))
+
+    async def pump(self, shard : int) -> None:
+        """
+        Dispatch the messages of the inbox of the shard to their recipients until STOP.
+        """
+        loop = asyncio.get_running_loop()
+        container = Container()
+        while True:
+            item = await loop.run_in_executor(None, self.inboxes[shard].get)
+            if item == GO:
+                self.started.set()
+            elif item == STOP:
+                self.stopped.set()
+                return
+            else:
+                to, sender, body, thread, metadata = item
+                self.routed_in += 1
+                if container.has_agent(to):
+                    container.get_agent(to).dispatch(Message(to=to, sender=sender, body=body, thread=thread, metadata=metadata))
+
+# ----------------------------------------------------------------------------------------------
+
+class ForwardingSocket:
+    """
+    Stands for the web app's socket in a shard, forwarding what the agents emit to the coordinator.
+    """
+    def __init__(self, outbox) -> None:
+        self.outbox = outbox
+
+    def emit(self, event : str, data) -> None:
+        self.outbox.put((EMIT, event, data))
+
+class ShardLogic(DeliveryLogic):
+    """
+    The `DeliveryLogic` of one shard: it waits for every shard to be ready before starting its drones,
+    and keeps its warehouses running until the drones of every shard finished, since they may ask them for orders.
+    """
+    def __init__(self, shard : int, router : ShardRouter, outbox, *args, **kwargs) -> None:
+        self.shard : int = shard
+        self.router : ShardRouter = router
+        self.outbox = outbox
+        self.started_at : float = perf_counter()
+        super().__init__(*args, **kwargs)
+
+    async def start_logic(self):
+        self.router.install(self.shard)
+        asyncio.create_task(self.router.pump(self.shard))
+        await self.start_warehouses()
+        await asyncio.sleep(2) # Wait for the warehouses to be ready
+        self.outbox.put((READY, self.shard, None))
+        await self.router.started.wait()
+
+        await self.start_drones()
+        await self.wait_drones()
+        self.outbox.put((FINISHED, self.shard, None))
+        await self.router.stopped.wait()
+        await self.stop_agents()
+        self.outbox.put((RESULT, self.shard, self.summary()))
+
+    def summary(self) -> dict:
+        """
+        Results of the shard, aggregated by the coordinator.
+        """
+        return {
+            "warehouses": len(self.warehouses),
+            "drones": len(self.delivery_drones),
+            "orders_delivered": sum(drone.params.orders_delivered for drone in self.delivery_drones),
+            "failed_drones": [drone.params.id for drone in self.delivery_drones if not getattr(drone, "died_successfully", False)],
+            "routed_out": self.router.routed_out,
+            "routed_in": self.router.routed_in,
+            "wall_time": round(perf_counter() - self.started_at, 3),
+            "event_loop": self.monitor.summary()
+        }
+
+def run_shard(shard : int, settings : dict, scenario : list, delivery_drones : list[dict], warehouses : list,
+              remote_warehouses : list[dict], router : "ShardRouter", outbox, logic_kwargs : dict) -> None:
+    """
+    Entry point of the process of a shard. Applies the process-wide settings of the coordinator, then runs
+    the warehouses and drones of the shard.
+
+    Args:
+        shard (int): The index of the shard.
+        settings (dict): The codec, transport, projection, distance matrix and planner of the coordinator.
+        scenario (list): Every warehouse and its orders, for the order catalog.
+        delivery_drones (list[dict]): The drones of the shard.
+        warehouses (list): The warehouses and orders of the shard.
+        remote_warehouses (list[dict]): The warehouses of the other shards, with the jid of their group with `multiplex`.
+        router (ShardRouter): The router between shards.
+        outbox: The queue of the coordinator.
+        logic_kwargs (dict): The options of `DeliveryLogic`.
+    """
+    set_codec(settings["codec"])
+    set_transport(settings["transport"])
+    set_projection(settings["projection"])
+    set_shared_matrix(settings["matrix"])
+    set_catalog(OrderCatalog.from_scenario(scenario))
+    set_planner(settings["planner"], settings["planner_workers"])
+
+    ShardLogic(shard, router, outbox, delivery_drones, warehouses, ForwardingSocket(outbox),
+               remote_warehouses=remote_warehouses, **logic_kwargs)
+    shutdown_planner()
+
+# ----------------------------------------------------------------------------------------------
+
+class ShardedSimulation:
+    """
+    Runs the simulation over several processes, one per region of the scenario (see `partition`), to use
+    more than one core. Drones ask the warehouses of other regions for orders through a `ShardRouter`,
+    or through the prosody server with the XMPP transport, which also lets the shards run as separate
+    deployments on the same host.
+
+    The coordinator waits for every shard to start its warehouses before letting drones start, forwards
+    what the shards emit to the web app, stops the warehouses once every drone finished and aggregates the results.
+
+    Example of usage:
+    ```py
+    summary = ShardedSimulation(delivery_drones, warehouses, socketio, shards=4, settings=settings).run()
+    ```
+
+    Args:
+        delivery_drones (list[dict]): The drones returned by `parse_data`.
+        warehouses (list): The warehouses and their orders returned by `parse_data`.
+        socketio (SocketIO): Where the shards' positions are emitted, None to emit nothing.
+        shards (int): The number of processes.
+        settings (dict): The codec, transport, projection, distance matrix and planner the shards run with.
+        **logic_kwargs: The options of `DeliveryLogic`.
+    """
+    def __init__(self, delivery_drones : list[dict], warehouses : list, socketio, shards : int, settings : dict, **logic_kwargs) -> None:
+        self.delivery_drones : list[dict] = delivery_drones
+        self.warehouses : list = warehouses
+        self.socketio = socketio
+        self.regions : list[tuple[list[dict], list]] = partition(delivery_drones, warehouses, shards)
+        self.settings : dict = settings
+        self.logic_kwargs : dict = logic_kwargs
+
+    def run(self) -> dict:
+        """
+        Run every shard until every drone finished.
+
+        Returns:
+            dict: The results of the run, aggregated over the shards.
+        """
+        started = perf_counter()
+        context = multiprocessing.get_context("spawn") # shards don't inherit the web app's threads
+        count = len(self.regions)
+        inboxes = [context.Queue() for _ in range(count)]
+        outbox = context.Queue()
+
+        # With multiplexing only the hosts of each shard exchange messages, they relay them to their entities
+        multiplex = self.logic_kwargs.get("multiplex", False)
+        shard_of, group_of = {}, {}
+        for shard, (drones, warehouses) in enumerate(self.regions):
+            if multiplex:
+                fleet_id, group_id = host_ids(warehouses)
+                shard_of.update({f"{fleet_id}@localhost": shard, f"{group_id}@localhost": shard})
+                group_of.update({warehouse["id"]: f"{group_id}@localhost" for warehouse, _ in warehouses})
+            else:
+                shard_of.update({drone["jid"]: shard for drone in drones})
+                shard_of.update({warehouse["jid"]: shard for warehouse, _ in warehouses})
+        router = ShardRouter(shard_of if self.settings["transport"] == LOCAL else {}, inboxes)
+
+        processes = []
+        for shard, (drones, warehouses) in enumerate(self.regions):
+            local = {warehouse["id"] for warehouse, _ in warehouses}
+            remote_warehouses = [
+                {**warehouse, "host": group_of[warehouse["id"]]} if multiplex else warehouse
+                for warehouse, _ in self.warehouses if warehouse["id"] not in local
+            ]
+            processes.append(context.Process(target=run_shard, name=f"shard{shard}", args=(
+                shard, self.settings, self.warehouses, drones, warehouses, remote_warehouses, router, outbox, self.logic_kwargs
+            )))
+        for process in processes:
+            process.start()
+
+        counts = {READY: 0, FINISHED: 0}
+        results : dict[int, dict] = {}
+        while len(results) < count:
+            try:
+                kind, first, second = outbox.get(timeout=1.0)
+            except queue.Empty:
+                failed = [process.name for process in processes if process.exitcode not in (None, 0)]
+                if failed:
+                    for process in processes:
+                        process.terminate()
+                    raise RuntimeError(f"Shards {failed} stopped before finishing.")
+                continue
+            if kind == EMIT:
+                if self.socketio is not None:
+                    self.socketio.emit(first, second)
+            elif kind == RESULT:
+                results[first] = second
+            else:
+                counts[kind] += 1
+                if counts[kind] == count:
+                    for inbox in inboxes:
+                        inbox.put(GO if kind == READY else STOP)
+        for process in processes:
+            process.join()
+
+        return {
+            "shards": count,
+            "wall_time": round(perf_counter() - started, 3),
+            "orders_delivered": sum(result["orders_delivered"] for result in results.values()),
+            "failed_drones": [drone for result in results.values() for drone in result["failed_drones"]],
+            "routed_messages": sum(result["routed_out"] for result in results.values()),
+            "per_shard": [results[shard] for shard in range(count)]
+        }
+
+# ----------------------------------------------------------------------------------------------
@@ -1,17 +1,23 @@
 # ----------------------------------------------------------------------------------------------
 
+import asyncio
 from spade.agent import Agent
+from misc.transport import LocalTransportMixin
+from misc.multiplex import HostAgent
 from flask_socketio import SocketIO
 
-from order import DeliveryOrder
+from order import DeliveryOrder, OrderTable, shared_catalog
 from misc.log import Logger
-from warehouse.behaviours import EmitSetupBehaviour, IdleBehaviour
-from warehouse.utils import OrdersMatrix
+from warehouse.behaviours import EmitSetupBehaviour, IdleBehaviour, ExpireReservationsBehaviour, AuctionBehaviour, PublishDigestBehaviour, \
+    MAX_CONCURRENT_REQUESTS, BATCH_WINDOW, DIGEST_PERIOD
+from warehouse.utils import OrdersMatrix, ServiceMetrics, InventoryDigest
             
 # ----------------------------------------------------------------------------------------------
 
-class WarehouseAgent(Agent):
-    def __init__(self, id : str, jid : str, password : str, latitude : float, longitude : float, orders : dict , socketio : SocketIO) -> None:
+class WarehouseAgent(LocalTransportMixin, Agent):
+    def __init__(self, id : str, jid : str, password : str, latitude : float, longitude : float, orders : dict , socketio : SocketIO, clock = None,
+                 max_concurrent_requests : int = MAX_CONCURRENT_REQUESTS, batch_window : float = BATCH_WINDOW,
+                 digest_period : float = DIGEST_PERIOD, log_file : str | None = None) -> None:
         super().__init__(jid, password)
         self.id : str = id
         self.latitude : float = latitude
@@ -20,33 +26,187 @@ class WarehouseAgent(Agent):
             "latitude": latitude,
             "longitude": longitude
         } 
-        self.inventory : dict[DeliveryOrder]= {}
-
-        for order in orders:
-            self.inventory[order["id"]] = DeliveryOrder(
-                order["id"],
-                self.position["latitude"],
-                self.position["longitude"],
-                order["latitude"],
-                order["longitude"],
-                order["weight"]
-            )
+        catalog = shared_catalog()
+        if catalog is not None and all(order["id"] in catalog for order in orders):
+            # Hold the catalog's orders, the same objects the drones resolve proposals to
+            self.orders_table : OrderTable = catalog.table
+            self.inventory : dict[str, DeliveryOrder] = {order["id"]: catalog[order["id"]] for order in orders}
+        else:
+            self.orders_table : OrderTable = OrderTable.from_records(orders, latitude, longitude)
+            self.inventory : dict[str, DeliveryOrder] = {order.id: order for order in self.orders_table}
         
         # See if we can get rid of this
         self.orders_to_be_picked : dict[str, list[DeliveryOrder]] = {}
 
-        self.logger = Logger(filename=id)
+        self.logger = Logger(filename=log_file or id, name=id)
         self.socketio = socketio
         self.orders_matrix : OrdersMatrix = OrdersMatrix(
                 self.inventory, 
-                divisions=5, 
                 capacity_multiplier=3,
-                warehouse_position=self.position
+                warehouse_position=self.position,
+                clock=clock
             )
+        
+        # Messages of different drones are served at the same time, the lock guards the inventory and the matrix.
+        # Only the orders matrix is ever touched from a worker thread, by the selections of orders, see `with_inventory`.
+        # The inventory and the orders to be picked are only touched on the event loop.
+        self.max_concurrent_requests : int = max_concurrent_requests
+        self.lock : asyncio.Lock = asyncio.Lock()
+        self.service_metrics : ServiceMetrics = ServiceMetrics()
+        
+        # With a batch window, requests for orders are collected for that long and answered together
+        self.batch_window : float = batch_window
+        self.auction : AuctionBehaviour | None = None # the auction collecting requests, if any
+        
+        # With a digest period, drones that asked for orders are sent a digest of the inventory when it changed
+        self.digest_period : float = digest_period
+        self.subscribers : set[str] = set()
+        self.published_version : int = -1
 
     async def setup(self) -> None:
         self.logger.log(f"{self.id} - [SETUP]")
-        self.add_behaviour(IdleBehaviour())
+        self.add_behaviour(IdleBehaviour(self.max_concurrent_requests))
         self.add_behaviour(EmitSetupBehaviour())
+        self.add_behaviour(ExpireReservationsBehaviour(), ExpireReservationsBehaviour.template())
+        if self.digest_period > 0:
+            self.add_behaviour(PublishDigestBehaviour(self.digest_period), PublishDigestBehaviour.template())
+        
+    # ----------------------------------------------------------------------------------------------
+    
+    def subscribe(self, sender : str) -> None:
+        """
+        Push the digests of the inventory to a drone that asked for orders, if the warehouse publishes any.
+        """
+        if self.digest_period > 0:
+            self.subscribers.add(sender)
+    
+    def unsubscribe(self, sender : str) -> None:
+        """
+        Stop pushing digests to a drone, e.g. once it finished.
+        """
+        self.subscribers.discard(sender)
+    
+    def has_orders(self) -> bool:
+        """
+        Check if the warehouse still has orders to suggest or to hand over to a drone.
+        """
+        return len(self.inventory) > 0 or len(self.orders_to_be_picked) > 0
+    
+    def suggest_orders(self, sender : str, capacity : int) -> list[DeliveryOrder]:
+        """
+        Select and reserve orders to propose to a drone.
+
+        Args:
+            sender (str): The jid of the drone.
+            capacity (int): The capacity of the drone.
+
+        Returns:
+            list[DeliveryOrder]: The orders reserved for the drone. Can be empty.
+        """
+        orders = self.orders_matrix.select_orders(self.position['latitude'],
+                                                  self.position['longitude'],
+                                                  capacity,
+                                                  sender,
+                                                  self.logger)
+        self.logger.log(f"[SUGGEST] - {len(orders)} orders for {sender} - {self.orders_matrix.last_cells_visited} cells visited")
+        return orders
+    
+    def suggest_batch(self, requests : dict[str, tuple[int, float]]) -> dict[str, list[DeliveryOrder]]:
+        """
+        Select and reserve orders to propose to several drones at once, sharing the closest orders between them.
+
+        Args:
+            requests (dict[str, tuple[int, float]]): The capacity and autonomy of each drone, by jid.
+
+        Returns:
+            dict[str, list[DeliveryOrder]]: The orders reserved for each drone. Can be empty.
+        """
+        bundles = self.orders_matrix.select_bundles(self.position['latitude'],
+                                                    self.position['longitude'],
+                                                    requests,
+                                                    self.logger)
+        for sender, orders in bundles.items():
+            self.logger.log(f"[SUGGEST] - {len(orders)} orders for {sender} - auction of {len(requests)} drones")
+        self.logger.log(f"[AUCTION] - {sum(len(orders) for orders in bundles.values())} orders shared by {len(requests)} drones - {self.orders_matrix.last_cells_visited} cells visited")
+        return bundles
+    
+    def digest(self) -> InventoryDigest:
+        """
+        Summarise the inventory for the drones, see `InventoryDigest`.
+        """
+        return self.orders_matrix.digest(self.id, len(self.inventory))
+    
+    def changed_digest(self) -> InventoryDigest | None:
+        """
+        Get the digest of the inventory if it changed since the last one published, and mark it published.
+
+        Returns:
+            InventoryDigest | None: The digest, None if the drones already have it.
+        """
+        if self.orders_matrix.version == self.published_version:
+            return None
+        self.published_version = self.orders_matrix.version
+        return self.digest()
+    
+    def accept_proposal(self, sender : str, order_ids : list[str]) -> None:
+        """
+        Hand the accepted orders over to a drone and return the rest of its reservations to the matrix.
+
+        Args:
+            sender (str): The jid of the drone.
+            order_ids (list[str]): The ids of the orders the drone accepted.
+        """
+        self.logger.log(f"[DECIDING] - [ACCEPTED] - {sender}")
         
-# ----------------------------------------------------------------------------------------------
\ No newline at end of file
+        if sender not in self.orders_to_be_picked:
+            self.orders_to_be_picked[sender] = []
+        
+        for order_id in order_ids:
+            # Remove order from matrix
+            self.orders_matrix.remove_order(order_id, sender)
+            
+            self.orders_to_be_picked[sender].append(self.inventory[order_id])
+            del self.inventory[order_id]
+            
+        # Undo reservations for orders the drone refused, if any
+        self.orders_matrix.undo_reservations(sender, self.logger)
+        self.logger.log(f"[DECIDING] - Orders remaining in inventory: {len(self.inventory)}")
+    
+    def reject_proposal(self, sender : str) -> None:
+        """
+        Return every order reserved for a drone to the matrix.
+        """
+        self.logger.log(f"[DECIDING] - [REJECTED] - {sender}")
+        self.orders_matrix.undo_reservations(sender, self.logger)
+    
+    def pickup_orders(self, sender : str) -> list[DeliveryOrder]:
+        """
+        Release the orders a drone accepted, when it comes to pick them up.
+
+        Returns:
+            list[DeliveryOrder]: The orders picked up.
+        """
+        orders = self.orders_to_be_picked.pop(sender)
+        for order in orders:
+            self.logger.log(f"[PICKUP] - {order} - from {sender}")
+        return orders
+        
+
+# ----------------------------------------------------------------------------------------------
+
+class WarehouseGroupAgent(HostAgent):
+    """
+    Hosts many warehouses over a single connection, see `misc.multiplex.HostAgent`. Each warehouse keeps
+    its own behaviours, and drones address it by its own jid as if it connected itself.
+
+    Args:
+        id (str): The id of the group, also the name of its log file.
+        jid (str): The jid of the group, the only one that connects.
+        password (str): The password of the jid.
+        warehouses (list[WarehouseAgent]): The warehouses it hosts.
+    """
+    def __init__(self, id : str, jid : str, password : str, warehouses : list[WarehouseAgent]) -> None:
+        super().__init__(id, jid, password, warehouses)
+        self.warehouses : list[WarehouseAgent] = warehouses
+
+# ----------------------------------------------------------------------------------------------
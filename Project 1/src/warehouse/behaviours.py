@@ -1,8 +1,13 @@
 
+import asyncio
 import json
-from spade.behaviour import CyclicBehaviour, OneShotBehaviour
+from abc import ABC, abstractmethod
+from time import perf_counter
+from spade.behaviour import CyclicBehaviour, OneShotBehaviour, PeriodicBehaviour
+from spade.template import Template
 from order import DeliveryOrder
 from spade.message import Message
+from misc.codec import METADATA_CODEC, codec_for
 
 # ----------------------------------------------------------------------------------------------
 
@@ -10,22 +15,52 @@ METADATA_NEXT_BEHAVIOUR = "next_behaviour"
 SUGGEST= "suggest"
 DECIDE = "decide"
 PICKUP = "pickup_orders"
+DIGEST = "digest"
+UNSUBSCRIBE = "unsubscribe"
 
 TIMEOUT = 5.0
+EXPIRY_PERIOD = 1.0 # seconds between checks for expired reservations
+MAX_CONCURRENT_REQUESTS = 8 # messages a warehouse serves at once, 1 serves them one at a time
+BATCH_WINDOW = 0.0 # seconds requests for orders are collected before being answered together, 0 answers each at once
+DIGEST_PERIOD = 0.0 # seconds between checks for a new inventory digest to push to the drones, 0 pushes none
 
 
 # ----------------------------------------------------------------------------------------------
 
 class IdleBehaviour(CyclicBehaviour):
+    """
+    Receives the messages of the drones and serves each one in its own behaviour.
+    Up to `max_concurrent` messages are served at once; once they are all busy, the next message waits
+    for one of them to finish. Messages of the same drone are still served in the order they arrived.
     
+    Args:
+        max_concurrent (int, optional): Messages served at once. Defaults to MAX_CONCURRENT_REQUESTS.
+    """
+    def __init__(self, max_concurrent : int = MAX_CONCURRENT_REQUESTS):
+        super().__init__()
+        if max_concurrent < 1:
+            raise ValueError(f"A warehouse must serve at least one message at once, got {max_concurrent}.")
+        self.max_concurrent : int = max_concurrent
+        self.__last_served : dict[str, asyncio.Event] = {} # sender -> set once its latest message is served
+        self.__busy : int = 0
+    
+    async def on_start(self):
+        self.__slots = asyncio.Semaphore(self.max_concurrent)
+        
     def get_next_behav(self, message : Message) :
-        if len(self.agent.inventory.keys()) == 0 and len(self.agent.orders_to_be_picked.keys()) == 0:
+        if message.metadata.get(METADATA_NEXT_BEHAVIOUR) == UNSUBSCRIBE:
+            # Finished drones sign off whether or not orders are left, and expect no answer
+            return UnsubscribeBehaviour(sender=str(message.sender))
+        
+        elif not self.agent.has_orders():
             self.agent.logger.log(f"[IDLE] - No orders to be picked - {str(message.sender)}")            
             return DismissBehaviour(message=message)
         
         elif message.metadata[METADATA_NEXT_BEHAVIOUR] == SUGGEST:
-            capacity = json.loads(message.body)["capacity"]
-            return SuggestOrderBehaviour(sender=str(message.sender), drone_capacity=capacity)
+            self.agent.subscribe(str(message.sender))
+            drone = json.loads(message.body)
+            return SuggestOrderBehaviour(sender=str(message.sender), drone_capacity=drone["capacity"], codec=codec_for(message),
+                                         drone_autonomy=drone["autonomy"], thread=message.thread)
         elif message.metadata[METADATA_NEXT_BEHAVIOUR] == DECIDE:
             return DecideOrdersBehaviour(sender=str(message.sender), message=message)
         elif message.metadata[METADATA_NEXT_BEHAVIOUR] == PICKUP:
@@ -40,108 +75,200 @@ class IdleBehaviour(CyclicBehaviour):
             self.agent.logger.log("[IDLE] Waiting for available drones... Didn't receive any message.")
         else:
             self.agent.logger.log("[IDLE] - [MESSAGE] - from {} with metadata :{}".format( str(message.sender), str(message.metadata)))
+            self.agent.service_metrics.received(self.mailbox_size() + self.__busy + 1)
             
-            b = self.get_next_behav(message)
+            # Reads the inventory, so it waits for the message being served to leave it consistent
+            async with self.agent.lock:
+                b = self.get_next_behav(message)
             if b is not None:
+                await self.__slots.acquire()
+                self.__busy += 1
+                sender = str(message.sender)
+                b.previous = self.__last_served.get(sender)
+                b.on_served = lambda: self.__release(sender, b)
+                self.__last_served[sender] = b.served
                 self.agent.add_behaviour(b)
-                await b.join()
             else:
                 self.agent.logger.log("[IDLE] - [ERROR] - Next behaviour is None. Ignoring message...")
                 
+    def __release(self, sender : str, behaviour : "RequestBehaviour") -> None:
+        self.__busy -= 1
+        self.__slots.release()
+        if self.__last_served.get(sender) is behaviour.served:
+            del self.__last_served[sender]
+
+# ----------------------------------------------------------------------------------------------
+
+class RequestBehaviour(OneShotBehaviour, ABC):
+    """
+    Serves one message of a drone, once the previous message of the same drone was served.
+    Subclasses implement `serve`, and read or change the inventory and the orders matrix only through
+    `with_inventory`, so that messages served at the same time never see them half updated.
+    """
+    def __init__(self):
+        super().__init__()
+        self.served : asyncio.Event = asyncio.Event()
+        self.previous : asyncio.Event | None = None
+        self.on_served = None
+        self.received_at : float = perf_counter()
+        
+    async def run(self):
+        try:
+            if self.previous is not None:
+                await self.previous.wait()
+            started = perf_counter()
+            await self.serve()
+            self.agent.service_metrics.served(started - self.received_at, perf_counter() - started)
+        finally:
+            self.served.set()
+            if self.on_served is not None:
+                self.on_served()
+                
+    @abstractmethod
+    async def serve(self):
+        """
+        Serve the message.
+        """
+
+async def with_inventory(agent, function, *args, in_thread : bool = False):
+    """
+    Run a method of the warehouse that reads or changes its inventory and orders matrix, holding the
+    warehouse's lock, so that other messages never see them half updated.
+
+    Only the selections of orders (`suggest_orders`, `suggest_batch`), which can take long, are worth
+    running in a worker thread, leaving the event loop to the other agents meanwhile. They only touch
+    the orders matrix. The rest of the bookkeeping takes well under a millisecond and runs on the loop.
+
+    Args:
+        agent (WarehouseAgent): The warehouse.
+        function: The method, e.g. `agent.suggest_orders`.
+        in_thread (bool, optional): Run the method in a worker thread. Defaults to False.
+
+    Returns:
+        The result of the method.
+    """
+    async with agent.lock:
+        if in_thread:
+            return await asyncio.to_thread(function, *args)
+        return function(*args)
 
 # ----------------------------------------------------------------------------------------------
 
-class SuggestOrderBehaviour(OneShotBehaviour):
-    def __init__(self, sender : str, drone_capacity : int):
+class SuggestOrderBehaviour(RequestBehaviour):
+    """
+    Proposes orders to a drone. With a batch window, the request joins the warehouse's auction instead,
+    which answers it together with the other requests that arrive during the window.
+    """
+    def __init__(self, sender : str, drone_capacity : int, codec, drone_autonomy : float | None = None, thread : str | None = None):
         super().__init__()
         self.sender : str = sender
+        self.thread : str | None = thread
         self.drone_capacity = drone_capacity
+        self.drone_autonomy = drone_autonomy
+        self.codec = codec
+        
+    async def serve(self):
+        if self.agent.batch_window > 0 and self.drone_autonomy is not None:
+            if self.agent.auction is None:
+                self.agent.auction = AuctionBehaviour(self.agent.batch_window)
+                self.agent.add_behaviour(self.agent.auction)
+            self.agent.auction.join(self.sender, self.drone_capacity, self.drone_autonomy, self.codec, self.thread)
+            return
+        
+        orders : list[DeliveryOrder] = await with_inventory(self.agent, self.agent.suggest_orders, self.sender, self.drone_capacity, in_thread=True)
+        await self.send(proposal(self.agent, self.sender, orders, self.codec, self.thread))
+
+# ----------------------------------------------------------------------------------------------
+
+class AuctionBehaviour(OneShotBehaviour):
+    """
+    Collects the requests for orders that arrive during the batch window, then shares the warehouse's
+    closest orders between all of them at once (see `warehouse.utils.assign_bundles`) and proposes
+    each drone its bundle. A request arriving after the window closed starts the next auction.
+    
+    Args:
+        window (float): Seconds requests are collected for.
+    """
+    def __init__(self, window : float):
+        super().__init__()
+        self.window : float = window
+        self.requests : dict[str, tuple[int, float]] = {}
+        self.codecs : dict = {}
+        self.threads : dict[str, str | None] = {}
+        
+    def join(self, sender : str, capacity : int, autonomy : float, codec, thread : str | None = None) -> None:
+        self.requests[sender] = (capacity, autonomy)
+        self.codecs[sender] = codec
+        self.threads[sender] = thread
         
     async def run(self):
-        orders : list[DeliveryOrder] = self.agent.orders_matrix.select_orders(self.agent.position['latitude'],
-                                                              self.agent.position['longitude'], 
-                                                              self.drone_capacity,
-                                                              self.sender,
-                                                              self.agent.logger)
-        message : Message = Message()
-        message.to = self.sender
-        message.set_metadata("performative", "propose")
-        message.body = json.dumps([order.__repr__() for order in orders])
-                
-        await self.send(message)
+        await asyncio.sleep(self.window)
+        self.agent.auction = None
+        bundles = await with_inventory(self.agent, self.agent.suggest_batch, self.requests, in_thread=True)
+        for sender, orders in bundles.items():
+            await self.send(proposal(self.agent, sender, orders, self.codecs[sender], self.threads[sender]))
+
+def proposal(agent, sender : str, orders : list[DeliveryOrder], codec, thread : str | None = None) -> Message:
+    """
+    Build the message proposing orders to a drone, encoded with the codec the drone asked with,
+    in the thread of its request.
+    """
+    message : Message = Message()
+    message.to = sender
+    message.thread = thread
+    message.set_metadata("performative", "propose")
+    message.set_metadata(METADATA_CODEC, codec.name)
+    message.body = codec.encode_orders(orders)
+    agent.logger.log(f"[CODEC] - {codec.name} - {len(message.body)} bytes for {len(orders)} orders to {sender}")
+    return message
 
 # ----------------------------------------------------------------------------------------------
 
-class DecideOrdersBehaviour(OneShotBehaviour):
+class DecideOrdersBehaviour(RequestBehaviour):
     def __init__(self, sender : str, message : Message):
         super().__init__()
         self.sender : str = sender
         self.message : Message = message
     
-    async def run(self):
+    async def serve(self):
         if self.message.metadata["performative"] == "accept-proposal":
-            self.agent.logger.log(f"[DECIDING] - [ACCEPTED] - {self.sender}")
-            
-            if self.sender not in self.agent.orders_to_be_picked:
-                self.agent.orders_to_be_picked[self.sender] = []
-            
-            # Reserve orders to drone
-            orders = json.loads(self.message.body)
-
-            for order_str in orders:
-                order = json.loads(order_str)
-                
-                # Remove order from matrix
-                self.agent.orders_matrix.remove_order(order["id"], self.sender)
-                                
-                self.agent.orders_to_be_picked[self.sender].append(self.agent.inventory[order["id"]])
-                del self.agent.inventory[order["id"]]
-                
-            # Undo reservations for orders the drone refused, if any
-            self.agent.orders_matrix.undo_reservations(self.sender, self.agent.logger)
-            self.agent.logger.log(f"[DECIDING] - Orders remaining in inventory: {len(self.agent.inventory)}")
+            order_ids = codec_for(self.message).decode_ids(self.message.body)
+            await with_inventory(self.agent, self.agent.accept_proposal, self.sender, order_ids)
 
         elif self.message.metadata["performative"] == "reject-proposal":
-            self.agent.logger.log(f"[DECIDING] - [REJECTED] - {self.sender}")
-            
-            self.agent.orders_matrix.undo_reservations(self.sender, self.agent.logger)
+            await with_inventory(self.agent, self.agent.reject_proposal, self.sender)
         
 # ----------------------------------------------------------------------------------------------
   
-class PickupOrdersBehaviour(OneShotBehaviour):
+class PickupOrdersBehaviour(RequestBehaviour):
     def __init__(self, sender : str, message : Message):
         super().__init__()
         self.sender : str = sender
         self.message : Message = message
         # print("RECEIVE", self.sender, message.body)
         
-    async def run(self):
-        orders = self.agent.orders_to_be_picked[self.sender]
-        for order in orders:
-            self.agent.logger.log(f"[PICKUP] - {order} - from {self.sender}")
-        
-        del self.agent.orders_to_be_picked[self.sender]
+    async def serve(self):
+        await with_inventory(self.agent, self.agent.pickup_orders, self.sender)
         
-        
-        message : Message = Message(to=self.sender)
+        message : Message = Message(to=self.sender, thread=self.message.thread)
         message.set_metadata("performative", "confirm")
 
         await self.send(message)
           
 # ----------------------------------------------------------------------------------------------
 
-class DismissBehaviour(OneShotBehaviour):  
+class DismissBehaviour(RequestBehaviour):  
     def __init__(self, message : Message):
         super().__init__()
         self.message : Message = message
         
       
-    async def run(self):
+    async def serve(self):
         if self.message is None:
             self.agent.logger.log(f"[REFUSING] - Waiting for drones to refuse...")
         else:
             self.agent.logger.log(f"[REFUSING] - [MESSAGE] {str(self.message.sender)}")
-            message = Message(to=str(self.message.sender))
+            message = Message(to=str(self.message.sender), thread=self.message.thread)
             message.set_metadata("performative", "refuse")
             message.set_metadata("Ja foste", "candido")
                         
@@ -149,9 +276,24 @@ class DismissBehaviour(OneShotBehaviour):
         
 # ----------------------------------------------------------------------------------------------
 
+class UnsubscribeBehaviour(RequestBehaviour):
+    """
+    Stops pushing inventory digests to a drone that finished.
+    """
+    def __init__(self, sender : str):
+        super().__init__()
+        self.sender : str = sender
+        
+    async def serve(self):
+        self.agent.unsubscribe(self.sender)
+        self.agent.logger.log(f"[UNSUBSCRIBE] - {self.sender}")
+
+# ----------------------------------------------------------------------------------------------
+
 class EmitSetupBehaviour(OneShotBehaviour):
     async def run(self):
-        data = [order.get_order_for_visualization() for order in self.agent.inventory.values()]
+        async with self.agent.lock:
+            data = [order.get_order_for_visualization() for order in self.agent.inventory.values()]
         data.append({
             'id': self.agent.id,
             'latitude': self.agent.position['latitude'],
@@ -161,3 +303,55 @@ class EmitSetupBehaviour(OneShotBehaviour):
         self.agent.socketio.emit('update_data', data)
 
 # ----------------------------------------------------------------------------------------------
+
+class ExpireReservationsBehaviour(PeriodicBehaviour):
+    """
+    Periodically undo the reservations that drones didn't accept or reject in time,
+    so that request handling never has to look for them.
+    """
+    def __init__(self, period : float = EXPIRY_PERIOD):
+        super().__init__(period=period)
+        
+    async def run(self):
+        expired_owners = await with_inventory(self.agent, self.agent.orders_matrix.check_timeout, self.agent.logger)
+        for owner in expired_owners:
+            self.agent.logger.log(f"[EXPIRED] - Reservations of {owner} timed out")
+            
+    @staticmethod
+    def template() -> Template:
+        # Matches no message, the behaviour only runs on its timer
+        return Template(metadata={METADATA_NEXT_BEHAVIOUR: "expire_reservations"})
+
+# ----------------------------------------------------------------------------------------------
+
+class PublishDigestBehaviour(PeriodicBehaviour):
+    """
+    Periodically push a digest of the inventory to the drones that asked the warehouse for orders,
+    if it changed since the last one. Changes in between are sent together, as a single digest.
+    """
+    def __init__(self, period : float = DIGEST_PERIOD):
+        super().__init__(period=period)
+        
+    async def run(self):
+        if not self.agent.subscribers:
+            return
+        digest = await with_inventory(self.agent, self.agent.changed_digest)
+        if digest is None:
+            return
+        body = digest.encode()
+        # Drones subscribe while the digest is being sent, they get the next one
+        subscribers = list(self.agent.subscribers)
+        for subscriber in subscribers:
+            message = Message(to=subscriber)
+            message.set_metadata("performative", "inform")
+            message.set_metadata(METADATA_NEXT_BEHAVIOUR, DIGEST)
+            message.body = body
+            await self.send(message)
+        self.agent.logger.log(f"[DIGEST] - version {digest.version} - {digest.available}/{digest.remaining} orders - {len(body)} bytes to {len(subscribers)} drones")
+            
+    @staticmethod
+    def template() -> Template:
+        # Matches no message, the behaviour only runs on its timer
+        return Template(metadata={METADATA_NEXT_BEHAVIOUR: "publish_digest"})
+
+# ----------------------------------------------------------------------------------------------
@@ -1,44 +1,274 @@
 # ----------------------------------------------------------------------------------------------
 
-import numpy as np
-from collections import deque
+import heapq
+import json
+from bisect import bisect_right
 
 from order import DeliveryOrder
+from misc.clock import WallClock
+from misc.distance import geo_distance
+from drone.utils import RouteCostTable, utility
 
-from time import time
+# ----------------------------------------------------------------------------------------------
+
+MAX_CELL_ORDERS = 32 # A cell with more orders than this is split in four
+MERGE_CELL_ORDERS = 8 # A split cell whose subtree drops to this many orders is merged back
+MAX_CELL_DEPTH = 16 # Cells at this depth are never split (e.g. many orders at the same spot)
+RESERVATION_TIMEOUT = 5.0 # seconds a drone has to accept or reject the orders reserved for it
+DIGEST_DEPTH = 2 # Depth of the quadtree cells counted in an inventory digest, up to 4 ** DIGEST_DEPTH cells
+
+# ----------------------------------------------------------------------------------------------
+
+class QuadtreeCell:
+    """
+    Cell of the quadtree used by OrdersMatrix. A cell either holds orders itself (leaf)
+    or is split in four children that cover its quadrants.
+    
+    Args:
+        bounds (tuple[float, float, float, float]): The minimum latitude, minimum longitude, maximum latitude and maximum longitude of the cell.
+        depth (int): The depth of the cell in the tree, 0 for the root.
+        
+    Attributes:
+        orders (dict[str, DeliveryOrder]): The orders in the cell by id, if it is a leaf.
+        by_weight (dict[int, dict[str, DeliveryOrder]]): The same orders grouped by weight.
+        children (list[QuadtreeCell] | None): The four quadrants, None if the cell is a leaf.
+        count (int): The number of orders in the cell and all of its children.
+    """
+    def __init__(self, bounds : tuple[float, float, float, float], depth : int = 0) -> None:
+        self.bounds : tuple[float, float, float, float] = bounds
+        self.depth : int = depth
+        self.orders : dict[str, DeliveryOrder] = {}
+        self.by_weight : dict[int, dict[str, DeliveryOrder]] = {}
+        self.children : list[QuadtreeCell] | None = None
+        self.count : int = 0
+        self.__weight_table : tuple[list[int], list[int]] | None = None
+        
+    def is_leaf(self) -> bool:
+        return self.children is None
+        
+    def child_for(self, latitude : float, longitude : float) -> "QuadtreeCell":
+        """
+        Get the child whose quadrant contains the given position.
+        """
+        min_lat, min_lon, max_lat, max_lon = self.bounds
+        north = latitude >= (min_lat + max_lat) / 2
+        east = longitude >= (min_lon + max_lon) / 2
+        return self.children[north * 2 + east]
+    
+    def leaf_for(self, latitude : float, longitude : float) -> "QuadtreeCell":
+        """
+        Get the leaf that contains the given position.
+        """
+        cell = self
+        while cell.children is not None:
+            cell = cell.child_for(latitude, longitude)
+        return cell
+    
+    def insert(self, order : DeliveryOrder) -> None:
+        """
+        Insert an order in the cell, splitting leaves that grow over MAX_CELL_ORDERS.
+        """
+        latitude = order.dest_lat
+        longitude = order.dest_lon
+        cell = self
+        while cell.children is not None:
+            cell.count += 1
+            cell = cell.child_for(latitude, longitude)
+        cell.count += 1
+        cell.add(order)
+        if len(cell.orders) > MAX_CELL_ORDERS and cell.depth < MAX_CELL_DEPTH:
+            cell.split()
+    
+    def remove(self, order_id : str, latitude : float, longitude : float) -> DeliveryOrder | None:
+        """
+        Remove an order from the cell, merging back split cells that drop to MERGE_CELL_ORDERS.
+        
+        Returns:
+            DeliveryOrder | None: The removed order, None if it wasn't in the cell.
+        """
+        if self.children is None:
+            order = self.discard(order_id)
+            if order is not None:
+                self.count -= 1
+            return order
+        
+        order = self.child_for(latitude, longitude).remove(order_id, latitude, longitude)
+        if order is not None:
+            self.count -= 1
+            if self.count <= MERGE_CELL_ORDERS:
+                self.merge()
+        return order
+    
+    def split(self) -> None:
+        """
+        Split the leaf in four children and move its orders to them.
+        """
+        min_lat, min_lon, max_lat, max_lon = self.bounds
+        mid_lat = (min_lat + max_lat) / 2
+        mid_lon = (min_lon + max_lon) / 2
+        self.children = [
+            QuadtreeCell((min_lat, min_lon, mid_lat, mid_lon), self.depth + 1), # south-west
+            QuadtreeCell((min_lat, mid_lon, mid_lat, max_lon), self.depth + 1), # south-east
+            QuadtreeCell((mid_lat, min_lon, max_lat, mid_lon), self.depth + 1), # north-west
+            QuadtreeCell((mid_lat, mid_lon, max_lat, max_lon), self.depth + 1)  # north-east
+        ]
+        orders, self.orders, self.by_weight, self.count = self.orders, {}, {}, 0
+        self.__weight_table = None
+        for order in orders.values():
+            self.insert(order)
+    
+    def merge(self) -> None:
+        """
+        Turn the cell back into a leaf holding the orders of all its children.
+        """
+        stack, orders = [self], {}
+        while stack:
+            cell = stack.pop()
+            if cell.children is None:
+                orders.update(cell.orders)
+            else:
+                stack.extend(cell.children)
+        self.children = None
+        self.orders, self.by_weight = {}, {}
+        for order in orders.values():
+            self.add(order)
+    
+    def add(self, order : DeliveryOrder) -> None:
+        """
+        Store an order in the leaf, without updating any count.
+        """
+        self.orders[order.id] = order
+        self.by_weight.setdefault(order.weight, {})[order.id] = order
+        self.__weight_table = None
+        
+    def discard(self, order_id : str) -> DeliveryOrder | None:
+        """
+        Take an order out of the leaf, without updating any count.
+        
+        Returns:
+            DeliveryOrder | None: The order, None if it isn't in the leaf.
+        """
+        order = self.orders.pop(order_id, None)
+        if order is not None:
+            bucket = self.by_weight[order.weight]
+            del bucket[order_id]
+            if not bucket:
+                del self.by_weight[order.weight]
+            self.__weight_table = None
+        return order
+    
+    def weight_table(self) -> tuple[list[int], list[int]]:
+        """
+        Get the distinct weights of the leaf's orders in ascending order, with prefix sums:
+        the i-th sum is the total weight of every order up to the i-th weight. Cached until the leaf changes.
+        
+        Returns:
+            tuple[list[int], list[int]]: The sorted weights and their prefix sums.
+        """
+        if self.__weight_table is None:
+            weights = sorted(self.by_weight.keys())
+            prefix, total = [], 0
+            for weight in weights:
+                total += weight * len(self.by_weight[weight])
+                prefix.append(total)
+            self.__weight_table = (weights, prefix)
+        return self.__weight_table
+    
+    def take(self, max_weight : int, budget : int) -> list[DeliveryOrder]:
+        """
+        Pick orders of the leaf that weigh at most `max_weight` each and at most `budget` together.
+        Every eligible order is taken if they fit, otherwise the heaviest are taken first.
+        The orders are not removed from the leaf.
+        
+        Args:
+            max_weight (int): The maximum weight of a single order.
+            budget (int): The maximum total weight.
+        
+        Returns:
+            list[DeliveryOrder]: The orders picked.
+        """
+        weights, prefix = self.weight_table()
+        eligible = bisect_right(weights, max_weight)
+        if eligible == 0:
+            return []
+        if prefix[eligible - 1] <= budget:
+            return [order for weight in weights[:eligible] for order in self.by_weight[weight].values()]
+        
+        taken = []
+        for weight in reversed(weights[:bisect_right(weights, min(max_weight, budget))]):
+            for order in self.by_weight[weight].values():
+                if weight > budget:
+                    break
+                taken.append(order)
+                budget -= weight
+        return taken
+        
+    def distance_to(self, latitude : float, longitude : float) -> float:
+        """
+        Distance, in meters, from the given position to the closest point of the cell. 0 if the position is inside it.
+        """
+        min_lat, min_lon, max_lat, max_lon = self.bounds
+        closest_lat = min(max(latitude, min_lat), max_lat)
+        closest_lon = min(max(longitude, min_lon), max_lon)
+        if closest_lat == latitude and closest_lon == longitude:
+            return 0.0
+        return geo_distance(latitude, longitude, closest_lat, closest_lon)
+    
+    def leaves(self) -> list["QuadtreeCell"]:
+        """
+        Get every leaf under the cell.
+        """
+        if self.children is None:
+            return [self]
+        return [leaf for child in self.children for leaf in child.leaves()]
 
 # ----------------------------------------------------------------------------------------------
 
 class OrdersMatrix:
     """
-    OrdersMatrix class to represent a matrix of orders.
+    OrdersMatrix class to store the orders of a warehouse by location.
+    Orders are kept in an adaptive quadtree: cells are split when they get crowded and merged back
+    as the inventory drains, so dense and sparse areas both end up with small cells.
     
     Args:
         inventory (dict[str, DeliveryOrder]): The inventory of orders.
-        divisions (int): The number of divisions for the matrix.
         capacity_multiplier (int): The capacity multiplier for the drones.
         warehouse_position (dict): The position of the warehouse.
+        clock (optional): Clock the reservation timeouts are measured with, any object with a `now()` method. Defaults to WallClock().
+        reservation_timeout (float, optional): Seconds before the reservations of a drone expire. Defaults to RESERVATION_TIMEOUT.
         
     Attributes:
-        corners (list): The corners of the matrix.
-        divisions (int): The number of divisions for the matrix.
+        corners (list): The corners of the area covered by the quadtree.
         capacity_multiplier (int): The capacity multiplier for the drones.
-        matrix (np.array): The matrix of orders.
+        root (QuadtreeCell): The root cell of the quadtree.
+        last_cells_visited (int): The number of cells visited by the last call to `select_orders`.
+        cells_visited_total (int): The number of cells visited by every call to `select_orders`.
+        selections (int): The number of calls to `select_orders`.
+        version (int): Increased every time an order enters or leaves the matrix, or is handed over.
     """
-    def __init__(self, inventory : dict[str, DeliveryOrder], divisions : int = 5, capacity_multiplier : int = 3, warehouse_position : dict = {}) -> None:
+    def __init__(self, inventory : dict[str, DeliveryOrder], capacity_multiplier : int = 3, warehouse_position : dict = {},
+                 clock = None, reservation_timeout : float = RESERVATION_TIMEOUT) -> None:
         self.corners : list = self.__setup(inventory, warehouse_position)
-        self.divisions : int = divisions
         self.capacity_multiplier : int = capacity_multiplier
         
-        self.matrix : np.array = np.empty((self.divisions, self.divisions), dtype=object)
+        bottom_left, top_right = self.corners[0], self.corners[3]
+        self.root : QuadtreeCell = QuadtreeCell((bottom_left[0], bottom_left[1], top_right[0], top_right[1]))
+        
+        self.reserved_orders : dict[str, dict[str, DeliveryOrder]] = {} # owner -> order id -> order
+        self.reservation_owners : dict[str, str] = {} # order id -> owner
+        self.reserved_orders_timer : dict[str, float] = {} # owner -> time of its last reservation
         
-        self.reserved_orders : dict[str, tuple] = {}
-        self.reserved_orders_timer : dict[str, float] = {}
-        self.__timeout : float = 5.0 # seconds
+        self.clock = clock if clock is not None else WallClock()
+        self.__timeout : float = reservation_timeout
+        self.__expiries : list[tuple[float, int, str]] = [] # min-heap of (deadline, sequence, owner)
+        self.__deadlines : dict[str, float] = {} # owner -> deadline of its newest heap entry
+        self.__sequence : int = 0
         
-        for i in range(self.divisions):
-            for j in range(self.divisions):
-                self.matrix[i, j] = []
+        self.__weight_counts : dict[int, int] = {} # weight -> number of orders in the matrix with it
+        self.last_cells_visited : int = 0
+        self.cells_visited_total : int = 0
+        self.selections : int = 0
+        self.version : int = 0
 
         self.populate_matrix(inventory)
                 
@@ -58,10 +288,10 @@ class OrdersMatrix:
         # Extract the minimum and maximum coordinates for the destination positions, and add a small buffer
         buffer = 0.01
         
-        min_dest_lat : float = min(order.destination_position["latitude"] for order in inventory.values()) - buffer
-        max_dest_lat : float = max(order.destination_position["latitude"] for order in inventory.values()) + buffer
-        min_dest_long : float = min(order.destination_position["longitude"] for order in inventory.values()) - buffer
-        max_dest_long : float = max(order.destination_position["longitude"] for order in inventory.values()) + buffer
+        min_dest_lat : float = min(order.dest_lat for order in inventory.values()) - buffer
+        max_dest_lat : float = max(order.dest_lat for order in inventory.values()) + buffer
+        min_dest_long : float = min(order.dest_lon for order in inventory.values()) - buffer
+        max_dest_long : float = max(order.dest_lon for order in inventory.values()) + buffer
 
         min_dest_lat : float = min(min_dest_lat, warehouse_position["latitude"]) - buffer
         max_dest_lat : float = max(max_dest_lat, warehouse_position["latitude"]) + buffer
@@ -77,48 +307,42 @@ class OrdersMatrix:
     
     # ----------------------------------------------------------------------------------------------
     
-    def calculate_cell_index(self, latitude : float, longitude : float) -> tuple[int, int]:        
-        # Extract the coordinates of the top left corner
-        top_left = self.corners[2]
-        
-        # Calculate the distance between the destination and the top left corner
-        x_distance = longitude - top_left[1]
-        y_distance = top_left[0] - latitude
-        
-        # Calculate the distance between the top left and top right corners
-        x_corner_dist = self.corners[3][1] - self.corners[2][1]
-        y_corner_dist = self.corners[2][0] - self.corners[0][0]
-        
-        # Calculate the cell index for the order
-        j = int(x_distance * self.divisions / x_corner_dist)
-        i = int(y_distance * self.divisions / y_corner_dist)
-        
-        return i, j
-    
-    # ----------------------------------------------------------------------------------------------
-    
     def populate_matrix(self, inventory : dict[str, DeliveryOrder]) -> None:
         for order in inventory.values():
-            # Calculate the cell index for the order
-            i, j = self.calculate_cell_index(order.destination_position["latitude"], order.destination_position["longitude"])
-            
-            # Store the order in the orders matrix
-            self.matrix[i, j].append(order)
-            
-            # print(f"Order {order.id} with {order.destination_position} is stored in cell ({i}, {j})")
+            self.root.insert(order)
+            self.__count_weight(order.weight, 1)
     
     # ----------------------------------------------------------------------------------------------
     
-    def check_timeout(self, logger) -> None:
+    def check_timeout(self, logger) -> list[str]:
         """
-        Check if the timeout for a reservation has expired.
-        If so, undo the reservations of the orders.
+        Undo the reservations of every owner whose timeout has expired.
+        Only the expired entries are popped from the expiry heap, owners with live reservations are not looked at.
+        
+        Returns:
+            list[str]: The owners whose reservations expired.
         """
-        current_time : float = time()
+        current_time : float = self.clock.now()
         
-        expired_owners = [owner for owner, timer in self.reserved_orders_timer.items() if current_time - timer > self.__timeout]
-        for owner in expired_owners:
+        expired_owners = []
+        while self.__expiries and self.__expiries[0][0] < current_time:
+            deadline, _, owner = heapq.heappop(self.__expiries)
+            if self.__deadlines.get(owner) != deadline:
+                continue # stale entry, the owner reserved again or its reservations were already settled
             self.undo_reservations(owner, logger)
+            expired_owners.append(owner)
+        return expired_owners
+    
+    def next_expiry(self) -> float | None:
+        """
+        Get the earliest time a reservation may expire.
+        
+        Returns:
+            float | None: The time according to the matrix's clock, None if nothing is reserved.
+        """
+        while self.__expiries and self.__deadlines.get(self.__expiries[0][2]) != self.__expiries[0][0]:
+            heapq.heappop(self.__expiries)
+        return self.__expiries[0][0] if self.__expiries else None
     
     # ----------------------------------------------------------------------------------------------
     
@@ -135,63 +359,108 @@ class OrdersMatrix:
             list[DeliveryOrder]: list of orders selected for the drone. Can be empty.
         """
         
-        # Check timeouts before reserving the order
-        self.check_timeout(logger)
-        
-        # Calculate the cell index for the order
-        i, j = self.calculate_cell_index(latitude, longitude)
-        
         # Drones will receive 3 times the capacity, so that they can choose the best orders
-        total_orders_capacity = capacity * self.capacity_multiplier
-        
-        orders: list[DeliveryOrder] = []
-        
-        # Define directions: right, down, left, up
-        directions = [(0, 1), (1, 0), (0, -1), (-1, 0)]
+        orders = self.gather_orders(latitude, longitude, capacity, capacity * self.capacity_multiplier)
         
-        # Initialize a queue for spiral traversal
-        queue = deque([(i, j)])
+        # Now, reserve the orders for the drone
+        self.reserve_orders(orders, owner)
+                    
+        return orders
+    
+    def gather_orders(self, latitude : float, longitude : float, max_weight : int, budget : int) -> list[DeliveryOrder]:
+        """
+        Collect the orders closest to a position, without reserving them.
         
-        # Initialize a set to keep track of visited cells
-        visited = set([(i, j)])
+        Args:
+            latitude (float): latitude of the position
+            longitude (float): longitude of the position
+            max_weight (int): maximum weight of a single order
+            budget (int): maximum total weight of the orders
+            
+        Returns:
+            list[DeliveryOrder]: the orders, from the closest cells outwards. Can be empty.
+        """
+        orders: list[DeliveryOrder] = []
         
-        # Initialize total weight of orders retrieved
-        total_weight = 0
+        # Visit the cells in rings of true distance from the position, leaves are only expanded when reached
+        counter = 0
+        cells_visited = 0
+        queue = [(self.root.distance_to(latitude, longitude), counter, self.root)]
         
-        # Perform spiral traversal to retrieve orders
-        while queue:
-            x, y = queue.popleft()
-                        
-            # Retrieve orders in the current cell
-            cell_orders = self.matrix[x, y]
+        while queue and not self.__budget_is_final(max_weight, budget):
+            _, _, cell = heapq.heappop(queue)
+            cells_visited += 1
+            if cell.count == 0:
+                continue
             
-            for order in cell_orders:
-                if order.weight <= capacity and order.weight + total_weight <= total_orders_capacity:
-                    orders.append(order)
-                    total_weight += order.weight
-                    
-            if total_weight == total_orders_capacity:
-                break
+            if not cell.is_leaf():
+                for child in cell.children:
+                    if child.count > 0:
+                        counter += 1
+                        heapq.heappush(queue, (child.distance_to(latitude, longitude), counter, child))
+                continue
             
-            # Explore neighboring cells in all directions
-            for dx, dy in directions:
-                nx, ny = x + dx, y + dy
-                
-                # Check if the neighboring cell is within bounds and not visited
-                if 0 <= nx < self.divisions and 0 <= ny < self.divisions and (nx, ny) not in visited:
-                    queue.append((nx, ny))
-                    visited.add((nx, ny))
+            # Retrieve orders in the current cell
+            for order in cell.take(max_weight, budget):
+                orders.append(order)
+                budget -= order.weight
         
-        # Now, reserve the orders for the drone
+        self.last_cells_visited = cells_visited
+        self.cells_visited_total += cells_visited
+        self.selections += 1
+        return orders
+    
+    def reserve_orders(self, orders : list[DeliveryOrder], owner : str) -> None:
+        """
+        Take orders out of the matrix and reserve them for an owner, until it accepts, rejects or the timeout expires.
+        """
+        now = self.clock.now()
         for order in orders:
-            self.reserve_order(
-                order.destination_position["latitude"], 
-                order.destination_position["longitude"], 
+            self.__reserve(
+                order.dest_lat, 
+                order.dest_lon, 
                 order.id, 
                 owner
             )
-                    
-        return orders
+        if orders:
+            self.__schedule_expiry(owner, now)
+    
+    def select_bundles(self, latitude : float, longitude : float, requests : dict[str, tuple[int, float]], logger) -> dict[str, list[DeliveryOrder]]:
+        """
+        Select orders for several drones at once, so that no two drones are offered the same orders.
+        The orders closest to the position are gathered for all the drones together, assigned with
+        `assign_bundles` and each bundle is reserved for its drone.
+
+        Args:
+            latitude (float): latitude of the warehouse
+            longitude (float): longitude of the warehouse
+            requests (dict[str, tuple[int, float]]): capacity and autonomy of each drone, by owner
+
+        Returns:
+            dict[str, list[DeliveryOrder]]: the orders reserved for each drone. Can be empty.
+        """
+        if not requests:
+            return {}
+        max_weight = max(capacity for capacity, _ in requests.values())
+        budget = sum(capacity for capacity, _ in requests.values()) * self.capacity_multiplier
+        orders = self.gather_orders(latitude, longitude, max_weight, budget)
+        
+        bundles = assign_bundles(orders, latitude, longitude, requests)
+        for owner, bundle in bundles.items():
+            self.reserve_orders(bundle, owner)
+        return bundles
+    
+    def __budget_is_final(self, capacity : int, budget : int) -> bool:
+        # No order left in the matrix fits in what remains of the budget, so visiting more cells can't add any
+        return not self.__weight_counts or min(capacity, budget) < min(self.__weight_counts)
+    
+    def __count_weight(self, weight : int, change : int) -> None:
+        self.version += 1
+        count = self.__weight_counts.get(weight, 0) + change
+        if count > 0:
+            self.__weight_counts[weight] = count
+        else:
+            self.__weight_counts.pop(weight, None)
     
     # ----------------------------------------------------------------------------------------------
 
@@ -206,19 +475,25 @@ class OrdersMatrix:
             order_id (str): The id of the order to be reserved.
         """
         
-        i, j = self.calculate_cell_index(lat, long)
+        self.__reserve(lat, long, order_id, owner)
+        self.__schedule_expiry(owner, self.clock.now())
         
-        for order in self.matrix[i, j]:
-            if order.id == order_id:
-                self.matrix[i, j].remove(order)
-                
-                if owner not in self.reserved_orders:
-                    self.reserved_orders[owner] = []
-                self.reserved_orders[owner].append((order, i, j))
-                break
+    def __reserve(self, lat : float, long : float, order_id : str, owner : str) -> None:
+        order = self.root.remove(order_id, lat, long)
+        if order is not None:
+            self.__count_weight(order.weight, -1)
+            if owner not in self.reserved_orders:
+                self.reserved_orders[owner] = {}
+            self.reserved_orders[owner][order_id] = order
+            self.reservation_owners[order_id] = owner
             
-        # Set the timer for the owner
-        self.reserved_orders_timer[owner] = time()
+    def __schedule_expiry(self, owner : str, now : float) -> None:
+        # Set the timer for the owner. Older heap entries of the owner become stale and are skipped when popped.
+        self.reserved_orders_timer[owner] = now
+        deadline = now + self.__timeout
+        self.__deadlines[owner] = deadline
+        self.__sequence += 1
+        heapq.heappush(self.__expiries, (deadline, self.__sequence, owner))
 
     # ----------------------------------------------------------------------------------------------
     
@@ -231,11 +506,10 @@ class OrdersMatrix:
             order_id (str): The id of the order to be removed.
             owner (str): The id of the owner of the order.
         """
-                
-        for order, i, j in self.reserved_orders[owner]:
-            if order.id == order_id:
-                self.reserved_orders[owner].remove((order, i, j))
-                break
+        self.version += 1
+        
+        if self.reserved_orders[owner].pop(order_id, None) is not None:
+            del self.reservation_owners[order_id]
                             
     # ----------------------------------------------------------------------------------------------
     
@@ -251,13 +525,258 @@ class OrdersMatrix:
         """
         
         if owner not in self.reserved_orders:
+            self.reserved_orders_timer.pop(owner, None)
+            self.__deadlines.pop(owner, None)
             return
         
-        for order, i, j in self.reserved_orders[owner]:
-            self.matrix[i, j].append(order)
+        for order in self.reserved_orders[owner].values():
+            self.root.insert(order)
+            self.__count_weight(order.weight, 1)
+            del self.reservation_owners[order.id]
             logger.log(f"[UNDO] - Order {order.id} is returned to the matrix")
             
         del self.reserved_orders[owner]
         del self.reserved_orders_timer[owner]
+        del self.__deadlines[owner]
+
+    # ----------------------------------------------------------------------------------------------
+    
+    def digest(self, warehouse_id : str, remaining : int, depth : int = DIGEST_DEPTH) -> "InventoryDigest":
+        """
+        Summarise the orders that can still be proposed, for the drones to decide whether to ask for them.
+
+        Args:
+            warehouse_id (str): The id of the warehouse.
+            remaining (int): The number of orders of the warehouse not handed over yet, reserved ones included.
+            depth (int, optional): Depth of the cells counted in the histogram. Defaults to DIGEST_DEPTH.
+
+        Returns:
+            InventoryDigest: The digest, with the current version of the matrix.
+        """
+        cells = []
+        stack = [self.root]
+        while stack:
+            cell = stack.pop()
+            if cell.count == 0:
+                continue
+            if cell.is_leaf() or cell.depth >= depth:
+                cells.append((*cell.bounds, cell.count))
+            else:
+                stack.extend(cell.children)
+        return InventoryDigest(
+            warehouse_id,
+            self.version,
+            remaining,
+            self.root.count,
+            sum(weight * count for weight, count in self.__weight_counts.items()),
+            min(self.__weight_counts) if self.__weight_counts else None,
+            cells
+        )
+    
+    def check_invariants(self) -> None:
+        """
+        Check that the bookkeeping of the matrix is consistent. Meant for debugging and tests.
+        
+        Raises:
+            Exception: If an order is both in the matrix and reserved, reserved twice, or the
+                order counts of the cells don't match their contents.
+        """
+        stack, in_matrix = [self.root], set()
+        while stack:
+            cell = stack.pop()
+            if cell.is_leaf():
+                if cell.count != len(cell.orders):
+                    raise Exception(f"Cell {cell.bounds} counts {cell.count} orders but holds {len(cell.orders)}.")
+                if sum(len(bucket) for bucket in cell.by_weight.values()) != len(cell.orders):
+                    raise Exception(f"Cell {cell.bounds} weight buckets don't match its orders.")
+                in_matrix.update(cell.orders.keys())
+            else:
+                if cell.count != sum(child.count for child in cell.children):
+                    raise Exception(f"Cell {cell.bounds} count doesn't match its children.")
+                stack.extend(cell.children)
+        
+        reserved = 0
+        for owner, orders in self.reserved_orders.items():
+            reserved += len(orders)
+            for order_id in orders:
+                if self.reservation_owners.get(order_id) != owner:
+                    raise Exception(f"Order {order_id} is reserved by {owner} but registered to {self.reservation_owners.get(order_id)}.")
+                if order_id in in_matrix:
+                    raise Exception(f"Order {order_id} is reserved by {owner} and still in the matrix.")
+            if owner not in self.reserved_orders_timer:
+                raise Exception(f"Reservations of {owner} have no timer.")
+        if reserved != len(self.reservation_owners):
+            raise Exception("Some orders are registered to an owner that doesn't reserve them.")
+
+# ----------------------------------------------------------------------------------------------
+
+class InventoryDigest:
+    """
+    Small summary of the stock of a warehouse, pushed to the drones so that they can skip warehouses
+    that have nothing for them without asking. Digests of the same warehouse are ordered by version.
+    
+    Args:
+        warehouse (str): The id of the warehouse.
+        version (int): The version of the warehouse's orders matrix when the digest was taken.
+        remaining (int): The orders not handed over to a drone yet, reserved ones included. 0 once the warehouse is done.
+        available (int): The orders that can be proposed right now.
+        total_weight (int): The weight of the orders that can be proposed.
+        min_weight (int | None): The weight of the lightest order that can be proposed, None if there is none.
+        cells (list[tuple]): Coarse spatial histogram, the minimum latitude, minimum longitude, maximum latitude,
+            maximum longitude and number of orders of every quadtree cell with orders, see `OrdersMatrix.digest`.
+    """
+    __slots__ = ("warehouse", "version", "remaining", "available", "total_weight", "min_weight", "cells")
+    
+    def __init__(self, warehouse : str, version : int, remaining : int, available : int, total_weight : int,
+                 min_weight : int | None, cells : list[tuple]) -> None:
+        self.warehouse : str = warehouse
+        self.version : int = version
+        self.remaining : int = remaining
+        self.available : int = available
+        self.total_weight : int = total_weight
+        self.min_weight : int | None = min_weight
+        self.cells : list[tuple] = cells
+        
+    def encode(self) -> str:
+        return json.dumps([self.warehouse, self.version, self.remaining, self.available, self.total_weight, self.min_weight, self.cells])
+    
+    @staticmethod
+    def decode(body : str) -> "InventoryDigest":
+        warehouse, version, remaining, available, total_weight, min_weight, cells = json.loads(body)
+        return InventoryDigest(warehouse, version, remaining, available, total_weight, min_weight, [tuple(cell) for cell in cells])
+        
+    def reach(self, latitude : float, longitude : float) -> float:
+        """
+        Distance, in meters, from the given position to the closest cell with orders. inf if there is none.
+        """
+        closest = float('inf')
+        for min_lat, min_lon, max_lat, max_lon, _ in self.cells:
+            closest_lat = min(max(latitude, min_lat), max_lat)
+            closest_lon = min(max(longitude, min_lon), max_lon)
+            closest = min(closest, geo_distance(latitude, longitude, closest_lat, closest_lon))
+        return closest
+
+# ----------------------------------------------------------------------------------------------
+
+def assign_bundles(orders : list[DeliveryOrder], latitude : float, longitude : float,
+                   requests : dict[str, tuple[int, float]]) -> dict[str, list[DeliveryOrder]]:
+    """
+    Share orders between drones leaving from the same position, with a greedy auction on `drone.utils.utility`.
+    
+    Every round, each drone bids for the order that raises the utility of its bundle the most, and the
+    highest bid over all the drones wins. An empty bundle counts as a utility of 0, so every drone gets
+    its first order before bundles grow past what a drone alone would pick. The auction stops when no
+    order fits a drone or raises its utility. Routes are nearest neighbour routes from the position,
+    shared by every drone through a single `RouteCostTable`.
+    
+    Args:
+        orders (list[DeliveryOrder]): the orders to share
+        latitude (float): latitude the drones leave from
+        longitude (float): longitude the drones leave from
+        requests (dict[str, tuple[int, float]]): capacity and autonomy of each drone, by owner
+        
+    Returns:
+        dict[str, list[DeliveryOrder]]: the bundle of each drone, in the order they were won. Can be empty.
+    """
+    route_table = RouteCostTable(orders, latitude, longitude)
+    unassigned = set(range(len(orders)))
+    masks = {owner: 0 for owner in requests}
+    weights = {owner: 0 for owner in requests}
+    utilities = {owner: 0.0 for owner in requests}
+    bundles : dict[str, list[DeliveryOrder]] = {owner: [] for owner in requests}
+    
+    def best_bid(owner : str) -> tuple[float, int]:
+        capacity, autonomy = requests[owner]
+        best = (0.0, -1)
+        for i in unassigned:
+            weight = weights[owner] + orders[i].weight
+            if weight > capacity:
+                continue
+            mask = masks[owner] | (1 << i)
+            gain = utility(mask.bit_count(), route_table.travel_distance(mask), autonomy, min(weight / capacity, 1.0)) - utilities[owner]
+            if gain > best[0]:
+                best = (gain, i)
+        return best
+    
+    # A bid only changes when its drone wins or the order it bids for goes to another drone
+    bids = {owner: best_bid(owner) for owner in requests}
+    while bids:
+        winner = max(bids, key=lambda owner: bids[owner][0])
+        gain, i = bids[winner]
+        if i < 0:
+            break
+        unassigned.discard(i)
+        masks[winner] |= 1 << i
+        weights[winner] += orders[i].weight
+        utilities[winner] += gain
+        bundles[winner].append(orders[i])
+        for owner, (_, order) in bids.items():
+            if owner == winner or order == i:
+                bids[owner] = best_bid(owner)
+        bids = {owner: bid for owner, bid in bids.items() if bid[1] >= 0}
+    return bundles
+
+# ----------------------------------------------------------------------------------------------
+
+class ServiceMetrics:
+    """
+    Queue depth and service times of the messages a warehouse served.
+    
+    Attributes:
+        received_count (int): The number of messages received.
+        served_count (int): The number of messages served.
+        max_queue_depth (int): The most messages waiting or being served at once, seen when one arrived.
+        total_wait (float): Seconds messages spent waiting to be served, in total.
+        total_service (float): Seconds spent serving messages, in total.
+        max_service (float): Seconds spent serving the slowest message.
+    """
+    def __init__(self) -> None:
+        self.received_count : int = 0
+        self.served_count : int = 0
+        self.max_queue_depth : int = 0
+        self.__total_queue_depth : int = 0
+        self.total_wait : float = 0.0
+        self.total_service : float = 0.0
+        self.max_service : float = 0.0
+        
+    def received(self, queue_depth : int) -> None:
+        """
+        Record a message arriving.
+        
+        Args:
+            queue_depth (int): The number of messages waiting or being served, counting this one.
+        """
+        self.received_count += 1
+        self.__total_queue_depth += queue_depth
+        self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+        
+    def served(self, wait : float, service : float) -> None:
+        """
+        Record a message served.
+        
+        Args:
+            wait (float): Seconds between its arrival and the start of its service.
+            service (float): Seconds its service took.
+        """
+        self.served_count += 1
+        self.total_wait += wait
+        self.total_service += service
+        self.max_service = max(self.max_service, service)
+        
+    def summary(self) -> dict:
+        """
+        Get the averages and maximums of the queue depth, waiting time and service time, in milliseconds.
+        """
+        received = max(self.received_count, 1)
+        served = max(self.served_count, 1)
+        return {
+            "received": self.received_count,
+            "served": self.served_count,
+            "avg_queue_depth": round(self.__total_queue_depth / received, 2),
+            "max_queue_depth": self.max_queue_depth,
+            "avg_wait_ms": round(self.total_wait * 1000 / served, 3),
+            "avg_service_ms": round(self.total_service * 1000 / served, 3),
+            "max_service_ms": round(self.max_service * 1000, 3)
+        }
 
 # ----------------------------------------------------------------------------------------------
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules of the project import each other from src, like when running src/main.py
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
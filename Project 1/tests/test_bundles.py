@@ -0,0 +1,62 @@
+import random
+
+import pytest
+
+from drone.utils import best_available_orders, RouteCostTable, utility
+from order import OrderTable
+from warehouse.utils import assign_bundles
+
+LATITUDE, LONGITUDE = 38.72, -9.14
+
+def random_orders(rng : random.Random, size : int) -> list:
+    return list(OrderTable.from_columns(
+        [f"order{i}" for i in range(size)],
+        LATITUDE,
+        LONGITUDE,
+        [LATITUDE + rng.uniform(-0.05, 0.05) for _ in range(size)],
+        [LONGITUDE + rng.uniform(-0.05, 0.05) for _ in range(size)],
+        [rng.randint(1, 5) for _ in range(size)]
+    ))
+
+def bundle_utility(orders : list, bundle : list, capacity : int, autonomy : float) -> float:
+    mask = sum(1 << orders.index(order) for order in bundle)
+    weight = sum(order.weight for order in bundle)
+    return utility(len(bundle), RouteCostTable(orders, LATITUDE, LONGITUDE).travel_distance(mask), autonomy, min(weight / capacity, 1.0))
+
+# ----------------------------------------------------------------------------------------------
+
+@pytest.mark.parametrize("seed", range(20))
+def test_bundles_are_disjoint_and_fit_each_drone(seed):
+    rng = random.Random(seed)
+    orders = random_orders(rng, rng.randint(0, 30))
+    requests = {f"drone{i}": (rng.randint(3, 12), rng.uniform(5000.0, 40000.0)) for i in range(rng.randint(1, 5))}
+    bundles = assign_bundles(orders, LATITUDE, LONGITUDE, requests)
+
+    assert set(bundles) == set(requests)
+    ids = [order.id for bundle in bundles.values() for order in bundle]
+    assert len(ids) == len(set(ids))
+    for owner, bundle in bundles.items():
+        capacity, autonomy = requests[owner]
+        assert sum(order.weight for order in bundle) <= capacity
+        if bundle:
+            assert bundle_utility(orders, bundle, capacity, autonomy) > 0.0
+
+def test_every_drone_gets_an_order_before_any_gets_two():
+    orders = random_orders(random.Random(1), 4)
+    requests = {f"drone{i}": (20, 100000.0) for i in range(4)}
+    bundles = assign_bundles(orders, LATITUDE, LONGITUDE, requests)
+    assert [len(bundle) for bundle in bundles.values()] == [1, 1, 1, 1]
+
+def test_a_single_drone_gets_a_bundle_as_good_as_it_would_pick_alone():
+    rng = random.Random(2)
+    orders = random_orders(rng, 8)
+    bundles = assign_bundles(orders, LATITUDE, LONGITUDE, {"drone1": (10, 30000.0)})
+    best = best_available_orders(orders, LATITUDE, LONGITUDE, 10, 30000.0, time_budget=None)
+    # The auction is greedy, so it may stop short of the best set, never past it
+    assert 0.0 < bundle_utility(orders, bundles["drone1"], 10, 30000.0) <= bundle_utility(orders, best, 10, 30000.0) + 1e-9
+
+def test_orders_that_fit_no_drone_stay_unassigned():
+    orders = random_orders(random.Random(3), 5)
+    assert assign_bundles(orders, LATITUDE, LONGITUDE, {"drone1": (0, 30000.0)}) == {"drone1": []}
+    assert assign_bundles([], LATITUDE, LONGITUDE, {"drone1": (10, 30000.0)}) == {"drone1": []}
+    assert assign_bundles(orders, LATITUDE, LONGITUDE, {}) == {}
@@ -0,0 +1,63 @@
+import pytest
+
+from misc.codec import CatalogCodec
+from order import OrderCatalog, OrderTable, set_catalog, FREE, TAKEN, DELIVERED
+
+WAREHOUSES = [
+    ({"id": "center1", "latitude": 38.72, "longitude": -9.14}, [
+        {"id": "order1_1", "latitude": 38.7312345678901, "longitude": -9.1598765432109, "weight": 3},
+        {"id": "order1_2", "latitude": 38.70, "longitude": -9.12, "weight": 5},
+    ]),
+    ({"id": "center2", "latitude": 41.15, "longitude": -8.61}, [
+        {"id": "order2_1", "latitude": 41.16, "longitude": -8.62, "weight": 1},
+    ]),
+]
+
+@pytest.fixture
+def orders() -> list:
+    return [order for warehouse, records in WAREHOUSES
+            for order in OrderTable.from_records(records, warehouse["latitude"], warehouse["longitude"])]
+
+@pytest.fixture
+def catalog():
+    catalog = OrderCatalog.from_scenario(WAREHOUSES)
+    set_catalog(catalog)
+    yield catalog
+    set_catalog(None)
+
+# ----------------------------------------------------------------------------------------------
+
+def test_catalog_codec_resolves_the_same_orders(catalog):
+    codec = CatalogCodec()
+    orders = catalog.resolve(["order2_1", "order1_1"])
+    decoded = codec.decode_orders(codec.encode_orders(orders))
+    assert all(a is b for a, b in zip(decoded, orders))
+    assert codec.decode_orders(codec.encode_orders([])) == []
+
+def test_catalog_codec_carries_statuses_forward(catalog):
+    codec = CatalogCodec()
+    # The sender runs in another process, whose copy of the order is already taken
+    remote = OrderCatalog.from_scenario(WAREHOUSES)
+    remote["order1_1"].mark_as_taken()
+    decoded = codec.decode_orders(codec.encode_orders([remote["order1_1"]]))
+    assert decoded[0] is catalog["order1_1"]
+    assert not catalog["order1_1"].is_available()
+
+def test_catalog_codec_never_moves_a_status_back(catalog):
+    codec = CatalogCodec()
+    late = codec.encode_orders(catalog.resolve(["order1_2"])) # sent while the order was free
+    catalog["order1_2"].mark_as_taken()
+    codec.decode_orders(late)
+    assert catalog.table.item("status", catalog["order1_2"].row) == TAKEN
+
+    catalog["order1_2"].mark_as_delivered()
+    catalog.resolve(["order1_2"], [TAKEN])
+    assert catalog.table.item("status", catalog["order1_2"].row) == DELIVERED
+    catalog.resolve(["order2_1"], [FREE])
+    assert catalog["order2_1"].is_available()
+
+def test_catalog_codec_needs_a_catalog(orders):
+    codec = CatalogCodec()
+    body = codec.encode_orders(orders)
+    with pytest.raises(ValueError):
+        codec.decode_orders(body)
@@ -0,0 +1,40 @@
+import pytest
+
+from misc.codec import CODECS, JsonCodec, BinaryCodec
+from order import OrderTable
+
+WAREHOUSES = [
+    ({"id": "center1", "latitude": 38.72, "longitude": -9.14}, [
+        {"id": "order1_1", "latitude": 38.7312345678901, "longitude": -9.1598765432109, "weight": 3},
+        {"id": "order1_2", "latitude": 38.70, "longitude": -9.12, "weight": 5},
+    ]),
+    ({"id": "center2", "latitude": 41.15, "longitude": -8.61}, [
+        {"id": "order2_1", "latitude": 41.16, "longitude": -8.62, "weight": 1},
+    ]),
+]
+
+def fields(order) -> tuple:
+    return (order.id, order.start_position["latitude"], order.start_position["longitude"], order.dest_lat, order.dest_lon, order.weight)
+
+@pytest.fixture
+def orders() -> list:
+    return [order for warehouse, records in WAREHOUSES
+            for order in OrderTable.from_records(records, warehouse["latitude"], warehouse["longitude"])]
+
+# ----------------------------------------------------------------------------------------------
+
+@pytest.mark.parametrize("codec", [JsonCodec(), BinaryCodec()], ids=lambda codec: codec.name)
+def test_orders_round_trip_exactly(codec, orders):
+    decoded = codec.decode_orders(codec.encode_orders(orders))
+    assert [fields(order) for order in decoded] == [fields(order) for order in orders]
+    assert all(order.is_available() for order in decoded)
+
+@pytest.mark.parametrize("codec", CODECS.values(), ids=lambda codec: codec.name)
+def test_ids_round_trip(codec):
+    ids = ["order1_1", "order2_1", "ção_3"]
+    assert codec.decode_ids(codec.encode_ids(ids)) == ids
+    assert codec.decode_ids(codec.encode_ids([])) == []
+
+@pytest.mark.parametrize("codec", [JsonCodec(), BinaryCodec()], ids=lambda codec: codec.name)
+def test_no_orders_round_trip(codec):
+    assert codec.decode_orders(codec.encode_orders([])) == []
@@ -0,0 +1,66 @@
+import math
+import random
+
+import pytest
+
+from misc.clock import VirtualClock
+from misc.distance import geo_distance
+from order import OrderTable
+from warehouse.utils import InventoryDigest, OrdersMatrix
+
+WAREHOUSE = {"latitude": 38.72, "longitude": -9.14}
+
+class Logger:
+    def log(self, message):
+        pass
+
+def matrix_of(size : int, seed : int = 0) -> OrdersMatrix:
+    rng = random.Random(seed)
+    table = OrderTable.from_columns(
+        [f"order{i}" for i in range(size)],
+        WAREHOUSE["latitude"],
+        WAREHOUSE["longitude"],
+        [WAREHOUSE["latitude"] + rng.uniform(-0.05, 0.05) for _ in range(size)],
+        [WAREHOUSE["longitude"] + rng.uniform(-0.05, 0.05) for _ in range(size)],
+        [rng.randint(2, 5) for _ in range(size)]
+    )
+    return OrdersMatrix({order.id: order for order in table}, warehouse_position=WAREHOUSE, clock=VirtualClock())
+
+# ----------------------------------------------------------------------------------------------
+
+@pytest.mark.parametrize("digest", [
+    InventoryDigest("center1", 7, 10, 4, 13, 2, [(38.7, -9.2, 38.75, -9.1, 4)]),
+    InventoryDigest("center2", 0, 0, 0, 0, None, []),
+], ids=["stock", "empty"])
+def test_digest_round_trip(digest):
+    decoded = InventoryDigest.decode(digest.encode())
+    assert [getattr(decoded, name) for name in InventoryDigest.__slots__] == [getattr(digest, name) for name in InventoryDigest.__slots__]
+
+def test_reach_is_the_distance_to_the_closest_cell():
+    digest = InventoryDigest("center1", 1, 2, 2, 4, 2, [(38.70, -9.20, 38.75, -9.10, 1), (39.00, -9.20, 39.10, -9.10, 1)])
+    assert digest.reach(38.72, -9.15) == 0.0 # inside the first cell
+    assert digest.reach(38.60, -9.15) == pytest.approx(geo_distance(38.60, -9.15, 38.70, -9.15))
+    assert digest.reach(38.90, -9.00) == pytest.approx(min(
+        geo_distance(38.90, -9.00, 38.75, -9.10), geo_distance(38.90, -9.00, 39.00, -9.10)
+    ))
+    assert math.isinf(InventoryDigest("center2", 0, 0, 0, 0, None, []).reach(38.72, -9.15))
+
+def test_matrix_digest_summarises_what_can_be_proposed():
+    matrix = matrix_of(100)
+    digest = matrix.digest("center1", 100)
+    assert digest.available == 100
+    assert sum(cell[-1] for cell in digest.cells) == 100
+    assert digest.min_weight == 2
+
+    reserved = matrix.select_orders(WAREHOUSE["latitude"], WAREHOUSE["longitude"], 10, "drone1", Logger())
+    after = matrix.digest("center1", 100)
+    assert after.version > digest.version
+    assert after.available == 100 - len(reserved)
+    assert after.total_weight == digest.total_weight - sum(order.weight for order in reserved)
+    assert sum(cell[-1] for cell in after.cells) == after.available
+    assert after.reach(WAREHOUSE["latitude"], WAREHOUSE["longitude"]) < 10000
+
+def test_digest_cells_stop_at_the_given_depth():
+    matrix = matrix_of(500, seed=1)
+    assert len(matrix.digest("center1", 500, depth=0).cells) == 1
+    assert len(matrix.digest("center1", 500, depth=2).cells) <= 16
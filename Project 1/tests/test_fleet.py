@@ -0,0 +1,90 @@
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from drone.fleet import FleetKinematics, INITIAL_SLOTS
+from drone.flight import FlightLeg
+from misc.clock import VirtualClock
+
+START = {"latitude": 38.72, "longitude": -9.14}
+SPEED = 100.0 # meters per second
+
+def drone(drone_id : str) -> SimpleNamespace:
+    # The fleet only reads the id of a drone to track its flights
+    return SimpleNamespace(params=SimpleNamespace(id=drone_id))
+
+def target(offset : float) -> dict:
+    return {"latitude": START["latitude"] + offset, "longitude": START["longitude"] + offset / 2}
+
+# ----------------------------------------------------------------------------------------------
+
+def test_positions_match_each_flight_leg():
+    async def scenario():
+        fleet = FleetKinematics(None, clock=VirtualClock())
+        legs = [
+            FlightLeg(START, target(0.01), SPEED, 0.0, autonomy=1e6),
+            FlightLeg(START, target(0.05), SPEED, 1.0, autonomy=2000.0), # runs out of battery on the way
+            FlightLeg(START, START, SPEED, 0.0, autonomy=1e6),            # already there
+        ]
+        drones = [drone(f"drone{i}") for i in range(len(legs))]
+        for agent, leg in zip(drones, legs):
+            fleet.add(agent)
+            fleet.take_off(agent, leg)
+
+        for now in (0.0, 0.5, 3.0, 10.0, 25.0, 1000.0):
+            latitudes, longitudes, flown = fleet.positions(now)
+            for i, leg in enumerate(legs):
+                expected = leg.position_at(now)
+                assert latitudes[i] == pytest.approx(expected["latitude"])
+                assert longitudes[i] == pytest.approx(expected["longitude"])
+                assert flown[i] == pytest.approx(leg.distance_at(now))
+    asyncio.run(scenario())
+
+def test_step_wakes_only_the_drones_that_arrived():
+    async def scenario():
+        clock = VirtualClock()
+        fleet = FleetKinematics(None, clock=clock)
+        legs = [FlightLeg(START, target(0.01 * (i + 1)), SPEED, 0.0, autonomy=1e6) for i in range(3)]
+        drones = [drone(f"drone{i}") for i in range(3)]
+        futures = []
+        for agent, leg in zip(drones, legs):
+            fleet.add(agent)
+            futures.append(fleet.take_off(agent, leg))
+
+        assert fleet.step() == []
+        clock.advance_to(legs[0].end_time)
+        assert fleet.step() == [0]
+        assert [future.done() for future in futures] == [True, False, False]
+        assert fleet.step() == [] # a drone is woken up once
+
+        clock.advance_to(legs[2].end_time)
+        assert fleet.step() == [1, 2]
+        assert all(future.done() for future in futures)
+        assert (fleet.ticks, fleet.arrivals) == (4, 3)
+
+        # The next flight of a drone is tracked like the first
+        leg = FlightLeg(target(0.01), START, SPEED, clock.now(), autonomy=1e6)
+        future = fleet.take_off(drones[0], leg)
+        clock.advance_to(leg.end_time)
+        assert fleet.step() == [0] and future.done()
+    asyncio.run(scenario())
+
+def test_arrays_grow_past_the_initial_slots():
+    async def scenario():
+        clock = VirtualClock()
+        fleet = FleetKinematics(None, clock=clock)
+        count = INITIAL_SLOTS * 2 + 1
+        legs = [FlightLeg(START, target(0.001 * (i + 1)), SPEED, 0.0, autonomy=1e6) for i in range(count)]
+        for i, leg in enumerate(legs):
+            agent = drone(f"drone{i}")
+            fleet.add(agent)
+            fleet.take_off(agent, leg)
+
+        latitudes, _, flown = fleet.positions(5.0)
+        assert len(latitudes) == count
+        assert np.allclose(flown, [leg.distance_at(5.0) for leg in legs])
+        clock.advance_to(max(leg.end_time for leg in legs))
+        assert len(fleet.step()) == count
+    asyncio.run(scenario())
@@ -0,0 +1,140 @@
+import random
+
+import pytest
+
+from misc.clock import VirtualClock
+from order import OrderTable
+from warehouse.utils import OrdersMatrix, MAX_CELL_ORDERS, RESERVATION_TIMEOUT
+
+WAREHOUSE = {"latitude": 38.72, "longitude": -9.14}
+
+class Logger:
+    def log(self, message):
+        pass
+
+def random_inventory(rng : random.Random, size : int, spread : float = 0.05) -> dict:
+    table = OrderTable.from_columns(
+        [f"order{i}" for i in range(size)],
+        WAREHOUSE["latitude"],
+        WAREHOUSE["longitude"],
+        [WAREHOUSE["latitude"] + rng.uniform(-spread, spread) for _ in range(size)],
+        [WAREHOUSE["longitude"] + rng.uniform(-spread, spread) for _ in range(size)],
+        [rng.randint(1, 5) for _ in range(size)]
+    )
+    return {order.id: order for order in table}
+
+def accounted(matrix : OrdersMatrix) -> int:
+    return matrix.root.count + sum(len(orders) for orders in matrix.reserved_orders.values())
+
+# ----------------------------------------------------------------------------------------------
+
+@pytest.mark.parametrize("seed", range(5))
+def test_reserve_accept_reject_keep_invariants(seed):
+    rng = random.Random(seed)
+    inventory = random_inventory(rng, 300)
+    matrix = OrdersMatrix(inventory, warehouse_position=WAREHOUSE, clock=VirtualClock())
+    matrix.check_invariants()
+    delivered = 0
+
+    for step in range(200):
+        owner = f"drone{rng.randint(1, 6)}"
+        position = (WAREHOUSE["latitude"] + rng.uniform(-0.05, 0.05), WAREHOUSE["longitude"] + rng.uniform(-0.05, 0.05))
+        if owner not in matrix.reserved_orders:
+            matrix.select_orders(*position, rng.randint(3, 10), owner, Logger())
+        elif rng.random() < 0.5:
+            # Accept some of the orders and return the rest, like WarehouseAgent.accept_proposal
+            reserved = list(matrix.reserved_orders[owner])
+            for order_id in rng.sample(reserved, rng.randint(0, len(reserved))):
+                matrix.remove_order(order_id, owner)
+                delivered += 1
+            matrix.undo_reservations(owner, Logger())
+        else:
+            matrix.undo_reservations(owner, Logger())
+        matrix.check_invariants()
+        assert accounted(matrix) + delivered == len(inventory)
+
+def test_reserved_orders_are_not_offered_again():
+    inventory = random_inventory(random.Random(1), 100)
+    matrix = OrdersMatrix(inventory, warehouse_position=WAREHOUSE, clock=VirtualClock())
+    first = matrix.select_orders(WAREHOUSE["latitude"], WAREHOUSE["longitude"], 10, "drone1", Logger())
+    second = matrix.select_orders(WAREHOUSE["latitude"], WAREHOUSE["longitude"], 10, "drone2", Logger())
+    assert first and second
+    assert not {order.id for order in first} & {order.id for order in second}
+    matrix.check_invariants()
+
+def test_select_bundles_offers_each_order_once():
+    inventory = random_inventory(random.Random(2), 150)
+    matrix = OrdersMatrix(inventory, warehouse_position=WAREHOUSE, clock=VirtualClock())
+    requests = {f"drone{i}": (8, 20000.0) for i in range(5)}
+    bundles = matrix.select_bundles(WAREHOUSE["latitude"], WAREHOUSE["longitude"], requests, Logger())
+    ids = [order.id for bundle in bundles.values() for order in bundle]
+    assert len(ids) == len(set(ids))
+    for owner, bundle in bundles.items():
+        assert set(matrix.reserved_orders.get(owner, {})) == {order.id for order in bundle}
+    matrix.check_invariants()
+
+def test_expired_reservations_return_to_the_matrix():
+    clock = VirtualClock()
+    inventory = random_inventory(random.Random(3), 80)
+    matrix = OrdersMatrix(inventory, warehouse_position=WAREHOUSE, clock=clock)
+    matrix.select_orders(WAREHOUSE["latitude"], WAREHOUSE["longitude"], 10, "drone1", Logger())
+    clock.advance_to(RESERVATION_TIMEOUT / 2)
+    matrix.select_orders(WAREHOUSE["latitude"], WAREHOUSE["longitude"], 10, "drone2", Logger())
+    matrix.check_invariants()
+
+    clock.advance_to(RESERVATION_TIMEOUT + 0.1)
+    assert matrix.check_timeout(Logger()) == ["drone1"]
+    matrix.check_invariants()
+    assert matrix.next_expiry() == pytest.approx(RESERVATION_TIMEOUT * 1.5)
+
+    clock.advance_to(RESERVATION_TIMEOUT * 2)
+    assert matrix.check_timeout(Logger()) == ["drone2"]
+    matrix.check_invariants()
+    assert matrix.root.count == len(inventory)
+    assert matrix.next_expiry() is None
+
+def test_settled_reservations_never_expire():
+    clock = VirtualClock()
+    inventory = random_inventory(random.Random(4), 50)
+    matrix = OrdersMatrix(inventory, warehouse_position=WAREHOUSE, clock=clock)
+    orders = matrix.select_orders(WAREHOUSE["latitude"], WAREHOUSE["longitude"], 10, "drone1", Logger())
+    for order in orders:
+        matrix.remove_order(order.id, "drone1")
+    matrix.undo_reservations("drone1", Logger())
+    clock.advance_to(RESERVATION_TIMEOUT * 2)
+    assert matrix.check_timeout(Logger()) == []
+    matrix.check_invariants()
+    assert matrix.root.count == len(inventory) - len(orders)
+
+# ----------------------------------------------------------------------------------------------
+
+def test_cells_split_as_they_fill_and_merge_as_they_drain():
+    inventory = random_inventory(random.Random(5), 4 * MAX_CELL_ORDERS, spread=0.01)
+    matrix = OrdersMatrix(inventory, warehouse_position=WAREHOUSE, clock=VirtualClock())
+    assert not matrix.root.is_leaf()
+    matrix.check_invariants()
+
+    # Reserve everything, a few orders at a time, until the tree collapses back to a leaf
+    owners = []
+    while matrix.root.count:
+        owner = f"drone{len(owners)}"
+        assert matrix.select_orders(WAREHOUSE["latitude"], WAREHOUSE["longitude"], 10, owner, Logger())
+        owners.append(owner)
+        matrix.check_invariants()
+    assert matrix.root.is_leaf()
+
+    # Returning the orders splits the cells again
+    for owner in owners:
+        matrix.undo_reservations(owner, Logger())
+        matrix.check_invariants()
+    assert not matrix.root.is_leaf()
+    assert matrix.root.count == len(inventory)
+    assert all(len(leaf.orders) <= MAX_CELL_ORDERS for leaf in matrix.root.leaves())
+
+def test_check_invariants_detects_an_order_reserved_and_in_the_matrix():
+    inventory = random_inventory(random.Random(6), 20)
+    matrix = OrdersMatrix(inventory, warehouse_position=WAREHOUSE, clock=VirtualClock())
+    orders = matrix.select_orders(WAREHOUSE["latitude"], WAREHOUSE["longitude"], 10, "drone1", Logger())
+    matrix.root.insert(orders[0])
+    with pytest.raises(Exception):
+        matrix.check_invariants()
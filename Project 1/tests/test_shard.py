@@ -0,0 +1,46 @@
+import pytest
+
+from shard import partition
+
+def warehouse(warehouse_id : str, latitude : float, longitude : float, orders : int) -> tuple[dict, list]:
+    return {"id": warehouse_id, "latitude": latitude, "longitude": longitude}, [{"id": f"{warehouse_id}_{i}"} for i in range(orders)]
+
+# Four warehouses spread east to west, the western ones busier
+WAREHOUSES = [
+    warehouse("w1", 38.7, -9.4, 40),
+    warehouse("w2", 38.8, -9.0, 30),
+    warehouse("w3", 38.6, -8.4, 20),
+    warehouse("w4", 38.7, -8.0, 10),
+]
+DRONES = [{"id": f"drone{i}", "initialPos": f"w{i % 4 + 1}"} for i in range(10)]
+
+def ids(region : list) -> list[str]:
+    return sorted(warehouse["id"] for warehouse, _ in region)
+
+# ----------------------------------------------------------------------------------------------
+
+@pytest.mark.parametrize("shards", [1, 2, 3, 4])
+def test_every_warehouse_and_drone_is_in_one_region(shards):
+    regions = partition(DRONES, WAREHOUSES, shards)
+    assert len(regions) == shards
+    assert sorted(id for _, region in regions for id in ids(region)) == ["w1", "w2", "w3", "w4"]
+    assert sorted(drone["id"] for drones, _ in regions for drone in drones) == sorted(drone["id"] for drone in DRONES)
+    for drones, region in regions:
+        assert {drone["initialPos"] for drone in drones} <= set(ids(region))
+
+def test_regions_are_cut_along_the_wider_side_at_half_the_orders():
+    regions = partition(DRONES, WAREHOUSES, 2)
+    assert [ids(region) for _, region in regions] == [["w1"], ["w2", "w3", "w4"]]
+
+def test_the_busiest_region_is_cut_first():
+    regions = partition(DRONES, WAREHOUSES, 3)
+    assert sorted(ids(region) for _, region in regions) == [["w1"], ["w2"], ["w3", "w4"]]
+
+def test_no_more_regions_than_warehouses():
+    assert len(partition(DRONES, WAREHOUSES, 10)) == len(WAREHOUSES)
+    assert len(partition(DRONES[:1], WAREHOUSES[:1], 4)) == 1
+
+def test_the_scenario_is_left_untouched():
+    warehouses = list(WAREHOUSES)
+    partition(DRONES, warehouses, 3)
+    assert warehouses == WAREHOUSES
@@ -0,0 +1,60 @@
+import random
+
+import pytest
+
+from drone.utils import best_available_orders, combine_orders, closest_order, generate_path, position_distance, \
+    calculate_travel_distance, calculate_capacity_level, utility
+from order import OrderTable
+
+CASES = 300
+
+def exhaustive_best_orders(orders : list, latitude : float, longitude : float, capacity : int, autonomy : float) -> list | None:
+    # The search best_available_orders replaced: every combination that fits, the last best one wins
+    best_set = None
+    best_utility = float('-inf')
+    for order_set in combine_orders(orders, capacity):
+        closest = closest_order(latitude, longitude, order_set)
+        path = generate_path(order_set, closest)
+        travel_distance = position_distance(latitude, longitude, closest.dest_lat, closest.dest_lon) + calculate_travel_distance(path)
+        set_utility = utility(len(order_set), travel_distance, autonomy, calculate_capacity_level(order_set, capacity))
+        if set_utility >= best_utility:
+            best_set = order_set
+            best_utility = set_utility
+    return best_set
+
+def random_case(rng : random.Random) -> tuple:
+    latitude, longitude = 38.72 + rng.uniform(-0.05, 0.05), -9.14 + rng.uniform(-0.05, 0.05)
+    size = rng.randint(1, 9)
+    table = OrderTable.from_columns(
+        [f"order{i}" for i in range(size)],
+        38.72,
+        -9.14,
+        [38.72 + rng.uniform(-0.1, 0.1) for _ in range(size)],
+        [-9.14 + rng.uniform(-0.1, 0.1) for _ in range(size)],
+        [rng.randint(1, 6) for _ in range(size)]
+    )
+    return list(table), latitude, longitude, rng.randint(3, 15), rng.uniform(5000.0, 150000.0)
+
+@pytest.mark.parametrize("seed", range(CASES))
+def test_branch_and_bound_matches_exhaustive_search(seed):
+    orders, latitude, longitude, capacity, autonomy = random_case(random.Random(seed))
+    stats = {}
+    best = best_available_orders(orders, latitude, longitude, capacity, autonomy, time_budget=None, stats=stats)
+    expected = exhaustive_best_orders(orders, latitude, longitude, capacity, autonomy)
+
+    assert not stats["timed_out"]
+    assert [order.id for order in best or []] == [order.id for order in expected or []]
+
+def test_branch_and_bound_prunes():
+    rng = random.Random(CASES)
+    table = OrderTable.from_columns(
+        [f"order{i}" for i in range(14)],
+        38.72,
+        -9.14,
+        [38.72 + rng.uniform(-0.1, 0.1) for _ in range(14)],
+        [-9.14 + rng.uniform(-0.1, 0.1) for _ in range(14)],
+        [rng.randint(1, 6) for _ in range(14)]
+    )
+    stats = {}
+    best_available_orders(list(table), 38.72, -9.14, 12, 60000.0, time_budget=None, stats=stats)
+    assert 0 < stats["evaluated"] < len(combine_orders(list(table), 12))
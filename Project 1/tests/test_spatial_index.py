@@ -0,0 +1,90 @@
+import copy
+import pickle
+import random
+
+import pytest
+
+from misc.distance import geo_distance
+from misc.spatial_index import IndexedPositions, SpatialIndex
+
+def position(latitude : float, longitude : float) -> dict:
+    return {"latitude": latitude, "longitude": longitude}
+
+def random_position(rng : random.Random) -> dict:
+    return position(38.7 + rng.uniform(-0.5, 0.5), -9.1 + rng.uniform(-0.5, 0.5))
+
+def brute_nearest(positions : dict, latitude : float, longitude : float) -> str | None:
+    if not positions:
+        return None
+    return min(positions, key=lambda key: geo_distance(latitude, longitude, positions[key]["latitude"], positions[key]["longitude"]))
+
+def assert_in_sync(positions : IndexedPositions, rng : random.Random) -> None:
+    for _ in range(20):
+        query = random_position(rng)
+        assert positions.nearest(query["latitude"], query["longitude"]) == brute_nearest(positions, query["latitude"], query["longitude"])
+
+# ----------------------------------------------------------------------------------------------
+
+def test_every_mutator_keeps_the_index_in_sync():
+    rng = random.Random(0)
+    positions = IndexedPositions({f"w{i}": random_position(rng) for i in range(10)})
+    assert_in_sync(positions, rng)
+
+    positions["w10"] = random_position(rng)
+    assert_in_sync(positions, rng)
+    positions["w0"] = random_position(rng) # moved
+    assert_in_sync(positions, rng)
+    del positions["w1"]
+    assert_in_sync(positions, rng)
+    positions.pop("w2")
+    assert positions.pop("missing", None) is None
+    assert_in_sync(positions, rng)
+    positions.popitem()
+    assert_in_sync(positions, rng)
+    positions.update({"w11": random_position(rng)}, w12=random_position(rng))
+    positions.update([("w13", random_position(rng))])
+    assert_in_sync(positions, rng)
+    positions.setdefault("w14", random_position(rng))
+    positions.setdefault("w14", random_position(rng)) # already there, nothing changes
+    assert_in_sync(positions, rng)
+    positions |= {"w15": random_position(rng)}
+    assert isinstance(positions, IndexedPositions)
+    assert_in_sync(positions, rng)
+
+    positions.clear()
+    assert positions.nearest(38.7, -9.1) is None
+    positions["w16"] = random_position(rng)
+    assert positions.nearest(38.7, -9.1) == "w16"
+
+@pytest.mark.parametrize("duplicate", [
+    lambda positions: pickle.loads(pickle.dumps(positions)),
+    copy.deepcopy,
+    IndexedPositions.copy
+], ids=["pickle", "deepcopy", "copy"])
+def test_copies_have_their_own_index(duplicate):
+    rng = random.Random(1)
+    positions = IndexedPositions({f"w{i}": random_position(rng) for i in range(10)})
+    copied = duplicate(positions)
+    assert isinstance(copied, IndexedPositions)
+    assert dict(copied) == dict(positions)
+    assert_in_sync(copied, rng)
+
+    # Changing the copy leaves the original alone
+    del copied["w0"]
+    assert "w0" in positions
+    assert_in_sync(copied, rng)
+    assert_in_sync(positions, rng)
+
+def test_spatial_index_queries_match_a_scan():
+    rng = random.Random(2)
+    points = {i: (38.7 + rng.uniform(-1, 1), -9.1 + rng.uniform(-1, 1)) for i in range(200)}
+    index = SpatialIndex(points)
+    for key in range(0, 200, 3):
+        index.remove(key)
+        del points[key]
+    for _ in range(50):
+        latitude, longitude = 38.7 + rng.uniform(-1, 1), -9.1 + rng.uniform(-1, 1)
+        distances = sorted((geo_distance(latitude, longitude, *point), key) for key, point in points.items())
+        assert [key for key, _ in index.k_nearest(latitude, longitude, 5)] == [key for _, key in distances[:5]]
+        within = [key for distance, key in distances if distance <= 20000]
+        assert [key for key, _ in index.within(latitude, longitude, 20000)] == within
@@ -0,0 +1,39 @@
+import pytest
+
+from drone.utils import target_warehouses, TARGET_ALL, TARGET_NEAREST, TARGET_REACH
+from misc.distance import geo_distance
+from misc.spatial_index import IndexedPositions
+
+# Warehouses north of the drone, about 11 km apart
+LATITUDE, LONGITUDE = 38.0, -9.0
+WAREHOUSES = {f"w{i}": {"latitude": LATITUDE + 0.1 * i, "longitude": LONGITUDE} for i in range(1, 9)}
+SPACING = geo_distance(LATITUDE, LONGITUDE, LATITUDE + 0.1, LONGITUDE)
+
+@pytest.fixture(params=[dict, IndexedPositions], ids=["dict", "indexed"])
+def positions(request) -> dict:
+    # The spatial index and the scan of a plain dictionary give the same answers
+    return request.param(WAREHOUSES)
+
+def test_all_asks_every_warehouse(positions):
+    assert sorted(target_warehouses(LATITUDE, LONGITUDE, positions, TARGET_ALL, widening=3)) == sorted(WAREHOUSES)
+
+def test_nearest_doubles_k_with_each_widening(positions):
+    assert target_warehouses(LATITUDE, LONGITUDE, positions, TARGET_NEAREST, k=2) == ["w1", "w2"]
+    assert target_warehouses(LATITUDE, LONGITUDE, positions, TARGET_NEAREST, k=2, widening=1) == ["w1", "w2", "w3", "w4"]
+    assert target_warehouses(LATITUDE, LONGITUDE, positions, TARGET_NEAREST, k=2, widening=5) == [f"w{i}" for i in range(1, 9)]
+
+def test_reach_doubles_the_radius_with_each_widening(positions):
+    radius = 2.5 * SPACING
+    assert target_warehouses(LATITUDE, LONGITUDE, positions, TARGET_REACH, autonomy=radius) == ["w1", "w2"]
+    assert target_warehouses(LATITUDE, LONGITUDE, positions, TARGET_REACH, autonomy=radius, widening=1) == ["w1", "w2", "w3", "w4", "w5"]
+
+def test_reach_falls_back_to_the_nearest_warehouse(positions):
+    assert target_warehouses(LATITUDE, LONGITUDE, positions, TARGET_REACH, autonomy=SPACING / 2) == ["w1"]
+
+def test_no_warehouses_left(positions):
+    positions.clear()
+    assert target_warehouses(LATITUDE, LONGITUDE, positions, TARGET_NEAREST) == []
+
+def test_unknown_policy(positions):
+    with pytest.raises(ValueError):
+        target_warehouses(LATITUDE, LONGITUDE, positions, "closest")